@@ -1,9 +1,10 @@
 from fastapi import APIRouter
-from .endpoints import video_analysis, file, stage_matching
+from .endpoints import video_analysis, file, stage_matching, metrics
 
 api_router = APIRouter()
 api_router.include_router(video_analysis.router)
 api_router.include_router(file.router)
 api_router.include_router(stage_matching.router)
+api_router.include_router(metrics.router)
 
 __all__ = ["api_router"]
\ No newline at end of file
@@ -6,6 +6,7 @@ import os
 
 from app.db.database import get_db
 from app.services.file_service import FileService
+from app.services.fingerprint_service import FingerprintService
 from app.models.video_frame import VideoFrame
 from app.schemas.file_schemas import (
     VideoFileResponse, 
@@ -78,6 +79,33 @@ def delete_video_file(
         raise HTTPException(status_code=404, detail="视频文件不存在")
     return {"message": "视频文件删除成功"}
 
+@router.get("/{file_id}/near-duplicates", summary="查找近似重复的录屏")
+def find_near_duplicate_videos(
+    file_id: int,
+    max_distance: float = Query(0.1, ge=0.0, le=1.0, description="最大归一化汉明距离（默认0.1）"),
+    duration_tolerance: float = Query(0.2, ge=0.0, le=1.0, description="允许的时长相对偏差（默认0.2）"),
+    limit: int = Query(20, ge=1, le=200, description="返回结果数量"),
+    db: Session = Depends(get_db)
+):
+    """基于帧感知哈希序列查找视觉上近似重复的已有录屏"""
+    file_service = FileService(db)
+    video_file = file_service.get_video_file(file_id)
+    if not video_file:
+        raise HTTPException(status_code=404, detail="视频文件不存在")
+    
+    try:
+        fingerprint_service = FingerprintService(db)
+        return fingerprint_service.find_near_duplicates(
+            video_file,
+            max_distance=max_distance,
+            duration_tolerance=duration_tolerance,
+            limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{file_id}/download", summary="下载视频文件")
 def download_video_file(
     file_id: int,
@@ -0,0 +1,61 @@
+import time
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from typing import Dict, Any
+
+from app.config import settings
+from app.utils.metrics import metrics
+from app.services.cache_service import PersistentCache
+from app.services.model_gateway import get_model_gateway
+from app.services.model_call_recorder import get_model_call_recorder
+
+router = APIRouter(prefix="/metrics", tags=["监控指标"])
+
+# 需要统计的持久化缓存命名空间
+CACHE_NAMESPACES = ["vision_stage_analysis", "comparison_report"]
+
+
+@router.get("", summary="Prometheus指标导出", response_class=PlainTextResponse)
+def export_metrics() -> str:
+    """以Prometheus文本格式导出进程内指标"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="指标导出未启用")
+    return metrics.render_prometheus()
+
+
+@router.get("/cache", summary="缓存命中统计")
+def get_cache_stats() -> Dict[str, Any]:
+    """获取各持久化缓存的容量和命中率"""
+    return {
+        "success": True,
+        "caches": [PersistentCache(namespace).stats() for namespace in CACHE_NAMESPACES]
+    }
+
+
+@router.get("/model-gateway", summary="模型网关状态")
+def get_model_gateway_status() -> Dict[str, Any]:
+    """获取模型网关的并发配置和各模型熔断状态"""
+    return {
+        "success": True,
+        "data": get_model_gateway().status()
+    }
+
+
+@router.get("/model-calls", summary="模型调用统计")
+def get_model_call_stats(
+    since_hours: float = Query(24, gt=0, le=24 * 90, description="统计最近多少小时的调用（默认24小时）"),
+    group_by: str = Query("caller", pattern="^(caller|model|kind|outcome)$", description="分组字段")
+) -> Dict[str, Any]:
+    """按调用方、模型、调用类型或结果聚合调用次数、耗时分位数、token、图片数和负载大小"""
+    try:
+        groups = get_model_call_recorder().aggregate(time.time() - since_hours * 3600, group_by)
+        return {
+            "success": True,
+            "data": {
+                "since_hours": since_hours,
+                "group_by": group_by,
+                "groups": groups
+            }
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -6,6 +6,7 @@ from app.db.database import get_db
 from app.services.stage_matching_service import StageMatchingService
 from app.services.video_service import VideoFileService
 from app.schemas.video_schemas import StageMatchingRequest, StageMatchingResponse
+from app.config import settings
 
 router = APIRouter(prefix="/stage-matching", tags=["阶段匹配"])
 
@@ -68,7 +69,7 @@ def get_video_stages_summary(
         # 获取阶段信息
         from app.services.video_service import VideoStageService
         stage_service = VideoStageService(db)
-        stages = stage_service.get_video_stages(video_id)
+        stages = stage_service.get_video_stages(video_file.analysis_source_id)
         
         if not stages:
             return {
@@ -113,6 +114,9 @@ def batch_match_stages(
     """
     批量进行阶段匹配分析
     
+    同一视频的多个查询合并为一次LLM调用，不同视频的请求并发执行（受模型调用并发上限约束）。
+    单次请求数量上限由 stage_matching_batch_limit 配置。
+    
     参数:
     - requests: 多个阶段匹配请求
     
@@ -120,28 +124,15 @@ def batch_match_stages(
     - 批量匹配结果
     """
     try:
-        if len(requests) > 10:
-            raise HTTPException(status_code=400, detail="批量请求数量不能超过10个")
+        if len(requests) > settings.stage_matching_batch_limit:
+            raise HTTPException(
+                status_code=400,
+                detail=f"批量请求数量不能超过{settings.stage_matching_batch_limit}个"
+            )
         
+        # 同一视频的请求合并处理，不同视频并发执行
         matching_service = StageMatchingService(db)
-        video_service = VideoFileService(db)
-        
-        results = []
-        for request in requests:
-            # 检查视频文件是否存在
-            video_file = video_service.get_video_file(request.video_id)
-            if not video_file:
-                results.append({
-                    "success": False,
-                    "user_input": request.user_input,
-                    "video_id": request.video_id,
-                    "error": f"视频文件不存在: {request.video_id}"
-                })
-                continue
-            
-            # 执行匹配
-            result = matching_service.match_stages(request)
-            results.append(result.dict())
+        results = matching_service.match_stages_batch(requests)
         
         return {
             "success": True,
@@ -2,8 +2,11 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import Dict, Any
 
+from app.config import settings
 from app.db.database import get_db
+from app.schemas.video_schemas import RagSearchQuery
 from app.services.ssim_video_service import SSIMVideoAnalysisService
+from app.services.video_rag_service import VideoRAGService
 from app.services.video_service import VideoFileService
 from app.services.simple_feishu_service import SimpleFeishuService
 
@@ -16,6 +19,8 @@ def analyze_video_with_ssim(
     product_name: str = Query(..., description="产品名称（用于向量存储的元数据）"),
     frame_interval: int = Query(30, ge=1, le=300, description="帧间隔（多少帧检测一次，默认30帧）"),
     ssim_threshold: float = Query(0.75, ge=0.1, le=0.99, description="SSIM阈值（默认0.75）"),
+    force: bool = Query(False, description="忽略已有的相同参数分析结果，强制重新分析"),
+    analysis_mode: str = Query("single", pattern="^(single|windowed)$", description="分析模式：single一次性分析，windowed长视频窗口化并发分析"),
     db: Session = Depends(get_db)
 ) -> Dict[str, Any]:
     """
@@ -25,6 +30,8 @@ def analyze_video_with_ssim(
     - video_id: 视频文件ID
     - frame_interval: 帧间隔，每隔多少帧进行一次SSIM检测（默认30帧）
     - ssim_threshold: SSIM相似度阈值，低于此值认为是关键帧（默认0.75）
+    - force: 是否强制重新分析（默认复用内容相同视频的相同参数分析结果）
+    - analysis_mode: 分析模式，windowed 会将关键帧分组为重叠窗口，边解码边并发分析后合并
     
     返回:
     - 包含关键帧信息和阶段分析结果的字典
@@ -42,12 +49,14 @@ def analyze_video_with_ssim(
             video_id=video_id,
             product_name=product_name,
             frame_interval=frame_interval,
-            ssim_threshold=ssim_threshold
+            ssim_threshold=ssim_threshold,
+            force=force,
+            analysis_mode=analysis_mode
         )
         
         return {
             "success": True,
-            "message": "SSIM视频分析完成",
+            "message": "复用已有分析结果" if result.get("reused_analysis") else "SSIM视频分析完成",
             "data": result
         }
         
@@ -57,6 +66,54 @@ def analyze_video_with_ssim(
         raise HTTPException(status_code=500, detail=f"分析过程中发生错误: {str(e)}")
 
 
+@router.post("/ssim-analysis-stream/{video_id}", summary="流式SSIM视频分析")
+def analyze_video_with_ssim_stream(
+    video_id: int,
+    product_name: str = Query(..., description="产品名称（用于向量存储的元数据）"),
+    frame_interval: int = Query(30, ge=1, le=300, description="帧间隔（多少帧检测一次，默认30帧）"),
+    ssim_threshold: float = Query(0.75, ge=0.1, le=0.99, description="SSIM阈值（默认0.75）"),
+    force: bool = Query(False, description="忽略已有的相同参数分析结果，强制重新分析"),
+    analysis_mode: str = Query("single", pattern="^(single|windowed)$", description="分析模式：single一次性分析，windowed长视频窗口化并发分析"),
+    db: Session = Depends(get_db)
+):
+    """
+    流式SSIM视频分析，分析过程中逐步推送进度
+    
+    参数与 /ssim-analysis/{video_id} 相同。
+    
+    返回:
+    - Server-Sent Events (SSE) 流式响应，事件类型包括 start、progress、keyframe、frames_saved、
+      stage_chunk / window_result、stages、stages_saved、rag_stored、result 和 error
+    """
+    from fastapi.responses import StreamingResponse
+    
+    # 检查视频文件是否存在
+    video_service = VideoFileService(db)
+    video_file = video_service.get_video_file(video_id)
+    if not video_file:
+        raise HTTPException(status_code=404, detail=f"视频文件不存在: {video_id}")
+    
+    ssim_service = SSIMVideoAnalysisService(db)
+    
+    return StreamingResponse(
+        ssim_service.analyze_video_with_ssim_stream(
+            video_id=video_id,
+            product_name=product_name,
+            frame_interval=frame_interval,
+            ssim_threshold=ssim_threshold,
+            force=force,
+            analysis_mode=analysis_mode
+        ),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "*"
+        }
+    )
+
+
 @router.delete("/analysis/{video_id}", summary="删除视频分析结果")
 def delete_video_analysis(
     video_id: int,
@@ -78,9 +135,9 @@ def delete_video_analysis(
         if not video_file:
             raise HTTPException(status_code=404, detail=f"视频文件不存在: {video_id}")
         
-        # 删除分析结果
+        # 删除分析结果（重复上传的视频，分析结果归属于源文件）
         ssim_service = SSIMVideoAnalysisService(db)
-        result = ssim_service.delete_video_analysis(video_id)
+        result = ssim_service.delete_video_analysis(video_file.analysis_source_id)
         
         return {
             "success": True,
@@ -116,7 +173,7 @@ def get_video_stages(
         # 获取阶段信息
         from app.services.video_service import VideoStageService
         stage_service = VideoStageService(db)
-        stages = stage_service.get_video_stages(video_id)
+        stages = stage_service.get_video_stages(video_file.analysis_source_id)
         
         stages_data = []
         for stage in stages:
@@ -165,7 +222,7 @@ def get_video_keyframes(
         # 获取关键帧信息
         from app.services.video_service import VideoFrameService
         frame_service = VideoFrameService(db)
-        frames = frame_service.get_video_frames(video_id)
+        frames = frame_service.get_video_frames(video_file.analysis_source_id)
         
         frames_data = []
         for frame in frames:
@@ -229,6 +286,47 @@ def query_similar_video_stages(
         raise HTTPException(status_code=500, detail=f"查询过程中发生错误: {str(e)}")
 
 
+@router.post("/rag/batch-query-similar-stages", summary="批量查询相似视频阶段")
+def batch_query_similar_video_stages(
+    queries: list[RagSearchQuery],
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    """
+    一次请求查询多个相似阶段
+    
+    全部查询文本合并为一次Embedding请求，向量检索按过滤条件分组批量计算。
+    单次请求的查询数上限由 rag_batch_search_limit 配置。
+    
+    参数:
+    - queries: 多个查询，每个包含 query、product_name（可选）、k、similarity_threshold
+    
+    返回:
+    - 按请求顺序排列的各查询结果，格式与单个查询相同
+    """
+    try:
+        if len(queries) > settings.rag_batch_search_limit:
+            raise HTTPException(
+                status_code=400,
+                detail=f"批量查询数量不能超过{settings.rag_batch_search_limit}个"
+            )
+        
+        rag_service = VideoRAGService(db)
+        result = rag_service.query_similar_stages_batch([query.dict() for query in queries])
+        if not result["success"]:
+            raise HTTPException(status_code=500, detail=result["message"])
+        
+        return {
+            "success": True,
+            "message": "批量相似阶段查询完成",
+            "data": result
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量查询过程中发生错误: {str(e)}")
+
+
 @router.post("/rag/generate-comparison-report", summary="生成阶段对比报告")
 def generate_stage_comparison_report(
     query: str = Query(..., description="查询描述"),
@@ -318,6 +416,56 @@ def generate_stage_comparison_report_stream(
     )
 
 
+@router.get("/rag/semantic-cache/stats", summary="语义报告缓存统计")
+def get_semantic_cache_stats(db: Session = Depends(get_db)) -> Dict[str, Any]:
+    """
+    获取对比报告语义缓存的条目数和命中率
+    
+    返回:
+    - 各产品的缓存条目数、命中次数、未命中次数和命中率
+    """
+    try:
+        rag_service = VideoRAGService(db)
+        return {
+            "success": True,
+            "data": rag_service.semantic_cache.stats()
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取缓存统计时发生错误: {str(e)}")
+
+
+@router.delete("/rag/semantic-cache", summary="清除语义报告缓存")
+def clear_semantic_cache(
+    product_name: str = Query(None, description="只清除该产品过滤条件下的缓存（可选，不传则全部清除）"),
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    """
+    清除对比报告语义缓存
+    
+    参数:
+    - product_name: 产品名称（可选）；未过滤产品的报告以空字符串保存
+    
+    返回:
+    - 清除的条目数
+    """
+    try:
+        rag_service = VideoRAGService(db)
+        deleted = rag_service.semantic_cache.clear(product_name)
+        
+        return {
+            "success": True,
+            "message": f"已清除 {deleted} 条语义缓存",
+            "data": {
+                "product_name": product_name,
+                "deleted_count": deleted
+            }
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"清除缓存时发生错误: {str(e)}")
+
+
 @router.post("/feishu/create-document", summary="创建飞书文档")
 def create_feishu_document(
     title: str = Query(..., description="文档标题"),
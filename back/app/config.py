@@ -1,5 +1,5 @@
 import os
-from typing import List
+from typing import List, Dict
 from pydantic_settings import BaseSettings
 
 
@@ -33,12 +33,42 @@ class Settings(BaseSettings):
     ark_model: str = "doubao-1-5-vision-pro-250328"
     ark_embedding_model: str = "doubao-embedding"
     
+    # 视觉请求图片负载配置
+    vision_max_long_edge: int = 1280  # 关键帧缩放后的最大长边（像素）
+    vision_payload_budget_bytes: int = 2 * 1024 * 1024  # 单次请求全部图片Base64总字节预算
+    vision_image_format: str = "jpeg"  # 图片编码格式: jpeg / webp
+    
+    # 长视频窗口化阶段分析配置
+    stage_window_size: int = 8  # 每个窗口的关键帧数
+    stage_window_overlap: int = 2  # 相邻窗口重叠的关键帧数
+    stage_window_concurrency: int = 3  # 同时进行的窗口分析请求数
+    
     # RAG配置
     chroma_persist_directory: str = "./chroma_db"
     chroma_collection_name: str = "video_analysis"
     rag_chunk_size: int = 1000
     rag_chunk_overlap: int = 200
     rag_top_k: int = 5
+    vector_backend: str = "chroma"  # 向量存储后端: chroma / mmap（进程内内存映射索引）
+    mmap_vector_directory: str = "./mmap_vector_db"  # mmap后端的数据目录，每个集合一个子目录
+    mmap_vector_dtype: str = "float32"  # mmap后端向量的存储精度: float32 / float16
+    mmap_ivf_threshold: int = 50000  # 向量数达到该值时启用IVF近似检索，0表示始终精确检索
+    mmap_ivf_nprobe: int = 8  # IVF检索时搜索的聚类数
+    mmap_quantization: str = "none"  # 第一轮检索使用的量化编码: none / int8 / pq
+    mmap_rerank_multiplier: int = 4  # 量化粗排后取 k*该倍数 个候选用原始向量重排
+    mmap_pq_subvectors: int = 64  # PQ的子空间数（需能整除向量维度，否则自动减小）
+    vector_partition_by_product: bool = False  # 按产品把阶段文档拆分到各自的集合（已有数据用 migrate_vector_partitions.py 迁移）
+    vector_partition_search_workers: int = 8  # 跨产品检索时并行检索的分区数
+    hybrid_search_enabled: bool = True  # 阶段检索是否融合词法（BM25字符n-gram）结果
+    hybrid_candidate_multiplier: int = 4  # 词法和向量各召回 k*该倍数 个候选再融合
+    hybrid_rrf_k: int = 60  # 倒数排名融合的平滑常数
+    hybrid_lexical_confident_overlap: float = 1.0  # 查询字符覆盖率达到该值的词法结果视为可信
+    hybrid_lexical_min_hits: int = 3  # 可信词法结果达到 min(k, 该值) 个时跳过向量检索
+    two_level_retrieval_enabled: bool = True  # 对比报告先按视频摘要向量选候选视频，再在其中检索阶段
+    two_level_summary_candidates: int = 50  # 第一层检索的视频摘要数
+    two_level_candidate_videos: int = 12  # 按产品轮流选出的候选视频数
+    two_level_max_stages_per_video: int = 2  # 报告上下文中每个视频最多的阶段数
+    video_summary_max_chars: int = 2000  # 视频摘要文本的最大长度
     
     # 安全配置
     secret_key: str = "your_secret_key_here_change_in_production"
@@ -74,11 +104,48 @@ class Settings(BaseSettings):
     max_concurrent_analyses: int = 5
     retry_attempts: int = 3
     
+    # 模型调用网关配置（单模型并发上限为 max_concurrent_analyses，单次超时为 analysis_timeout）
+    model_gateway_max_concurrency: int = 10  # 所有模型调用的全局并发上限
+    model_gateway_model_limits: Dict[str, int] = {}  # 按模型覆盖并发上限
+    model_gateway_backoff_base: float = 0.5  # 重试退避基数（秒）
+    model_gateway_backoff_max: float = 8.0  # 重试退避上限（秒）
+    model_gateway_breaker_threshold: int = 5  # 连续失败多少次后熔断
+    model_gateway_breaker_cooldown: float = 30.0  # 熔断冷却时间（秒）
+    model_call_recording_enabled: bool = True  # 是否把每次模型调用写入 model_call_records 表
+    model_call_retention_days: int = 30  # 模型调用记录保留天数
+    
+    # 阶段匹配配置（综合分 = 语义权重 * 余弦相似度 + (1 - 语义权重) * 关键词重合度）
+    stage_match_fast_path: bool = True  # 是否启用向量快速匹配
+    stage_match_semantic_weight: float = 0.5
+    stage_match_confident_score: float = 0.6  # 最高分达到该值才视为明确匹配（默认需要关键词命中）
+    stage_match_ambiguity_margin: float = 0.1  # 最高分与次高分的最小差距
+    stage_match_min_score: float = 0.3  # 返回结果的最低综合分
+    stage_match_llm_candidates: int = 5  # 结果不明确时交给LLM判断的候选阶段数
+    stage_matching_batch_limit: int = 50  # 批量匹配单次请求数上限
+    rag_batch_search_limit: int = 100  # 批量相似阶段查询单次请求的查询数上限
+    
     # 缓存配置
     cache_ttl: int = 3600
     cache_max_size: int = 1000
+    comparison_report_cache_ttl: int = 86400  # 对比报告缓存有效期（秒），语料变更时立即失效
+    comparison_report_cache_max_size: int = 500
+    comparison_report_replay_chunk_size: int = 40  # 流式接口回放缓存报告时每个分块的字符数
+    semantic_cache_enabled: bool = True  # 是否启用对比报告的语义缓存
+    semantic_cache_similarity: float = 0.92  # 查询向量余弦相似度达到该值才复用报告
+    semantic_cache_ttl: int = 86400
+    semantic_cache_max_size: int = 1000
+    embedding_cache_enabled: bool = True  # 是否缓存文本向量（按模型和文本哈希）
+    embedding_cache_max_size: int = 200000  # 向量缓存最多保留的条目数，超出时淘汰最早写入的
+    embedding_batch_max_wait_ms: float = 5  # 并发Embedding请求合并的最长等待时间，0表示不合并
+    embedding_batch_max_size: int = 64  # 每个合并请求最多包含的文本数
+    embedding_batch_concurrency: int = 4  # 同时发出的合并请求数
+    
+    # 本地模型替身服务器地址（如 http://127.0.0.1:8100），设置后所有模型和飞书客户端都改用该服务器
+    local_model_server_url: str = ""
     
     # 性能配置
+    http_pool_max_connections: int = 100  # 模型客户端共享连接池的最大连接数
+    http_pool_max_keepalive: int = 20  # 连接池保持的空闲连接数
     worker_processes: int = 4
     worker_connections: int = 1000
     keep_alive: int = 2
@@ -96,6 +163,7 @@ class Settings(BaseSettings):
         env_file = ".env"
         env_file_encoding = "utf-8"
         case_sensitive = False
+        extra = "ignore"
 
 
 # 创建全局配置实例
@@ -1,6 +1,15 @@
 from .video_file import VideoFile
 from .video_frame import VideoFrame, FrameBehaviorDescription
 from .video_stage import VideoStage, StageMetric, VideoComparison, ComparisonDetail
+from .video_analysis_run import VideoAnalysisRun
+from .video_fingerprint import VideoFingerprint
+from .cache_entry import CacheEntry
+from .rag_corpus_state import RagCorpusState
+from .semantic_cache_entry import SemanticCacheEntry
+from .model_call_record import ModelCallRecord
+from .embedding_cache_entry import EmbeddingCacheEntry
+from .vector_collection_alias import VectorCollectionAlias
+from .vector_partition import VectorPartition
 
 __all__ = [
     "VideoFile",
@@ -9,5 +18,14 @@ __all__ = [
     "VideoStage",
     "StageMetric",
     "VideoComparison",
-    "ComparisonDetail"
-]
\ No newline at end of file
+    "ComparisonDetail",
+    "VideoAnalysisRun",
+    "VideoFingerprint",
+    "CacheEntry",
+    "RagCorpusState",
+    "SemanticCacheEntry",
+    "ModelCallRecord",
+    "EmbeddingCacheEntry",
+    "VectorCollectionAlias",
+    "VectorPartition"
+]
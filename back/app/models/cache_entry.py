@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, Float, Text, Index
+from app.db.database import Base
+
+class CacheEntry(Base):
+    __tablename__ = "cache_entries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    namespace = Column(String(100), nullable=False)  # 缓存命名空间（如 vision_stage_analysis）
+    cache_key = Column(String(64), nullable=False)  # 缓存键（SHA-256）
+    value = Column(Text, nullable=False)  # 缓存内容（JSON）
+    created_at = Column(Float, nullable=False)  # 写入时间（Unix时间戳），用于TTL过期
+    last_accessed_at = Column(Float, nullable=False, index=True)  # 最近访问时间，用于容量淘汰
+    hit_count = Column(Integer, nullable=False, default=0)  # 命中次数
+    
+    __table_args__ = (
+        Index("ix_cache_entries_namespace_key", "namespace", "cache_key", unique=True),
+    )
+    
+    def __repr__(self):
+        return f"<CacheEntry(namespace='{self.namespace}', cache_key='{self.cache_key}')>"
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, Float, LargeBinary, Index
+from app.db.database import Base
+
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache_entries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    model = Column(String(100), nullable=False)  # 计算向量所用的模型
+    text_hash = Column(String(64), nullable=False)  # 文本的SHA-256
+    embedding = Column(LargeBinary, nullable=False)  # 向量（float32）
+    created_at = Column(Float, nullable=False, index=True)  # 写入时间（Unix时间戳），用于容量淘汰
+    
+    __table_args__ = (
+        Index("ix_embedding_cache_entries_model_hash", "model", "text_hash", unique=True),
+    )
+    
+    def __repr__(self):
+        return f"<EmbeddingCacheEntry(model='{self.model}', text_hash='{self.text_hash}')>"
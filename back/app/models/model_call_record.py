@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, Float, Index
+from app.db.database import Base
+
+class ModelCallRecord(Base):
+    __tablename__ = "model_call_records"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    caller = Column(String(100), nullable=False)  # 调用方（如 ssim_stage_analysis）
+    model = Column(String(100), nullable=False)  # 模型名称
+    kind = Column(String(20), nullable=False)  # 调用类型：chat / vision / embedding
+    started_at = Column(Float, nullable=False, index=True)  # 开始时间（Unix时间戳）
+    latency_ms = Column(Float, nullable=False)  # 总耗时（毫秒，含排队和重试）
+    queue_ms = Column(Float, nullable=False, default=0.0)  # 等待并发槽位的时间（毫秒）
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    image_count = Column(Integer, nullable=False, default=0)  # 请求中的图片数
+    payload_bytes = Column(Integer, nullable=False, default=0)  # 请求负载字节数（图片Base64或文本）
+    retries = Column(Integer, nullable=False, default=0)  # 重试次数
+    outcome = Column(String(20), nullable=False)  # success / error / cancelled
+    error = Column(String(500), nullable=True)  # 失败原因
+    
+    __table_args__ = (
+        Index("ix_model_call_records_caller_started", "caller", "started_at"),
+    )
+    
+    def __repr__(self):
+        return f"<ModelCallRecord(caller='{self.caller}', model='{self.model}', outcome='{self.outcome}')>"
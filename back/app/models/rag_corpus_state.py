@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class RagCorpusState(Base):
+    __tablename__ = "rag_corpus_states"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(255), nullable=False, unique=True)  # 向量集合名称
+    version = Column(Integer, nullable=False, default=0)  # 语料版本号，集合内容每次变更时递增
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<RagCorpusState(name='{self.name}', version={self.version})>"
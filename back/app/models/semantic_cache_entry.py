@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, Float, Text, LargeBinary, Index
+from app.db.database import Base
+
+class SemanticCacheEntry(Base):
+    __tablename__ = "semantic_cache_entries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    product_name = Column(String(255), nullable=False, default="")  # 产品过滤条件，未过滤时为空字符串
+    similarity_threshold = Column(Float, nullable=False)  # 生成报告时使用的相似度阈值
+    query = Column(Text, nullable=False)  # 原始查询
+    embedding = Column(LargeBinary, nullable=False)  # 查询向量（float32）
+    embedding_model = Column(String(100), nullable=False)  # 计算向量所用的模型
+    report = Column(Text, nullable=False)  # 报告及来源（JSON）
+    source_stage_ids = Column(Text, nullable=False)  # 报告引用的阶段ID列表（JSON），用于校验缓存是否仍然有效
+    created_at = Column(Float, nullable=False)  # 写入时间（Unix时间戳），用于TTL过期
+    last_accessed_at = Column(Float, nullable=False, index=True)  # 最近访问时间，用于容量淘汰
+    hit_count = Column(Integer, nullable=False, default=0)  # 命中次数
+    
+    __table_args__ = (
+        Index("ix_semantic_cache_entries_product", "product_name", "similarity_threshold"),
+    )
+    
+    def __repr__(self):
+        return f"<SemanticCacheEntry(id={self.id}, product_name='{self.product_name}')>"
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class VectorCollectionAlias(Base):
+    __tablename__ = "vector_collection_aliases"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    alias = Column(String(255), nullable=False, unique=True)  # 配置中的集合名称（CHROMA_COLLECTION_NAME）
+    collection_name = Column(String(255), nullable=False)  # 当前实际使用的集合
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<VectorCollectionAlias(alias='{self.alias}', collection_name='{self.collection_name}')>"
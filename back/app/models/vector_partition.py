@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class VectorPartition(Base):
+    __tablename__ = "vector_partitions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    base_collection = Column(String(255), nullable=False, index=True)  # 分区所属的逻辑集合
+    product_name = Column(String(255), nullable=False)  # 产品名称
+    collection_name = Column(String(255), nullable=False)  # 存放该产品文档的物理集合
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        UniqueConstraint("base_collection", "product_name", name="uq_vector_partitions_product"),
+    )
+    
+    def __repr__(self):
+        return f"<VectorPartition(base_collection='{self.base_collection}', product_name='{self.product_name}')>"
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, DateTime, Float, Text, ForeignKey, Index
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class VideoAnalysisRun(Base):
+    __tablename__ = "video_analysis_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    video_file_id = Column(Integer, ForeignKey("video_files.id"), nullable=False)
+    product_name = Column(String(255), nullable=False)  # 产品名称
+    frame_interval = Column(Integer, nullable=False)  # 帧间隔
+    ssim_threshold = Column(Float, nullable=False)  # SSIM阈值
+    analysis_mode = Column(String(20), nullable=True, default="single")  # 分析模式: single / windowed
+    result = Column(Text, nullable=False)  # 分析结果（JSON）
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # 关系
+    video_file = relationship("VideoFile")
+    
+    __table_args__ = (
+        Index("ix_video_analysis_runs_lookup", "video_file_id", "product_name", "frame_interval"),
+    )
+    
+    def __repr__(self):
+        return f"<VideoAnalysisRun(id={self.id}, video_file_id={self.video_file_id})>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Text
+from sqlalchemy import Column, Integer, String, DateTime, Float, Text, ForeignKey
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.database import Base
@@ -17,11 +17,18 @@ class VideoFile(Base):
     fps = Column(Float, nullable=True)  # 帧率
     format = Column(String(50), nullable=True)  # 视频格式
     description = Column(Text, nullable=True)  # 描述
+    content_hash = Column(String(64), nullable=True, index=True)  # 文件内容SHA-256
+    source_file_id = Column(Integer, ForeignKey("video_files.id"), nullable=True, index=True)  # 重复上传时指向首次上传的文件
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     # 关系
     frames = relationship("VideoFrame", back_populates="video_file")
     
+    @property
+    def analysis_source_id(self) -> int:
+        """分析产物（关键帧、阶段、分析记录）实际归属的视频ID"""
+        return self.source_file_id or self.id
+    
     def __repr__(self):
-        return f"<VideoFile(id={self.id}, filename='{self.filename}')>"
\ No newline at end of file
+        return f"<VideoFile(id={self.id}, filename='{self.filename}')>"
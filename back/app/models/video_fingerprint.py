@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, DateTime, Float, LargeBinary, ForeignKey
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class VideoFingerprint(Base):
+    __tablename__ = "video_fingerprints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    video_file_id = Column(Integer, ForeignKey("video_files.id"), nullable=False, unique=True, index=True)
+    duration = Column(Float, nullable=False, index=True)  # 视频时长（秒），用于预筛选候选
+    sample_count = Column(Integer, nullable=False)  # 采样帧数
+    signature = Column(LargeBinary, nullable=False)  # 感知哈希序列（uint64小端序）
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # 关系
+    video_file = relationship("VideoFile")
+
+    def __repr__(self):
+        return f"<VideoFingerprint(id={self.id}, video_file_id={self.video_file_id})>"
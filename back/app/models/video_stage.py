@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Float, Text, ForeignKey, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.database import Base
@@ -13,6 +13,8 @@ class VideoStage(Base):
     end_time = Column(Float, nullable=False)  # 结束时间（秒）
     duration = Column(Float, nullable=False)  # 持续时间（秒）
     description = Column(Text, nullable=True)  # 阶段描述
+    embedding = Column(LargeBinary, nullable=True)  # 阶段文本向量（float32）
+    embedding_model = Column(String(100), nullable=True)  # 计算向量所用的模型
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # 关系
@@ -16,6 +16,8 @@ class VideoFileCreate(VideoFileBase):
     height: Optional[int] = None
     fps: Optional[float] = None
     format: Optional[str] = None
+    content_hash: Optional[str] = None
+    source_file_id: Optional[int] = None
 
 class VideoFileUpdate(BaseModel):
     filename: Optional[str] = None
@@ -30,6 +32,8 @@ class VideoFileResponse(VideoFileBase):
     height: Optional[int] = None
     fps: Optional[float] = None
     format: Optional[str] = None
+    content_hash: Optional[str] = None
+    source_file_id: Optional[int] = None  # 重复上传时指向首次上传的文件
     created_at: datetime
     updated_at: Optional[datetime] = None
     
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional, List
 
@@ -122,4 +122,12 @@ class StageMatchingResponse(BaseModel):
     video_id: int
     matched_stages: List[MatchedStage]
     total_matches: int
-    analysis_summary: str
\ No newline at end of file
+    analysis_summary: str
+    match_method: str = "llm"  # 匹配方式：embedding（向量快速匹配）/ llm / none
+
+# RAG batch search schemas
+class RagSearchQuery(BaseModel):
+    query: str
+    product_name: Optional[str] = None
+    k: int = Field(5, ge=1, le=20)
+    similarity_threshold: float = Field(0.7, ge=0.0, le=1.0)
@@ -0,0 +1,143 @@
+import os
+import threading
+import httpx
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+from volcenginesdkarkruntime import Ark
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+from app.services.model_gateway import get_model_gateway
+from app.services.embedding_cache import EmbeddingCache, text_hash
+from app.services.cache_service import model_identity
+from app.services.embedding_batcher import EmbeddingMicroBatcher
+from app.config import settings
+
+
+class ArkEmbeddings(Embeddings):
+    """Ark embedding model integration."""
+    
+    def __init__(self, model: str = "doubao-embedding-large-text-250515",
+                 http_client: Optional[httpx.Client] = None,
+                 base_url: Optional[str] = None, api_key: Optional[str] = None):
+        # 重试由模型网关统一处理
+        client_kwargs = {"base_url": base_url} if base_url else {}
+        self.client = Ark(
+            api_key=api_key or os.getenv("ARK_API_KEY"),
+            timeout=settings.analysis_timeout,
+            max_retries=0,
+            http_client=http_client,
+            **client_kwargs
+        )
+        self.model = model
+        # 缓存和已保存向量按模型和接口地址区分
+        self.identity = model_identity(model, base_url)
+        self.gateway = get_model_gateway()
+        self.cache = EmbeddingCache(self.identity) if settings.embedding_cache_enabled else None
+        # 正在请求中的文本：文本哈希 -> Future，并发调用方的相同文本只请求一次
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        # 并发调用方的未命中文本合并为批量请求；等待时间为0时直接请求
+        self.batcher = None
+        if settings.embedding_batch_max_wait_ms > 0:
+            self.batcher = EmbeddingMicroBatcher(
+                self._request_embeddings,
+                max_batch_size=settings.embedding_batch_max_size,
+                max_wait_ms=settings.embedding_batch_max_wait_ms,
+                concurrency=settings.embedding_batch_concurrency
+            )
+    
+    def _create_embeddings(self, texts: List[str], caller: str):
+        return self.gateway.call(
+            self.model,
+            lambda: self.client.embeddings.create(
+                model=self.model,
+                input=texts,
+                encoding_format="float",
+            ),
+            caller=caller,
+            kind="embedding",
+            payload_bytes=sum(len(text.encode("utf-8")) for text in texts)
+        )
+    
+    def _request_embeddings(self, texts: List[str], caller: str) -> List[List[float]]:
+        resp = self._create_embeddings(texts, caller=caller)
+        return [item.embedding for item in resp.data]
+    
+    def _embed(self, texts: List[str], caller: str) -> List[List[float]]:
+        """先查缓存，未命中的文本交给微批处理器与其他调用方的文本合并请求
+
+        其他调用方正在请求的相同文本不重复请求，等待其结果即可。
+        """
+        if not texts:
+            return []
+
+        keys = [text_hash(text) for text in texts]
+        vectors = self.cache.get_many(keys) if self.cache else {}
+
+        owned: Dict[str, Tuple[str, Future]] = {}
+        waiting: Dict[str, Future] = {}
+        with self._inflight_lock:
+            for key, text in zip(keys, texts):
+                if key in vectors or key in owned or key in waiting:
+                    continue
+                future = self._inflight.get(key)
+                if future is not None:
+                    waiting[key] = future
+                else:
+                    future = Future()
+                    self._inflight[key] = future
+                    owned[key] = (text, future)
+
+        if owned:
+            try:
+                missing = [text for text, _ in owned.values()]
+                if self.batcher is not None:
+                    embeddings = self.batcher.embed(missing, caller)
+                else:
+                    embeddings = self._request_embeddings(missing, caller)
+                fresh = dict(zip(owned, embeddings))
+            except Exception as e:
+                self._release(owned, error=e)
+                raise
+
+            # 先写缓存再释放，之后到达的调用方可以直接命中缓存
+            if self.cache:
+                try:
+                    self.cache.put_many(fresh)
+                except Exception as e:
+                    print(f"写入向量缓存失败: {str(e)}")
+            self._release(owned, results=fresh)
+            vectors.update(fresh)
+
+        for key, future in waiting.items():
+            vectors[key] = future.result()
+        return [vectors[key] for key in keys]
+    
+    def _release(self, owned: Dict[str, Tuple[str, Future]], results: Optional[Dict[str, List[float]]] = None,
+                 error: Optional[Exception] = None):
+        """通知等待中的调用方并移除请求中标记"""
+        for key, (_, future) in owned.items():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[key])
+        with self._inflight_lock:
+            for key in owned:
+                self._inflight.pop(key, None)
+    
+    def close(self):
+        """停止微批处理器"""
+        if self.batcher is not None:
+            self.batcher.close()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed search docs."""
+        return self._embed(texts, caller="embed_documents")
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed query text."""
+        return self._embed([text], caller="embed_query")[0]
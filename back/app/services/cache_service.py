@@ -0,0 +1,165 @@
+import json
+import time
+import hashlib
+from typing import Any, Dict, Optional
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.db.database import SessionLocal
+from app.models.cache_entry import CacheEntry
+from app.utils.metrics import metrics
+
+metrics.describe("cache_requests_total", "持久化缓存的查询次数（按命名空间和命中结果）")
+metrics.describe("cache_evictions_total", "持久化缓存淘汰的条目数（按命名空间和原因）")
+
+
+def make_cache_key(*parts: Any) -> str:
+    """由若干可JSON序列化的部分生成稳定的缓存键"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def model_identity(model: str, base_url: Optional[str] = None) -> str:
+    """缓存键和向量记录中使用的模型标识
+
+    接口地址不是默认的Ark地址时（如本地替身服务器）附加地址，
+    避免替身返回的结果与真实模型的结果共用缓存。
+    """
+    if base_url and base_url.rstrip("/") != settings.ark_base_url.rstrip("/"):
+        return f"{model}@{base_url.rstrip('/')}"
+    return model
+
+
+class PersistentCache:
+    """基于数据库表的持久化缓存，支持TTL过期和按最近访问时间的容量淘汰
+
+    每次读写使用独立的数据库会话，不影响调用方的事务。
+    未指定TTL和容量时，优先使用配置项 <namespace>_cache_ttl / <namespace>_cache_max_size，
+    没有单独配置的命名空间使用 cache_ttl / cache_max_size。
+    """
+
+    def __init__(self, namespace: str, ttl: Optional[int] = None, max_size: Optional[int] = None):
+        self.namespace = namespace
+        if ttl is None:
+            ttl = getattr(settings, f"{namespace}_cache_ttl", settings.cache_ttl)
+        if max_size is None:
+            max_size = getattr(settings, f"{namespace}_cache_max_size", settings.cache_max_size)
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存，过期或不存在时返回None"""
+        now = time.time()
+        db = SessionLocal()
+        try:
+            entry = db.query(CacheEntry).filter(
+                CacheEntry.namespace == self.namespace,
+                CacheEntry.cache_key == key
+            ).first()
+
+            if entry and now - entry.created_at > self.ttl:
+                db.delete(entry)
+                db.commit()
+                metrics.inc("cache_evictions_total", namespace=self.namespace, reason="ttl")
+                entry = None
+
+            if not entry:
+                metrics.inc("cache_requests_total", namespace=self.namespace, result="miss")
+                return None
+
+            entry.last_accessed_at = now
+            entry.hit_count += 1
+            value = entry.value
+            db.commit()
+            metrics.inc("cache_requests_total", namespace=self.namespace, result="hit")
+            return json.loads(value)
+        finally:
+            db.close()
+
+    def set(self, key: str, value: Any):
+        """写入缓存，并清理过期和超出容量的条目"""
+        now = time.time()
+        db = SessionLocal()
+        try:
+            entry = db.query(CacheEntry).filter(
+                CacheEntry.namespace == self.namespace,
+                CacheEntry.cache_key == key
+            ).first()
+            if not entry:
+                entry = CacheEntry(namespace=self.namespace, cache_key=key, hit_count=0)
+                db.add(entry)
+            entry.value = json.dumps(value, ensure_ascii=False)
+            entry.created_at = now
+            entry.last_accessed_at = now
+            db.flush()
+
+            self._evict(db, now)
+            db.commit()
+        except IntegrityError:
+            # 并发写入同一键时以先写入者为准
+            db.rollback()
+        finally:
+            db.close()
+
+    def delete(self, key: str):
+        """删除单个缓存条目"""
+        db = SessionLocal()
+        try:
+            db.query(CacheEntry).filter(
+                CacheEntry.namespace == self.namespace,
+                CacheEntry.cache_key == key
+            ).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def clear(self) -> int:
+        """清空当前命名空间"""
+        db = SessionLocal()
+        try:
+            deleted = db.query(CacheEntry).filter(CacheEntry.namespace == self.namespace).delete()
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def _evict(self, db, now: float):
+        """淘汰过期条目，并按最近访问时间淘汰超出容量的条目"""
+        expired = db.query(CacheEntry).filter(
+            CacheEntry.namespace == self.namespace,
+            CacheEntry.created_at < now - self.ttl
+        ).delete(synchronize_session=False)
+        if expired:
+            metrics.inc("cache_evictions_total", expired, namespace=self.namespace, reason="ttl")
+
+        size = db.query(CacheEntry).filter(CacheEntry.namespace == self.namespace).count()
+        overflow = size - self.max_size
+        if overflow > 0:
+            stale_ids = [
+                row[0] for row in db.query(CacheEntry.id).filter(
+                    CacheEntry.namespace == self.namespace
+                ).order_by(CacheEntry.last_accessed_at).limit(overflow).all()
+            ]
+            db.query(CacheEntry).filter(CacheEntry.id.in_(stale_ids)).delete(synchronize_session=False)
+            metrics.inc("cache_evictions_total", len(stale_ids), namespace=self.namespace, reason="size")
+
+    def stats(self) -> Dict[str, Any]:
+        """当前命名空间的缓存统计"""
+        hits = metrics.get_counter("cache_requests_total", namespace=self.namespace, result="hit")
+        misses = metrics.get_counter("cache_requests_total", namespace=self.namespace, result="miss")
+        db = SessionLocal()
+        try:
+            size = db.query(CacheEntry).filter(CacheEntry.namespace == self.namespace).count()
+        finally:
+            db.close()
+
+        total = hits + misses
+        return {
+            "namespace": self.namespace,
+            "size": size,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": int(hits),
+            "misses": int(misses),
+            "hit_rate": round(hits / total, 4) if total else 0.0
+        }
@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+import httpx
+from typing import Any, Callable, Dict, Optional
+from langchain_openai import ChatOpenAI
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+from app.config import settings
+from app.services.ark_embeddings import ArkEmbeddings
+from app.services.vector_backend import VectorBackend, create_vector_backend
+from app.services.collection_alias import resolve_collection
+from app.services.partitioned_vector_store import PartitionedVectorBackend, list_partitions
+
+ARK_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+# 未分区的集合每隔该秒数重新检查是否已有产品分区（迁移脚本可能在服务运行期间创建分区）
+PARTITION_CHECK_INTERVAL = 10.0
+
+
+class ClientRegistry:
+    """进程内共享的模型客户端和向量存储
+
+    所有客户端首次使用时创建一次，之后各请求复用，底层共享带连接池的HTTP客户端。
+    ChatOpenAI、Ark 和 Chroma 客户端均可在多线程间共享。
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clients: Dict[str, Any] = {}
+        # 集合名称 -> 最近一次确认尚未分区的时间
+        self._unpartitioned_checked: Dict[str, float] = {}
+    
+    def _get_or_create(self, name: str, factory: Callable[[], Any]) -> Any:
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = factory()
+                    self._clients[name] = client
+        return client
+    
+    @property
+    def http_client(self) -> httpx.Client:
+        """带连接池的共享HTTP客户端"""
+        return self._get_or_create("http_client", lambda: httpx.Client(
+            timeout=settings.analysis_timeout,
+            limits=httpx.Limits(
+                max_connections=settings.http_pool_max_connections,
+                max_keepalive_connections=settings.http_pool_max_keepalive
+            )
+        ))
+    
+    @staticmethod
+    def _api_base(default: str) -> str:
+        """模型接口地址，配置了本地替身服务器时统一指向它"""
+        if settings.local_model_server_url:
+            return f"{settings.local_model_server_url.rstrip('/')}/api/v3"
+        return default
+    
+    @staticmethod
+    def _api_key() -> Optional[str]:
+        return os.getenv("ARK_API_KEY") or ("local" if settings.local_model_server_url else None)
+    
+    def _create_chat_model(self, model_name: str, api_base: str) -> ChatOpenAI:
+        return ChatOpenAI(
+            model_name=model_name,
+            openai_api_key=self._api_key(),
+            openai_api_base=self._api_base(api_base),
+            request_timeout=settings.analysis_timeout,
+            max_retries=0,  # 重试由模型网关统一处理
+            stream_usage=True,  # 流式响应也返回token用量，用于调用记录
+            http_client=self.http_client,
+        )
+    
+    @property
+    def vision_llm(self) -> ChatOpenAI:
+        """视觉分析模型（关键帧阶段分析）"""
+        return self._get_or_create("vision_llm", lambda: self._create_chat_model(
+            os.getenv("ARK_MODEL", "doubao-1-5-vision-pro-250328"),
+            os.getenv("ARK_BASE_URL", ARK_BASE_URL)
+        ))
+    
+    @property
+    def text_llm(self) -> ChatOpenAI:
+        """文本模型（对比报告、阶段匹配）"""
+        return self._get_or_create("text_llm", lambda: self._create_chat_model(
+            os.getenv("LLM_MODEL_NAME", "doubao-seed-1-6-250615"),
+            os.getenv("ARK_API_BASE", ARK_BASE_URL)
+        ))
+    
+    @property
+    def embeddings(self) -> ArkEmbeddings:
+        """Ark Embedding 客户端"""
+        return self._get_or_create("embeddings", lambda: ArkEmbeddings(
+            http_client=self.http_client,
+            base_url=self._api_base(ARK_BASE_URL),
+            api_key=self._api_key()
+        ))
+    
+    @property
+    def collection_alias(self) -> str:
+        """配置的向量集合名称"""
+        return os.getenv("CHROMA_COLLECTION_NAME", "video_analysis_collection")
+    
+    @property
+    def collection_name(self) -> str:
+        """当前使用的向量集合（重建索引后可切换到新集合，见 reindex_vector_store.py）"""
+        return resolve_collection(self.collection_alias)
+    
+    def open_collection(self, collection_name: str) -> VectorBackend:
+        """单个物理集合（每个集合只打开一次），后端由配置项 vector_backend 决定"""
+        return self._get_or_create(f"collection:{collection_name}",
+                                   lambda: create_vector_backend(collection_name, self.embeddings))
+    
+    def get_vector_store(self, collection_name: Optional[str] = None) -> VectorBackend:
+        """指定集合的向量存储
+        
+        启用 vector_partition_by_product 或集合已有产品分区时返回按产品分区的存储。
+        未分区的集合每隔 PARTITION_CHECK_INTERVAL 秒重新检查，服务运行期间执行
+        migrate_vector_partitions.py 后无需重启即可切换到分区存储；出现分区后不再检查。
+        """
+        name = collection_name or self.collection_name
+        if settings.vector_partition_by_product or f"partitioned_store:{name}" in self._clients:
+            return self.get_partitioned_vector_store(name)
+        
+        checked_at = self._unpartitioned_checked.get(name)
+        if checked_at is None or time.monotonic() - checked_at >= PARTITION_CHECK_INTERVAL:
+            if list_partitions(name):
+                return self.get_partitioned_vector_store(name)
+            self._unpartitioned_checked[name] = time.monotonic()
+        return self.open_collection(name)
+    
+    def get_partitioned_vector_store(self, collection_name: str) -> PartitionedVectorBackend:
+        """按产品分区的存储（不受配置项影响，迁移脚本使用）"""
+        return self._get_or_create(f"partitioned_store:{collection_name}", lambda: PartitionedVectorBackend(
+            collection_name, self.open_collection, self.embeddings
+        ))
+    
+    @property
+    def vector_store(self) -> VectorBackend:
+        """默认集合的向量存储"""
+        return self.get_vector_store()
+    
+    def warm_up(self):
+        """预先创建全部客户端，避免首个请求承担初始化开销"""
+        for name in ("vision_llm", "text_llm", "embeddings", "vector_store"):
+            getattr(self, name)
+    
+    def close(self):
+        """停止Embedding微批处理器和分区检索线程池，并关闭共享的HTTP连接池"""
+        with self._lock:
+            for name, client in self._clients.items():
+                if name.startswith("partitioned_store:"):
+                    client.close()
+            embeddings = self._clients.get("embeddings")
+            if embeddings is not None:
+                embeddings.close()
+            http_client = self._clients.get("http_client")
+            if http_client is not None:
+                http_client.close()
+            self._clients.clear()
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_client_registry() -> ClientRegistry:
+    """获取进程内共享的客户端注册表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ClientRegistry()
+    return _registry
+
+
+def close_client_registry():
+    """关闭并丢弃共享客户端（应用关闭时调用）"""
+    global _registry
+    with _registry_lock:
+        if _registry is not None:
+            _registry.close()
+            _registry = None
@@ -0,0 +1,49 @@
+from typing import Optional
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.db.database import SessionLocal
+from app.models.vector_collection_alias import VectorCollectionAlias
+
+
+def resolve_collection(alias: str) -> str:
+    """配置的集合名称当前指向的实际集合，未切换过时即为自身"""
+    db = SessionLocal()
+    try:
+        target = db.query(VectorCollectionAlias.collection_name).filter(
+            VectorCollectionAlias.alias == alias
+        ).scalar()
+        return target or alias
+    except OperationalError:
+        # 表尚未创建（create_tables 之前）
+        return alias
+    finally:
+        db.close()
+
+
+def switch_collection(alias: str, collection_name: str) -> Optional[str]:
+    """把配置的集合名称原子地切换到新集合，返回切换前的实际集合
+
+    切换后新建的服务实例立即使用新集合，进行中的请求继续使用旧集合直至完成。
+    """
+    db = SessionLocal()
+    try:
+        entry = db.query(VectorCollectionAlias).filter(VectorCollectionAlias.alias == alias).first()
+        previous = entry.collection_name if entry else alias
+        if entry:
+            entry.collection_name = collection_name
+        else:
+            db.add(VectorCollectionAlias(alias=alias, collection_name=collection_name))
+        try:
+            db.commit()
+        except IntegrityError:
+            # 并发创建同一别名时改为更新
+            db.rollback()
+            previous = resolve_collection(alias)
+            db.query(VectorCollectionAlias).filter(VectorCollectionAlias.alias == alias).update(
+                {VectorCollectionAlias.collection_name: collection_name},
+                synchronize_session=False
+            )
+            db.commit()
+        return previous
+    finally:
+        db.close()
@@ -0,0 +1,42 @@
+from sqlalchemy.exc import IntegrityError
+
+from app.db.database import SessionLocal
+from app.models.rag_corpus_state import RagCorpusState
+
+
+def get_corpus_version(name: str) -> int:
+    """获取向量集合当前的语料版本号，从未变更过时为0"""
+    db = SessionLocal()
+    try:
+        state = db.query(RagCorpusState).filter(RagCorpusState.name == name).first()
+        return state.version if state else 0
+    finally:
+        db.close()
+
+
+def bump_corpus_version(name: str) -> int:
+    """向量集合内容变更后递增语料版本号，使依赖旧语料的缓存失效
+
+    使用独立的数据库会话，并以单条UPDATE原子递增。
+    """
+    db = SessionLocal()
+    try:
+        updated = db.query(RagCorpusState).filter(RagCorpusState.name == name).update(
+            {RagCorpusState.version: RagCorpusState.version + 1},
+            synchronize_session=False
+        )
+        if not updated:
+            db.add(RagCorpusState(name=name, version=1))
+        try:
+            db.commit()
+        except IntegrityError:
+            # 并发创建同一集合的记录时改为递增
+            db.rollback()
+            db.query(RagCorpusState).filter(RagCorpusState.name == name).update(
+                {RagCorpusState.version: RagCorpusState.version + 1},
+                synchronize_session=False
+            )
+            db.commit()
+        return db.query(RagCorpusState.version).filter(RagCorpusState.name == name).scalar()
+    finally:
+        db.close()
@@ -0,0 +1,98 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from app.utils.metrics import metrics
+
+metrics.describe("embedding_batches_total", "微批合并后发出的Embedding请求数（按触发原因: size/timeout）")
+metrics.describe("embedding_batch_texts", "每个合并请求包含的文本数")
+metrics.describe("embedding_batch_wait_seconds", "文本在微批队列中等待的时间")
+
+# (文本, 调用方, 结果, 入队时间)
+_Pending = Tuple[str, str, Future, float]
+
+
+class EmbeddingMicroBatcher:
+    """把并发的Embedding请求合并为批量请求
+
+    第一条文本入队后最多等待 max_wait_ms，或凑满 max_batch_size 条时立即发出；
+    批量请求在线程池中执行，结果按顺序分发给各调用方的 Future。
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str], str], List[List[float]]],
+                 max_batch_size: int = 64, max_wait_ms: float = 5, concurrency: int = 4):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: List[_Pending] = []
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embedding-batch")
+        self._closed = False
+        self._worker: Optional[threading.Thread] = None
+
+    def submit(self, texts: List[str], caller: str) -> List[Future]:
+        """提交一组文本，返回每条文本对应的 Future（结果为向量）"""
+        futures = [Future() for _ in texts]
+        now = time.monotonic()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Embedding微批处理器已关闭")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+            self._queue.extend((text, caller, future, now) for text, future in zip(texts, futures))
+            self._condition.notify()
+        return futures
+
+    def embed(self, texts: List[str], caller: str) -> List[List[float]]:
+        """提交并等待结果"""
+        return [future.result() for future in self.submit(texts, caller)]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if self._closed and not self._queue:
+                    return
+
+                deadline = self._queue[0][3] + self.max_wait
+                while len(self._queue) < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = self._queue[:self.max_batch_size]
+                del self._queue[:self.max_batch_size]
+
+            trigger = "size" if len(batch) >= self.max_batch_size else "timeout"
+            metrics.inc("embedding_batches_total", trigger=trigger)
+            metrics.observe("embedding_batch_texts", len(batch))
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: List[_Pending]):
+        now = time.monotonic()
+        for _, _, _, enqueued_at in batch:
+            metrics.observe("embedding_batch_wait_seconds", now - enqueued_at)
+
+        callers = {caller for _, caller, _, _ in batch}
+        caller = callers.pop() if len(callers) == 1 else "micro_batch"
+        try:
+            vectors = self.embed_batch([text for text, _, _, _ in batch], caller)
+        except Exception as e:
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future, _), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def close(self):
+        """发出剩余的请求后停止"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+        self._executor.shutdown(wait=True)
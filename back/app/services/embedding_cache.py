@@ -0,0 +1,100 @@
+import hashlib
+import time
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.db.database import SessionLocal
+from app.models.embedding_cache_entry import EmbeddingCacheEntry
+from app.utils.metrics import metrics
+from app.utils.text_similarity import embedding_to_bytes, embedding_from_bytes
+
+metrics.describe("embedding_cache_requests_total", "文本向量缓存的查询条数（按模型和命中结果）")
+metrics.describe("embedding_cache_evictions_total", "文本向量缓存淘汰的条目数")
+
+# SQLite 单条语句的参数个数有限，IN 查询按批执行
+_QUERY_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    """文本内容的SHA-256"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """按（模型标识, 文本哈希）持久化的文本向量缓存
+
+    同一模型对同一文本的向量是确定的，因此条目不过期，只在超出容量时淘汰最早写入的。
+    每次读写使用独立的数据库会话，不影响调用方的事务。
+    """
+
+    def __init__(self, model: str, max_size: Optional[int] = None):
+        self.model = model
+        self.max_size = max_size if max_size is not None else settings.embedding_cache_max_size
+
+    def get_many(self, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        """批量读取向量，返回 {文本哈希: 向量}，未缓存的哈希不在结果中"""
+        hashes = list(dict.fromkeys(hashes))
+        found: Dict[str, List[float]] = {}
+        if not hashes:
+            return found
+
+        db = SessionLocal()
+        try:
+            for start in range(0, len(hashes), _QUERY_BATCH):
+                rows = db.query(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.embedding).filter(
+                    EmbeddingCacheEntry.model == self.model,
+                    EmbeddingCacheEntry.text_hash.in_(hashes[start:start + _QUERY_BATCH])
+                ).all()
+                for key, blob in rows:
+                    found[key] = embedding_from_bytes(blob).tolist()
+        finally:
+            db.close()
+
+        metrics.inc("embedding_cache_requests_total", len(found), model=self.model, result="hit")
+        metrics.inc("embedding_cache_requests_total", len(hashes) - len(found), model=self.model, result="miss")
+        return found
+
+    def put_many(self, vectors: Dict[str, List[float]]):
+        """批量写入向量，并淘汰超出容量的条目"""
+        if not vectors:
+            return
+
+        now = time.time()
+        db = SessionLocal()
+        try:
+            db.add_all([
+                EmbeddingCacheEntry(model=self.model, text_hash=key, embedding=embedding_to_bytes(vector), created_at=now)
+                for key, vector in vectors.items()
+            ])
+            db.flush()
+            self._evict(db)
+            db.commit()
+        except IntegrityError:
+            # 其他进程已写入相同文本，向量相同，忽略即可
+            db.rollback()
+        finally:
+            db.close()
+
+    def _evict(self, db):
+        overflow = db.query(EmbeddingCacheEntry).count() - self.max_size
+        if overflow > 0:
+            stale_ids = [
+                row[0] for row in db.query(EmbeddingCacheEntry.id).order_by(
+                    EmbeddingCacheEntry.created_at
+                ).limit(overflow).all()
+            ]
+            db.query(EmbeddingCacheEntry).filter(
+                EmbeddingCacheEntry.id.in_(stale_ids)
+            ).delete(synchronize_session=False)
+            metrics.inc("embedding_cache_evictions_total", len(stale_ids))
+
+    def clear(self) -> int:
+        """清空当前模型的缓存"""
+        db = SessionLocal()
+        try:
+            deleted = db.query(EmbeddingCacheEntry).filter(EmbeddingCacheEntry.model == self.model).delete()
+            db.commit()
+            return deleted
+        finally:
+            db.close()
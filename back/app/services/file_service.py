@@ -1,15 +1,21 @@
 import os
 import cv2
-import shutil
+import hashlib
 from typing import List, Optional
 from sqlalchemy.orm import Session
 from fastapi import UploadFile, HTTPException
 from app.models.video_file import VideoFile
 from app.models.video_frame import VideoFrame
+from app.models.video_stage import VideoStage
+from app.models.video_analysis_run import VideoAnalysisRun
+from app.models.video_fingerprint import VideoFingerprint
 from app.schemas.file_schemas import VideoFileCreate, VideoFileUpdate, FrameExtractionServiceRequest
 from app.utils.frame_extractor import VideoFrameExtractor
+from app.services.fingerprint_service import FingerprintService
 
 class FileService:
+    HASH_CHUNK_SIZE = 1024 * 1024
+    
     def __init__(self, db: Session):
         self.db = db
         self.upload_dir = "static/files"
@@ -31,33 +37,92 @@ class FileService:
         unique_filename = f"{uuid.uuid4()}{file_extension}"
         file_path = os.path.join(self.upload_dir, unique_filename)
         
-        # 保存文件
+        # 保存文件，同时计算内容哈希
+        hasher = hashlib.sha256()
         try:
             with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+                while chunk := file.file.read(self.HASH_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    buffer.write(chunk)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
         
-        # 获取文件信息
+        content_hash = hasher.hexdigest()
         file_size = os.path.getsize(file_path)
-        video_info = self._get_video_info(file_path)
         
-        # 创建数据库记录
-        video_file_data = VideoFileCreate(
-            filename=unique_filename,
-            original_filename=file.filename,
-            file_path=file_path,
-            file_size=file_size,
-            **video_info
-        )
+        # 内容重复的上传共享已有文件及其分析结果
+        source_file = self.find_file_by_hash(content_hash, file_size)
+        if source_file:
+            os.remove(file_path)
+            video_file_data = VideoFileCreate(
+                filename=source_file.filename,
+                original_filename=file.filename,
+                file_path=source_file.file_path,
+                file_size=source_file.file_size,
+                duration=source_file.duration,
+                width=source_file.width,
+                height=source_file.height,
+                fps=source_file.fps,
+                format=source_file.format,
+                content_hash=content_hash,
+                source_file_id=source_file.id
+            )
+        else:
+            # 获取文件信息
+            video_info = self._get_video_info(file_path)
+            
+            video_file_data = VideoFileCreate(
+                filename=unique_filename,
+                original_filename=file.filename,
+                file_path=file_path,
+                file_size=file_size,
+                content_hash=content_hash,
+                **video_info
+            )
         
+        # 创建数据库记录
         db_video_file = VideoFile(**video_file_data.dict())
         self.db.add(db_video_file)
         self.db.commit()
         self.db.refresh(db_video_file)
         
+        # 生成近似重复检测指纹，失败不影响上传
+        if not source_file:
+            try:
+                FingerprintService(self.db).ensure_fingerprint(db_video_file)
+            except Exception as e:
+                self.db.rollback()
+                print(f"生成视频指纹失败: {e}")
+        
         return db_video_file
     
+    def find_file_by_hash(self, content_hash: str, file_size: int) -> Optional[VideoFile]:
+        """按内容哈希查找首次上传的视频文件
+        
+        尚未记录哈希的历史文件只在大小相同时才补算哈希。
+        """
+        source_file = self.db.query(VideoFile).filter(
+            VideoFile.content_hash == content_hash,
+            VideoFile.source_file_id.is_(None)
+        ).order_by(VideoFile.id).first()
+        if source_file:
+            return source_file
+        
+        legacy_files = self.db.query(VideoFile).filter(
+            VideoFile.content_hash.is_(None),
+            VideoFile.source_file_id.is_(None),
+            VideoFile.file_size == file_size
+        ).order_by(VideoFile.id).all()
+        for legacy_file in legacy_files:
+            if not os.path.exists(legacy_file.file_path):
+                continue
+            legacy_file.content_hash = self._compute_file_hash(legacy_file.file_path)
+            if legacy_file.content_hash == content_hash:
+                source_file = legacy_file
+                break
+        self.db.commit()
+        return source_file
+    
     def get_video_file(self, file_id: int) -> Optional[VideoFile]:
         """获取视频文件信息"""
         return self.db.query(VideoFile).filter(VideoFile.id == file_id).first()
@@ -86,6 +151,62 @@ class FileService:
         if not db_video_file:
             return False
         
+        # 仍被重复上传记录引用时，把文件和分析结果移交给最早的重复记录
+        duplicates = self.db.query(VideoFile).filter(
+            VideoFile.source_file_id == file_id
+        ).order_by(VideoFile.id).all()
+        heir = None
+        if duplicates:
+            heir = self._promote_duplicate(db_video_file, duplicates)
+        else:
+            # 重复上传的记录与源记录共用同一个物理文件，只有文件不再被其他记录引用时才删除
+            if self._owns_physical_file(db_video_file):
+                self._remove_physical_files(db_video_file)
+            self.db.query(VideoFingerprint).filter(
+                VideoFingerprint.video_file_id == file_id
+            ).delete(synchronize_session=False)
+        
+        # 删除数据库记录
+        self.db.delete(db_video_file)
+        self.db.commit()
+        
+        if heir is not None:
+            self._reassign_vector_documents(file_id, heir)
+        return True
+    
+    def _promote_duplicate(self, source_file: VideoFile, duplicates: List[VideoFile]) -> VideoFile:
+        """将首个重复记录提升为源文件，并迁移分析产物，返回接替的记录"""
+        heir = duplicates[0]
+        heir.source_file_id = None
+        for duplicate in duplicates[1:]:
+            duplicate.source_file_id = heir.id
+        
+        for model in (VideoFrame, VideoStage, VideoAnalysisRun, VideoFingerprint):
+            self.db.query(model).filter(
+                model.video_file_id == source_file.id
+            ).update({model.video_file_id: heir.id}, synchronize_session=False)
+        return heir
+    
+    def _reassign_vector_documents(self, source_id: int, heir: VideoFile):
+        """向量文档的ID和元数据中包含视频ID，提交数据库变更后按接替记录的ID重新写入"""
+        try:
+            from app.services.video_rag_service import VideoRAGService
+            VideoRAGService(self.db).reassign_video_documents(source_id, heir.id, heir.filename)
+        except Exception as e:
+            print(f"迁移向量文档失败: {e}")
+    
+    def _owns_physical_file(self, db_video_file: VideoFile) -> bool:
+        """记录是否独占其物理文件（不是重复上传，且没有其他记录指向同一路径）"""
+        if db_video_file.source_file_id is not None:
+            return False
+        shared = self.db.query(VideoFile.id).filter(
+            VideoFile.file_path == db_video_file.file_path,
+            VideoFile.id != db_video_file.id
+        ).first()
+        return shared is None
+    
+    def _remove_physical_files(self, db_video_file: VideoFile):
+        """删除视频文件及其帧文件"""
         # 删除物理文件
         try:
             if os.path.exists(db_video_file.file_path):
@@ -94,18 +215,13 @@ class FileService:
             print(f"删除文件失败: {e}")
         
         # 删除相关的帧文件
-        frames = self.db.query(VideoFrame).filter(VideoFrame.video_file_id == file_id).all()
+        frames = self.db.query(VideoFrame).filter(VideoFrame.video_file_id == db_video_file.id).all()
         for frame in frames:
             try:
                 if os.path.exists(frame.frame_path):
                     os.remove(frame.frame_path)
             except Exception as e:
                 print(f"删除帧文件失败: {e}")
-        
-        # 删除数据库记录
-        self.db.delete(db_video_file)
-        self.db.commit()
-        return True
     
     def extract_frames(self, request: FrameExtractionServiceRequest) -> List[VideoFrame]:
         """提取视频帧"""
@@ -219,6 +335,14 @@ class FileService:
         self.db.commit()
         return deleted_count
     
+    def _compute_file_hash(self, file_path: str) -> str:
+        """计算文件内容的SHA-256"""
+        hasher = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            while chunk := f.read(self.HASH_CHUNK_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    
     def _get_video_info(self, file_path: str) -> dict:
         """获取视频信息"""
         try:
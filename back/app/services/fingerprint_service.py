@@ -0,0 +1,135 @@
+import os
+import numpy as np
+from typing import List, Dict, Any, Optional
+from sqlalchemy.orm import Session
+
+from app.models.video_file import VideoFile
+from app.models.video_stage import VideoStage
+from app.models.video_fingerprint import VideoFingerprint
+from app.utils.video_fingerprint import (
+    FINGERPRINT_SAMPLES,
+    compute_video_fingerprint,
+    signature_to_bytes,
+    signature_from_bytes,
+    sequence_distances
+)
+
+
+class FingerprintService:
+    """视频近似重复指纹服务"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_fingerprint(self, video_id: int) -> Optional[VideoFingerprint]:
+        """获取视频指纹记录"""
+        return self.db.query(VideoFingerprint).filter(
+            VideoFingerprint.video_file_id == video_id
+        ).first()
+
+    def ensure_fingerprint(self, video_file: VideoFile) -> VideoFingerprint:
+        """获取视频指纹，不存在时计算并保存
+
+        重复上传的视频与源文件内容相同，直接使用源文件的指纹。
+        """
+        source_id = video_file.analysis_source_id
+        fingerprint = self.get_fingerprint(source_id)
+        if fingerprint:
+            return fingerprint
+
+        if not os.path.exists(video_file.file_path):
+            raise ValueError(f"视频文件路径不存在: {video_file.file_path}")
+
+        signature, duration = compute_video_fingerprint(video_file.file_path)
+        fingerprint = VideoFingerprint(
+            video_file_id=source_id,
+            duration=duration,
+            sample_count=len(signature),
+            signature=signature_to_bytes(signature)
+        )
+        self.db.add(fingerprint)
+        self.db.commit()
+        self.db.refresh(fingerprint)
+        return fingerprint
+
+    def find_near_duplicates(self, video_file: VideoFile, max_distance: float = 0.1,
+                             duration_tolerance: float = 0.2, limit: int = 20) -> Dict[str, Any]:
+        """查找与指定视频视觉上近似重复的已有录屏
+
+        先按时长（有索引）预筛选候选，再对候选指纹矩阵做向量化汉明距离计算。
+
+        Args:
+            video_file: 视频文件
+            max_distance: 最大归一化汉明距离（0~1，越小越相似）
+            duration_tolerance: 允许的时长相对偏差
+            limit: 返回结果数量
+
+        Returns:
+            近似重复查询结果
+        """
+        fingerprint = self.ensure_fingerprint(video_file)
+        query = signature_from_bytes(fingerprint.signature)
+
+        min_duration = fingerprint.duration * (1 - duration_tolerance)
+        max_duration = fingerprint.duration * (1 + duration_tolerance)
+        # 关联视频文件表，忽略已删除视频遗留的指纹
+        rows = self.db.query(
+            VideoFingerprint.video_file_id, VideoFingerprint.signature
+        ).join(
+            VideoFile, VideoFile.id == VideoFingerprint.video_file_id
+        ).filter(
+            VideoFingerprint.duration >= min_duration,
+            VideoFingerprint.duration <= max_duration,
+            VideoFingerprint.sample_count == FINGERPRINT_SAMPLES,
+            VideoFingerprint.video_file_id != fingerprint.video_file_id
+        ).all()
+
+        matches = []
+        if rows:
+            candidate_ids = np.array([row[0] for row in rows])
+            candidates = np.vstack([signature_from_bytes(row[1]) for row in rows])
+            distances = sequence_distances(query, candidates)
+
+            within = np.nonzero(distances <= max_distance)[0]
+            order = within[np.argsort(distances[within], kind="stable")][:limit]
+            matches = [
+                {"video_id": int(candidate_ids[i]), "distance": round(float(distances[i]), 4)}
+                for i in order
+            ]
+
+        self._attach_video_details(matches)
+
+        # 同组录屏以最早的视频ID作为组ID
+        group_id = min([fingerprint.video_file_id] + [match["video_id"] for match in matches])
+
+        return {
+            "video_id": video_file.id,
+            "source_video_id": fingerprint.video_file_id,
+            "group_id": group_id,
+            "max_distance": max_distance,
+            "total_matches": len(matches),
+            "matches": matches
+        }
+
+    def _attach_video_details(self, matches: List[Dict[str, Any]]):
+        """为匹配结果补充视频信息和是否已有分析结果"""
+        if not matches:
+            return
+
+        video_ids = [match["video_id"] for match in matches]
+        videos = {
+            video.id: video
+            for video in self.db.query(VideoFile).filter(VideoFile.id.in_(video_ids)).all()
+        }
+        analyzed_ids = {
+            row[0]
+            for row in self.db.query(VideoStage.video_file_id).filter(
+                VideoStage.video_file_id.in_(video_ids)
+            ).distinct().all()
+        }
+
+        for match in matches:
+            video = videos.get(match["video_id"])
+            match["original_filename"] = video.original_filename if video else None
+            match["duration"] = video.duration if video else None
+            match["has_analysis"] = match["video_id"] in analyzed_ids
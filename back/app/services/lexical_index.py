@@ -0,0 +1,183 @@
+import math
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+from app.services.corpus_version import get_corpus_version
+from app.services.vector_backend import VectorBackend, metadata_matches
+from app.utils.text_similarity import normalize_text
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 两次检查语料版本的最短间隔（秒），期间的查询直接使用已有索引，不访问数据库
+VERSION_CHECK_INTERVAL = 2.0
+
+
+def char_tokens(text: str) -> List[str]:
+    """字符1-gram和2-gram（中文没有空格分词，按字符切分）"""
+    text = normalize_text(text)
+    return list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+class BM25Index:
+    """基于字符n-gram的内存BM25索引
+
+    每个词项保存倒排的文档下标和词频数组，查询时用NumPy累加各词项的得分。
+    删除的文档只打标记，不再出现在结果中（词项统计到下次重建时才更新）。
+    """
+
+    def __init__(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]],
+                 documents: Optional[List[str]] = None):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.documents = documents if documents is not None else texts
+
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(len(ids), dtype=np.float32)
+        for index, text in enumerate(texts):
+            tokens = char_tokens(text)
+            lengths[index] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[index] = counts.get(index, 0) + 1
+
+        average_length = float(lengths.mean()) if len(ids) else 0.0
+        self._length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (average_length or 1.0))
+        self._postings = {
+            token: (
+                np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)),
+                np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            )
+            for token, counts in postings.items()
+        }
+        self._alive = np.ones(len(ids), dtype=bool)
+        self._row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+
+    def __len__(self):
+        return int(self._alive.sum())
+
+    def remove(self, ids: Iterable[str]):
+        """标记文档已删除"""
+        rows = [self._row_of[doc_id] for doc_id in ids if doc_id in self._row_of]
+        if rows:
+            self._alive[rows] = False
+
+    def search(self, query: str, k: int, where: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """返回得分最高的k个 (文档下标, BM25得分)，只包含至少命中一个词项的文档"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        total = len(self.ids)
+        for token in set(char_tokens(query)):
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            rows, frequencies = posting
+            idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * frequencies * (BM25_K1 + 1) / (frequencies + self._length_norm[rows])
+
+        candidates = np.flatnonzero((scores > 0) & self._alive)
+        if where:
+            candidates = np.array([
+                row for row in candidates if metadata_matches(self.metadatas[row], where)
+            ], dtype=np.int64)
+        if not len(candidates):
+            return []
+
+        top = min(k, len(candidates))
+        best = candidates[np.argpartition(-scores[candidates], top - 1)[:top]]
+        best = best[np.argsort(-scores[best])]
+        return [(int(row), float(scores[row])) for row in best]
+
+
+class _IndexState:
+    """一个集合的词法索引及其语料版本"""
+
+    def __init__(self, index: BM25Index, version: int):
+        self.index = index
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.rebuilding = False
+        # 重建期间删除的文档，新索引替换旧索引时同样标记删除
+        self.removed_during_rebuild: List[str] = []
+
+
+_indexes: Dict[str, _IndexState] = {}
+_indexes_lock = threading.Lock()
+
+
+def _build_index(vector_store: VectorBackend) -> BM25Index:
+    """读取集合全部文档建立索引，索引文本为阶段名称加阶段描述"""
+    documents = vector_store.get(include=["documents", "metadatas"])
+    metadatas = [metadata or {} for metadata in documents["metadatas"]]
+    texts = [
+        f"{metadata.get('stage_name', '')} {content or ''}"
+        for content, metadata in zip(documents["documents"], metadatas)
+    ]
+    return BM25Index(documents["ids"], texts, metadatas,
+                     [content or "" for content in documents["documents"]])
+
+
+def _rebuild(collection_name: str, vector_store: VectorBackend, version: int):
+    """后台重建索引，完成后替换；重建期间查询继续使用旧索引"""
+    state = _indexes[collection_name]
+    try:
+        started = time.monotonic()
+        index = _build_index(vector_store)
+        with _indexes_lock:
+            index.remove(state.removed_during_rebuild)
+            state.index = index
+            state.version = version
+            state.removed_during_rebuild = []
+        print(f"已重建词法索引: {collection_name}（{len(index)} 个文档，语料版本 {version}，"
+              f"耗时 {time.monotonic() - started:.2f} 秒）")
+    except Exception as e:
+        print(f"重建词法索引失败: {collection_name}: {str(e)}")
+    finally:
+        with _indexes_lock:
+            state.rebuilding = False
+
+
+def get_lexical_index(collection_name: str, vector_store: VectorBackend) -> BM25Index:
+    """集合对应的BM25索引
+
+    首次使用时同步建立；之后每隔 VERSION_CHECK_INTERVAL 秒检查一次语料版本，
+    版本变化（其他请求或进程写入、删除文档）时在后台线程重建，重建完成前返回旧索引。
+    """
+    state = _indexes.get(collection_name)
+    if state is not None and time.monotonic() - state.checked_at < VERSION_CHECK_INTERVAL:
+        return state.index
+
+    version = get_corpus_version(collection_name)
+    if state is None:
+        with _indexes_lock:
+            state = _indexes.get(collection_name)
+            if state is None:
+                index = _build_index(vector_store)
+                state = _indexes[collection_name] = _IndexState(index, version)
+                print(f"已建立词法索引: {collection_name}（{len(index)} 个文档，语料版本 {version}）")
+            return state.index
+
+    with _indexes_lock:
+        state.checked_at = time.monotonic()
+        if state.version == version or state.rebuilding:
+            return state.index
+        state.rebuilding = True
+    threading.Thread(target=_rebuild, args=(collection_name, vector_store, version),
+                     name="lexical-index-rebuild", daemon=True).start()
+    return state.index
+
+
+def invalidate_lexical_index(collection_name: str, deleted_ids: Optional[Iterable[str]] = None):
+    """本进程写入或删除文档后调用：删除的文档立即从结果中去掉，下一次查询检查版本并在后台重建"""
+    with _indexes_lock:
+        state = _indexes.get(collection_name)
+        if state is None:
+            return
+        if deleted_ids:
+            deleted_ids = list(deleted_ids)
+            state.index.remove(deleted_ids)
+            if state.rebuilding:
+                state.removed_during_rebuild.extend(deleted_ids)
+        state.checked_at = 0.0
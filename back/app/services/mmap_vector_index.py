@@ -0,0 +1,643 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.services.vector_backend import VectorBackend, group_by_where
+from app.utils.vector_quantization import create_quantizer, nearest
+
+VECTORS_FILE = "vectors.bin"
+INDEX_FILE = "index.json"
+LOG_FILE = "index.log"
+QUANTIZED_FILE = "quantized.npz"
+
+# 向量文件的初始容量（行），写满后按倍数扩容
+INITIAL_CAPACITY = 1024
+# 已删除行超过该数量且超过总行数一半时压缩文件
+COMPACT_MIN_DEAD = 1000
+# 日志记录的行数超过快照行数（且不少于该值）时重写快照，限制打开集合时回放的日志量
+SNAPSHOT_MIN_LOG_ROWS = 1000
+# 精确检索时每批计算距离的行数，限制临时内存
+SEARCH_CHUNK_ROWS = 65536
+# IVF训练的采样数和迭代次数
+IVF_TRAIN_SAMPLES = 20000
+IVF_TRAIN_ITERATIONS = 10
+
+
+class MmapVectorBackend(VectorBackend):
+    """进程内的内存映射向量索引
+
+    向量按行存放在内存映射文件中（float32或float16），文档内容和元数据按列存放在 index.json 快照中，
+    之后的写入和删除只追加到 index.log，打开集合时在快照上回放；压缩文件或日志较长时才重写快照。
+    元数据过滤和top-k检索都用NumPy向量化计算。删除只打标记，已删除行较多时压缩文件。
+    向量数达到 ivf_threshold 时自动训练IVF聚类，检索只扫描最近的 ivf_nprobe 个聚类。
+    启用量化（int8 / pq）时，第一轮用内存中的量化编码计算近似距离，
+    取前 k*rerank_multiplier 个候选再从映射文件读取原始向量精确重排。
+    同一目录只应由一个进程写入。
+    """
+
+    def __init__(self, directory: str, embedding_function: Embeddings, dtype: str = "float32",
+                 ivf_threshold: int = 0, ivf_nprobe: int = 8, quantization: str = "none",
+                 rerank_multiplier: int = 4, pq_subvectors: int = 64):
+        self.directory = directory
+        self.embedding_function = embedding_function
+        self.ivf_threshold = ivf_threshold
+        self.ivf_nprobe = ivf_nprobe
+        self.quantization = quantization
+        self.rerank_multiplier = max(1, rerank_multiplier)
+        self.pq_subvectors = pq_subvectors
+        self._lock = threading.RLock()
+        self._dtype = np.dtype(dtype)
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # ---------- 持久化 ----------
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.directory, VECTORS_FILE)
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE)
+
+    @property
+    def _log_path(self) -> str:
+        return os.path.join(self.directory, LOG_FILE)
+
+    @property
+    def _quantized_path(self) -> str:
+        return os.path.join(self.directory, QUANTIZED_FILE)
+
+    def _reset_state(self):
+        self._dim: Optional[int] = None
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._ids: List[str] = []
+        self._documents: List[Optional[str]] = []
+        self._columns: Dict[str, List[Any]] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._row_of: Dict[str, int] = {}
+        self._column_cache: Dict[str, np.ndarray] = {}
+        self._ivf: Optional[Dict[str, Any]] = None
+        self._quantizer = create_quantizer(self.quantization, self.pq_subvectors)
+        self._quantizer_trained_size = 0
+        # 快照的代数，日志首行记录所属的代数，重写快照后旧日志不再回放
+        self._generation = 0
+        self._log_rows = 0
+
+    def _load(self):
+        self._reset_state()
+        if not os.path.exists(self._index_path):
+            return
+
+        with open(self._index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        stored_dtype = np.dtype(index["dtype"])
+        if stored_dtype != self._dtype:
+            print(f"向量索引 {self.directory} 以 {stored_dtype} 存储，忽略配置的 {self._dtype}")
+            self._dtype = stored_dtype
+
+        self._dim = index["dim"]
+        self._generation = index.get("generation", 0)
+        self._ids = index["ids"]
+        self._documents = index["documents"]
+        self._columns = index["columns"]
+        self._alive = np.array(index["alive"], dtype=bool)
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids) if self._alive[row]}
+        complete = self._replay_log()
+        if self._dim:
+            self._open_vectors()
+        if not complete:
+            # 重写快照，避免之后追加的日志接在不完整的行后面
+            self._write_snapshot()
+        self._load_quantized()
+
+    def _replay_log(self) -> bool:
+        """在快照上回放写入和删除日志；属于旧快照的日志和未写完的末行被忽略，返回日志是否完整"""
+        if not os.path.exists(self._log_path):
+            return True
+        with open(self._log_path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except json.JSONDecodeError:
+            header = {}
+        if header.get("generation") != self._generation:
+            return True
+
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"向量索引 {self.directory} 的日志末尾不完整，已忽略")
+                return False
+            if record["op"] == "add":
+                self._append_documents(record["ids"], record["documents"], record["metadatas"])
+            else:
+                self._mark_deleted(record["ids"])
+            self._log_rows += len(record["ids"])
+        return True
+
+    def _open_vectors(self):
+        """按实际文件大小映射向量文件；文件缺失或短于已记录的行数时只接受空集合"""
+        row_bytes = self._dim * self._dtype.itemsize
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        capacity = size // row_bytes
+        if capacity < len(self._ids):
+            if self._alive.any():
+                raise ValueError(f"向量文件 {self._vectors_path} 缺失或不完整: "
+                                 f"记录了 {len(self._ids)} 行，文件只有 {capacity} 行")
+            # 没有有效文档（例如全部删除），从空集合重新开始
+            self._ids, self._documents, self._columns = [], [], {}
+            self._alive = np.zeros(0, dtype=bool)
+            self._row_of = {}
+            self._write_snapshot()
+        self._capacity = capacity
+        if capacity:
+            self._vectors = np.memmap(self._vectors_path, dtype=self._dtype, mode="r+",
+                                      shape=(self._capacity, self._dim))
+        self._norms = self._row_norms(0, len(self._ids))
+
+    def _load_quantized(self):
+        """读取保存的量化编码；方式不一致或文件不存在时在首次检索时重新编码"""
+        if self._quantizer is None or not os.path.exists(self._quantized_path):
+            return
+        with np.load(self._quantized_path) as state:
+            if str(state["name"]) != self._quantizer.name:
+                return
+            self._quantizer.load_state({key: state[key] for key in state.files if key != "name"})
+        if len(self._quantizer) > len(self._ids):
+            self._quantizer = create_quantizer(self.quantization, self.pq_subvectors)
+            return
+        self._quantizer_trained_size = int(self._alive.sum())
+
+    def _write_snapshot(self):
+        """重写完整的快照并开始新的日志（只在新建集合、压缩和日志过长时调用）"""
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._generation += 1
+        index = {
+            "dim": self._dim,
+            "dtype": self._dtype.name,
+            "generation": self._generation,
+            "ids": self._ids,
+            "documents": self._documents,
+            "columns": self._columns,
+            "alive": self._alive.tolist()
+        }
+        temp_path = self._index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(temp_path, self._index_path)
+
+        temp_path = self._log_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"generation": self._generation}) + "\n")
+        os.replace(temp_path, self._log_path)
+        self._log_rows = 0
+        self._save_quantized()
+
+    def _append_log(self, record: Dict[str, Any]):
+        """追加一条写入或删除日志；日志累积较多时改为重写快照"""
+        self._log_rows += len(record["ids"])
+        if self._log_rows > max(SNAPSHOT_MIN_LOG_ROWS, len(self._ids)):
+            self._write_snapshot()
+            return
+        if self._vectors is not None:
+            # 日志引用的向量行先落盘
+            self._vectors.flush()
+        header = "" if os.path.exists(self._log_path) else json.dumps({"generation": self._generation}) + "\n"
+        with open(self._log_path, "a", encoding="utf-8") as f:
+            f.write(header + json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _save_quantized(self):
+        """保存量化编码（训练或压缩后），之后新增的行在检索前补充编码"""
+        if self._quantizer is not None and self._quantizer.trained and len(self._quantizer):
+            temp_path = self._quantized_path + ".tmp.npz"
+            np.savez(temp_path, name=self._quantizer.name, **self._quantizer.state())
+            os.replace(temp_path, self._quantized_path)
+
+    def _ensure_capacity(self, rows: int):
+        """保证向量文件至少能容纳 rows 行"""
+        if rows <= self._capacity:
+            return
+        capacity = max(INITIAL_CAPACITY, self._capacity)
+        while capacity < rows:
+            capacity *= 2
+
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(capacity * self._dim * self._dtype.itemsize)
+        self._capacity = capacity
+        self._vectors = np.memmap(self._vectors_path, dtype=self._dtype, mode="r+",
+                                  shape=(self._capacity, self._dim))
+
+    def _row_norms(self, start: int, end: int) -> np.ndarray:
+        norms = np.empty(end - start, dtype=np.float32)
+        for chunk in range(start, end, SEARCH_CHUNK_ROWS):
+            block = np.asarray(self._vectors[chunk:min(end, chunk + SEARCH_CHUNK_ROWS)], dtype=np.float32)
+            norms[chunk - start:chunk - start + len(block)] = np.einsum("ij,ij->i", block, block)
+        return norms
+
+    # ---------- 写入和删除 ----------
+
+    def add_texts(self, texts, metadatas=None, ids=None, embeddings=None):
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        if embeddings is None:
+            embeddings = self.embedding_function.embed_documents(texts)
+        matrix = np.asarray(embeddings, dtype=np.float32)
+
+        with self._lock:
+            created = self._dim is None
+            if created:
+                self._dim = matrix.shape[1]
+            elif matrix.shape[1] != self._dim:
+                raise ValueError(f"Collection expecting embedding with dimension of {self._dim}, got {matrix.shape[1]}")
+
+            start = len(self._ids)
+            end = start + len(ids)
+            self._ensure_capacity(end)
+            self._vectors[start:end] = matrix.astype(self._dtype)
+            self._append_documents(ids, texts, metadatas)
+            self._norms = np.concatenate([self._norms, self._row_norms(start, end)])
+            self._ivf_append(start, end)
+            if created:
+                self._write_snapshot()
+            else:
+                self._append_log({"op": "add", "ids": ids, "documents": texts, "metadatas": metadatas})
+        return ids
+
+    def _append_documents(self, ids: List[str], texts: List[Optional[str]], metadatas: List[Optional[Dict[str, Any]]]):
+        """追加文档内容和元数据（向量已写入对应行）；ID已存在时旧行作废"""
+        self._mark_deleted([doc_id for doc_id in ids if doc_id in self._row_of])
+        start = len(self._ids)
+        for row, (doc_id, text, metadata) in enumerate(zip(ids, texts, metadatas), start):
+            self._ids.append(doc_id)
+            self._documents.append(text)
+            self._row_of[doc_id] = row
+            for column in self._columns.values():
+                column.append(None)
+            for key, value in (metadata or {}).items():
+                column = self._columns.setdefault(key, [None] * (row + 1))
+                column[row] = value
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._column_cache.clear()
+
+    def _mark_deleted(self, ids: List[str]) -> int:
+        rows = [self._row_of.pop(doc_id) for doc_id in ids if doc_id in self._row_of]
+        if rows:
+            self._alive[rows] = False
+        return len(rows)
+
+    def delete(self, ids):
+        with self._lock:
+            ids = [doc_id for doc_id in dict.fromkeys(ids or []) if doc_id in self._row_of]
+            if not self._mark_deleted(ids):
+                return
+            dead = len(self._ids) - int(self._alive.sum())
+            if dead >= COMPACT_MIN_DEAD and dead * 2 > len(self._ids):
+                self._compact()
+            else:
+                self._append_log({"op": "delete", "ids": ids})
+
+    def _compact(self):
+        """去掉已删除的行，重写向量文件"""
+        rows = np.flatnonzero(self._alive)
+        quantizer_complete = self._quantizer is not None and len(self._quantizer) == len(self._ids)
+        vectors = np.asarray(self._vectors[rows]) if len(rows) else None
+        ids = [self._ids[row] for row in rows]
+        documents = [self._documents[row] for row in rows]
+        columns = {key: [values[row] for row in rows] for key, values in self._columns.items()}
+
+        self._vectors = None
+        if os.path.exists(self._vectors_path):
+            os.remove(self._vectors_path)
+        self._capacity = 0
+        self._ids, self._documents, self._columns = ids, documents, columns
+        self._alive = np.ones(len(rows), dtype=bool)
+        self._row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+        self._column_cache.clear()
+        self._ivf = None
+        if quantizer_complete:
+            self._quantizer.take(rows)
+        else:
+            self._quantizer = create_quantizer(self.quantization, self.pq_subvectors)
+        self._ensure_capacity(len(rows))
+        if vectors is not None:
+            self._vectors[:len(rows)] = vectors
+        self._norms = self._row_norms(0, len(rows))
+        self._write_snapshot()
+
+    def delete_collection(self):
+        with self._lock:
+            self._vectors = None
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            self._reset_state()
+
+    # ---------- 读取和过滤 ----------
+
+    def count(self):
+        with self._lock:
+            return int(self._alive.sum())
+
+    def _column_array(self, key: str) -> np.ndarray:
+        array = self._column_cache.get(key)
+        if array is None:
+            values = self._columns.get(key)
+            array = np.empty(len(self._ids), dtype=object)
+            if values is not None:
+                array[:] = values
+            self._column_cache[key] = array
+        return array
+
+    def _numeric_column(self, key: str) -> np.ndarray:
+        cache_key = f"{key}#numeric"
+        array = self._column_cache.get(cache_key)
+        if array is None:
+            array = np.array([
+                float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+                for value in self._column_array(key)
+            ], dtype=np.float64)
+            self._column_cache[cache_key] = array
+        return array
+
+    def _where_mask(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """把Chroma风格的where子句转换为行掩码"""
+        mask = np.ones(len(self._ids), dtype=bool)
+        for key, condition in (where or {}).items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._where_mask(clause)
+            elif key == "$or":
+                any_mask = np.zeros(len(self._ids), dtype=bool)
+                for clause in condition:
+                    any_mask |= self._where_mask(clause)
+                mask &= any_mask
+            else:
+                mask &= self._field_mask(key, condition)
+        return mask
+
+    def _field_mask(self, key: str, condition: Any) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        mask = np.ones(len(self._ids), dtype=bool)
+        for operator, value in condition.items():
+            if operator == "$eq":
+                mask &= self._column_array(key) == value
+            elif operator == "$ne":
+                mask &= self._column_array(key) != value
+            elif operator in ("$in", "$nin"):
+                values = set(value)
+                member = np.fromiter((item in values for item in self._column_array(key)),
+                                     dtype=bool, count=len(self._ids))
+                mask &= member if operator == "$in" else ~member
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                column = self._numeric_column(key)
+                with np.errstate(invalid="ignore"):
+                    if operator == "$gt":
+                        mask &= column > value
+                    elif operator == "$gte":
+                        mask &= column >= value
+                    elif operator == "$lt":
+                        mask &= column < value
+                    else:
+                        mask &= column <= value
+            else:
+                raise ValueError(f"不支持的过滤操作: {operator}")
+        return mask
+
+    def _metadata(self, row: int) -> Dict[str, Any]:
+        return {key: values[row] for key, values in self._columns.items() if values[row] is not None}
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        with self._lock:
+            mask = self._alive & self._where_mask(where)
+            if ids is not None:
+                rows = [self._row_of[doc_id] for doc_id in ids if doc_id in self._row_of]
+                rows = [row for row in rows if mask[row]]
+            else:
+                rows = np.flatnonzero(mask).tolist()
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+
+            return {
+                "ids": [self._ids[row] for row in rows],
+                "documents": [self._documents[row] for row in rows] if "documents" in include else None,
+                "metadatas": [self._metadata(row) for row in rows] if "metadatas" in include else None,
+                "embeddings": (np.asarray(self._vectors[rows], dtype=np.float32)
+                               if "embeddings" in include and rows else None)
+            }
+
+    # ---------- 检索 ----------
+
+    def search_by_vector(self, embedding, k=4, where=None):
+        query = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if self._dim is None or k <= 0:
+                return []
+            return self._search_masked(query, self._alive & self._where_mask(where), k)
+
+    def _search_masked(self, query: np.ndarray, mask: np.ndarray, k: int):
+        """在掩码内检索单个查询：IVF候选（启用时）、量化粗排（启用时）和精确重排"""
+        candidates = self._ivf_candidates(query, mask, k)
+        if candidates is None:
+            candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+
+        # 量化编码粗排，只对候选读取原始向量精确重排
+        shortlist_size = k * self.rerank_multiplier
+        if len(candidates) > shortlist_size and self._ensure_quantizer():
+            approximate = self._quantizer.approximate_distances(query, candidates, self._norms)
+            candidates = np.sort(candidates[np.argpartition(approximate, shortlist_size - 1)[:shortlist_size]])
+
+        distances = self._distances(query, candidates)
+        top = min(k, len(candidates))
+        order = np.argpartition(distances, top - 1)[:top]
+        order = order[np.argsort(distances[order])]
+
+        return [(self._document(int(candidates[index])), float(distances[index])) for index in order]
+
+    def search_by_vectors(self, embeddings, k=4, wheres=None):
+        """批量检索，结果与逐条调用 search_by_vector 相同
+
+        相同过滤条件的查询共用一次过滤掩码。需要精确扫描时每批向量只读取一次，
+        用一次矩阵乘法算出全部查询的距离；启用IVF或量化粗排时每个查询的候选不同，逐个查询检索。
+        """
+        queries = np.asarray(embeddings, dtype=np.float32)
+        results = [[] for _ in range(len(queries))]
+        with self._lock:
+            if self._dim is None or k <= 0 or not len(queries):
+                return results
+            for where, indexes in group_by_where(wheres, len(queries)):
+                mask = self._alive & self._where_mask(where)
+                candidates = np.flatnonzero(mask)
+                if not len(candidates):
+                    continue
+                if self._ivf_enabled() or (len(candidates) > k * self.rerank_multiplier and self._ensure_quantizer()):
+                    for index in indexes:
+                        results[index] = self._search_masked(queries[index], mask, k)
+                    continue
+                best_rows, best_distances = self._batch_top_k(queries[indexes], candidates, k)
+                for position, index in enumerate(indexes):
+                    results[index] = [
+                        (self._document(int(row)), float(distance))
+                        for row, distance in zip(best_rows[position], best_distances[position])
+                    ]
+        return results
+
+    def _batch_top_k(self, queries: np.ndarray, rows: np.ndarray, k: int):
+        """多个查询在候选行中的前k个，返回按距离升序的 (行号矩阵, 距离矩阵)"""
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_CHUNK_ROWS):
+            chunk = rows[start:start + SEARCH_CHUNK_ROWS]
+            distances = self._norms[chunk][None, :] - 2 * (queries @ self._read_rows(chunk).T) + query_norms[:, None]
+            # 与之前各批的前k个合并后重新取前k个
+            merged_distances = np.concatenate([best_distances, np.maximum(distances, 0)], axis=1)
+            merged_rows = np.concatenate([best_rows, np.broadcast_to(chunk, distances.shape)], axis=1)
+            top = min(k, merged_distances.shape[1])
+            keep = np.argpartition(merged_distances, top - 1, axis=1)[:, :top]
+            best_distances = np.take_along_axis(merged_distances, keep, axis=1)
+            best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+        order = np.argsort(best_distances, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_distances, order, axis=1)
+
+    def _document(self, row: int) -> Document:
+        return Document(page_content=self._documents[row] or "", metadata=self._metadata(row), id=self._ids[row])
+
+    def _read_rows(self, rows: np.ndarray) -> np.ndarray:
+        """读取一批行的向量（float32）"""
+        if rows[-1] - rows[0] + 1 == len(rows):
+            # 连续的行直接切片，避免花式索引复制
+            return np.asarray(self._vectors[rows[0]:rows[-1] + 1], dtype=np.float32)
+        return np.asarray(self._vectors[rows], dtype=np.float32)
+
+    def _distances(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """平方L2距离: |x|^2 - 2x·q + |q|^2"""
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_CHUNK_ROWS):
+            chunk = rows[start:start + SEARCH_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = self._read_rows(chunk) @ query
+        distances = self._norms[rows] - 2 * scores + float(query @ query)
+        return np.maximum(distances, 0)
+
+    # ---------- IVF近似检索 ----------
+
+    def _ivf_candidates(self, query: np.ndarray, mask: np.ndarray, k: int) -> Optional[np.ndarray]:
+        """IVF候选行；未启用IVF或候选不足k个时返回None（退回精确检索）"""
+        if not self._ivf_enabled():
+            return None
+        self._ensure_ivf()
+
+        centroids = self._ivf["centroids"]
+        centroid_distances = ((centroids - query) ** 2).sum(axis=1)
+        nprobe = min(self.ivf_nprobe, len(centroids))
+        probe = np.argpartition(centroid_distances, nprobe - 1)[:nprobe]
+        candidates = np.flatnonzero(mask & np.isin(self._ivf["assignments"], probe))
+        return candidates if len(candidates) >= k else None
+
+    def _ivf_enabled(self) -> bool:
+        return bool(self.ivf_threshold) and int(self._alive.sum()) >= self.ivf_threshold
+
+    def _ensure_ivf(self):
+        """首次使用或数据量翻倍后重新训练聚类"""
+        alive = int(self._alive.sum())
+        if self._ivf is not None and alive < 2 * self._ivf["trained_size"]:
+            return
+
+        rows = np.flatnonzero(self._alive)
+        rng = np.random.default_rng(0)
+        sample = rng.choice(rows, size=min(len(rows), IVF_TRAIN_SAMPLES), replace=False)
+        sample.sort()
+        data = np.asarray(self._vectors[sample], dtype=np.float32)
+
+        nlist = max(1, int(np.sqrt(len(rows))))
+        centroids = data[rng.choice(len(data), size=min(nlist, len(data)), replace=False)].copy()
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            labels = nearest(data, centroids)
+            for cluster in range(len(centroids)):
+                members = data[labels == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+
+        self._ivf = {
+            "centroids": centroids,
+            "assignments": np.full(len(self._ids), -1, dtype=np.int32),
+            "trained_size": alive
+        }
+        self._ivf_append(0, len(self._ids))
+
+    def _ivf_append(self, start: int, end: int):
+        """新增的行分配到最近的聚类"""
+        if self._ivf is None:
+            return
+        assignments = self._ivf["assignments"]
+        if len(assignments) < end:
+            assignments = np.concatenate([assignments, np.full(end - len(assignments), -1, dtype=np.int32)])
+        for chunk in range(start, end, SEARCH_CHUNK_ROWS):
+            block = np.asarray(self._vectors[chunk:min(end, chunk + SEARCH_CHUNK_ROWS)], dtype=np.float32)
+            assignments[chunk:chunk + len(block)] = nearest(block, self._ivf["centroids"])
+        self._ivf["assignments"] = assignments
+
+    # ---------- 量化 ----------
+
+    def _ensure_quantizer(self) -> bool:
+        """保证量化编码覆盖全部行，返回是否可以使用量化粗排
+
+        PQ在数据量达到中心数后首次训练，之后数据量翻倍时重新训练；新增的行在检索前补充编码。
+        """
+        quantizer = self._quantizer
+        if quantizer is None:
+            return False
+        alive = int(self._alive.sum())
+        if alive < quantizer.min_train_size:
+            return False
+
+        if quantizer.min_train_size and (not quantizer.trained or alive >= 2 * self._quantizer_trained_size):
+            rows = np.flatnonzero(self._alive)
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(rows, size=min(len(rows), IVF_TRAIN_SAMPLES), replace=False))
+            quantizer = create_quantizer(self.quantization, self.pq_subvectors)
+            quantizer.train(np.asarray(self._vectors[sample], dtype=np.float32))
+            self._quantizer = quantizer
+            self._quantizer_trained_size = alive
+            self._save_quantized()
+
+        for chunk in range(len(quantizer), len(self._ids), SEARCH_CHUNK_ROWS):
+            end = min(len(self._ids), chunk + SEARCH_CHUNK_ROWS)
+            quantizer.encode(np.asarray(self._vectors[chunk:end], dtype=np.float32))
+        return True
+
+    def memory_usage(self) -> Dict[str, int]:
+        """索引占用的字节数（向量文件按映射的有效部分计）"""
+        with self._lock:
+            rows = len(self._ids)
+            vector_bytes = rows * (self._dim or 0) * self._dtype.itemsize
+            ivf_bytes = 0
+            if self._ivf is not None:
+                ivf_bytes = self._ivf["centroids"].nbytes + self._ivf["assignments"].nbytes
+            return {
+                "vector_bytes": vector_bytes,
+                "norm_bytes": self._norms.nbytes,
+                "ivf_bytes": ivf_bytes,
+                "quantized_bytes": self._quantizer.nbytes if self._quantizer is not None else 0,
+                "index_file_bytes": sum(
+                    os.path.getsize(path) for path in (self._index_path, self._log_path) if os.path.exists(path)
+                )
+            }
@@ -0,0 +1,231 @@
+import math
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+
+from app.config import settings
+from app.db.database import SessionLocal
+from app.models.model_call_record import ModelCallRecord
+from app.utils.metrics import metrics
+
+metrics.describe("model_tokens_total", "模型调用消耗的token数（按模型、调用方和方向）")
+metrics.describe("model_images_total", "视觉请求发送的图片数（按模型和调用方）")
+metrics.describe("model_payload_bytes_total", "模型请求负载字节数（按模型和调用方）")
+
+# 聚合查询支持的分组字段
+GROUP_FIELDS = {
+    "caller": ModelCallRecord.caller,
+    "model": ModelCallRecord.model,
+    "kind": ModelCallRecord.kind,
+    "outcome": ModelCallRecord.outcome
+}
+
+
+def extract_token_usage(result: Any) -> Dict[str, int]:
+    """从模型响应中提取token用量，支持LangChain消息和Ark/OpenAI SDK响应"""
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        return {
+            "input_tokens": usage.get("input_tokens", 0) or 0,
+            "output_tokens": usage.get("output_tokens", 0) or 0
+        }
+    usage = getattr(result, "usage", None)
+    if usage is not None:
+        return {
+            "input_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "output_tokens": getattr(usage, "completion_tokens", 0) or 0
+        }
+    return {"input_tokens": 0, "output_tokens": 0}
+
+
+class ModelCallRecorder:
+    """模型调用记录器
+
+    记录先进入内存队列，由后台线程批量写入 model_call_records 表，不阻塞模型调用；
+    同时累加到进程内指标，供Prometheus导出。
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._last_prune = 0.0
+
+    def record(self, **fields):
+        """记录一次模型调用"""
+        labels = {"model": fields["model"], "caller": fields["caller"]}
+        metrics.inc("model_tokens_total", fields.get("input_tokens", 0), direction="input", **labels)
+        metrics.inc("model_tokens_total", fields.get("output_tokens", 0), direction="output", **labels)
+        if fields.get("image_count"):
+            metrics.inc("model_images_total", fields["image_count"], **labels)
+        if fields.get("payload_bytes"):
+            metrics.inc("model_payload_bytes_total", fields["payload_bytes"], **labels)
+
+        if not settings.model_call_recording_enabled:
+            return
+        self._queue.put(fields)
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="model-call-recorder", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._stopping.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> int:
+        """把队列中的记录写入数据库，返回写入条数"""
+        written = 0
+        while True:
+            batch: List[Dict[str, Any]] = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+
+            db = SessionLocal()
+            try:
+                db.add_all([ModelCallRecord(**fields) for fields in batch])
+                db.commit()
+                written += len(batch)
+            except Exception as e:
+                db.rollback()
+                print(f"模型调用记录写入失败: {str(e)}")
+            finally:
+                db.close()
+
+        self._prune()
+        return written
+
+    def _prune(self):
+        """每小时清理一次超出保留期的记录"""
+        now = time.time()
+        if now - self._last_prune < 3600:
+            return
+        self._last_prune = now
+        db = SessionLocal()
+        try:
+            db.query(ModelCallRecord).filter(
+                ModelCallRecord.started_at < now - settings.model_call_retention_days * 86400
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            # 数据库被锁等错误不能让后台写入线程退出，下一个周期再清理
+            db.rollback()
+            print(f"模型调用记录清理失败: {str(e)}")
+        finally:
+            db.close()
+
+    def stop(self):
+        """停止后台线程并写入剩余记录"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def aggregate(self, since: float, group_by: str = "caller") -> List[Dict[str, Any]]:
+        """按字段聚合模型调用记录
+
+        Args:
+            since: 起始时间（Unix时间戳）
+            group_by: 分组字段（caller / model / kind / outcome）
+
+        Returns:
+            各分组的调用次数、耗时分位数、token和负载汇总
+        """
+        if group_by not in GROUP_FIELDS:
+            raise ValueError(f"不支持的分组字段: {group_by}")
+        self.flush()
+
+        group_column = GROUP_FIELDS[group_by]
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                group_column,
+                func.count(ModelCallRecord.id),
+                func.sum(ModelCallRecord.input_tokens),
+                func.sum(ModelCallRecord.output_tokens),
+                func.sum(ModelCallRecord.image_count),
+                func.sum(ModelCallRecord.payload_bytes),
+                func.sum(ModelCallRecord.retries),
+                func.avg(ModelCallRecord.latency_ms),
+                func.avg(ModelCallRecord.queue_ms)
+            ).filter(ModelCallRecord.started_at >= since).group_by(group_column).all()
+
+            outcome_counts: Dict[Any, Dict[str, int]] = {}
+            for key, outcome, count in db.query(
+                group_column, ModelCallRecord.outcome, func.count(ModelCallRecord.id)
+            ).filter(ModelCallRecord.started_at >= since).group_by(group_column, ModelCallRecord.outcome).all():
+                outcome_counts.setdefault(key, {})[outcome] = count
+
+            # 分位数在数据库中按耗时排序后取对应位置的一行，不把全部耗时读入内存
+            percentiles: Dict[Any, Dict[float, float]] = {
+                row[0]: {
+                    q: self._latency_percentile(db, group_column, row[0], since, row[1], q)
+                    for q in (0.5, 0.95)
+                }
+                for row in rows
+            }
+        finally:
+            db.close()
+
+        results = []
+        for key, count, input_tokens, output_tokens, images, payload, retries, avg_latency, avg_queue in rows:
+            results.append({
+                group_by: key,
+                "calls": count,
+                "outcomes": outcome_counts.get(key, {}),
+                "retries": int(retries or 0),
+                "avg_latency_ms": round(avg_latency or 0.0, 1),
+                "p50_latency_ms": round(percentiles[key][0.5], 1),
+                "p95_latency_ms": round(percentiles[key][0.95], 1),
+                "avg_queue_ms": round(avg_queue or 0.0, 1),
+                "input_tokens": int(input_tokens or 0),
+                "output_tokens": int(output_tokens or 0),
+                "image_count": int(images or 0),
+                "payload_bytes": int(payload or 0)
+            })
+        results.sort(key=lambda item: item["calls"], reverse=True)
+        return results
+
+    @staticmethod
+    def _latency_percentile(db, group_column, key: Any, since: float, count: int, q: float) -> float:
+        """分组内耗时的分位数（最近秩法），由数据库排序并用 OFFSET 定位"""
+        if not count:
+            return 0.0
+        index = min(count - 1, max(0, math.ceil(q * count) - 1))
+        value = db.query(ModelCallRecord.latency_ms).filter(
+            group_column == key,
+            ModelCallRecord.started_at >= since
+        ).order_by(ModelCallRecord.latency_ms).offset(index).limit(1).scalar()
+        return value or 0.0
+
+
+_recorder: Optional[ModelCallRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_model_call_recorder() -> ModelCallRecorder:
+    """获取进程内共享的模型调用记录器"""
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = ModelCallRecorder()
+    return _recorder
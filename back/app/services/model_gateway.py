@@ -0,0 +1,388 @@
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+from app.config import settings
+from app.utils.metrics import metrics
+from app.services.model_call_recorder import extract_token_usage, get_model_call_recorder
+
+T = TypeVar("T")
+
+metrics.describe("model_calls_total", "经网关发出的模型调用次数（按模型、调用方和结果）")
+metrics.describe("model_call_retries_total", "模型调用重试次数（按模型）")
+metrics.describe("model_call_seconds", "模型调用耗时（秒，含重试）")
+metrics.describe("model_call_queue_seconds", "模型调用排队等待并发槽位的时间（秒）")
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# 流式响应读取完毕的标记
+_STREAM_END = object()
+
+
+class ModelGatewayError(Exception):
+    """模型网关错误"""
+
+
+class CircuitOpenError(ModelGatewayError):
+    """熔断器打开，暂停向该模型发送请求"""
+
+
+class CircuitBreaker:
+    """按模型的熔断器：连续失败达到阈值后打开，冷却期过后放行一个试探请求"""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return "half_open"
+            return "open"
+
+    def before_call(self):
+        """请求前检查，熔断时抛出 CircuitOpenError"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                raise CircuitOpenError("模型服务连续失败，熔断中，请稍后重试")
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """结束试探但不计入成败（调用方取消、排队超时或请求本身有误），下一个请求可以重新试探"""
+        with self._lock:
+            self._probing = False
+
+
+class _StreamReader:
+    """在网关线程中逐个读取流式分块，调用方可以对每次读取设置超时"""
+
+    def __init__(self, fn: Callable[[], Iterator[Any]]):
+        self.fn = fn
+        self.chunks: Optional[Iterator[Any]] = None
+        self.pending = None
+
+    def read(self) -> Any:
+        if self.chunks is None:
+            self.chunks = iter(self.fn())
+        return next(self.chunks, _STREAM_END)
+
+    def close(self):
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception as e:
+                print(f"关闭模型流式响应失败: {str(e)}")
+
+
+class ModelGateway:
+    """所有模型调用（LLM、视觉、Embedding）的统一出口
+
+    - 全局并发上限和按模型的并发上限，超出的请求排队等待
+    - 单次调用超时（analysis_timeout）
+    - 指数退避加随机抖动的重试（retry_attempts）
+    - 按模型的熔断器
+    - 每次调用的耗时、token、图片数、负载大小、重试次数和结果写入调用记录
+
+    服务层均为同步代码（由FastAPI线程池执行），网关以线程原语实现；
+    异步调用方使用 acall，在线程中执行同一套限流逻辑。
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, per_model_concurrency: Optional[int] = None,
+                 timeout: Optional[float] = None, retry_attempts: Optional[int] = None,
+                 backoff_base: Optional[float] = None, backoff_max: Optional[float] = None,
+                 breaker_threshold: Optional[int] = None, breaker_cooldown: Optional[float] = None):
+        self.max_concurrency = max_concurrency or settings.model_gateway_max_concurrency
+        self.per_model_concurrency = per_model_concurrency or settings.max_concurrent_analyses
+        self.timeout = timeout or settings.analysis_timeout
+        self.retry_attempts = retry_attempts if retry_attempts is not None else settings.retry_attempts
+        self.backoff_base = backoff_base or settings.model_gateway_backoff_base
+        self.backoff_max = backoff_max or settings.model_gateway_backoff_max
+        self.breaker_threshold = breaker_threshold or settings.model_gateway_breaker_threshold
+        self.breaker_cooldown = breaker_cooldown or settings.model_gateway_breaker_cooldown
+
+        self._global_slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._model_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        # 执行带超时的调用；线程数与全局并发上限一致
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="model-gateway")
+        self.recorder = get_model_call_recorder()
+
+    def _model_semaphore(self, model: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if model not in self._model_slots:
+                limit = settings.model_gateway_model_limits.get(model, self.per_model_concurrency)
+                self._model_slots[model] = threading.BoundedSemaphore(max(1, limit))
+            return self._model_slots[model]
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return self._breakers[model]
+
+    def _acquire(self, model: str, deadline: float) -> float:
+        """按固定顺序获取全局和模型槽位，避免死锁，返回排队等待的秒数"""
+        started = time.monotonic()
+        model_slots = self._model_semaphore(model)
+        if not model_slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise ModelGatewayError(f"等待模型 {model} 的并发槽位超时")
+        if not self._global_slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            model_slots.release()
+            raise ModelGatewayError("等待模型调用并发槽位超时")
+        waited = time.monotonic() - started
+        metrics.observe("model_call_queue_seconds", waited, model=model)
+        return waited
+
+    def _release(self, model: str):
+        self._global_slots.release()
+        self._model_semaphore(model).release()
+
+    def _release_stream(self, model: str, reader: _StreamReader):
+        """关闭流式响应并释放槽位；读取超时时仍在进行的读取结束后才关闭和释放"""
+        def finish(_=None):
+            reader.close()
+            self._release(model)
+
+        if reader.pending is not None and not reader.pending.done():
+            reader.pending.add_done_callback(finish)
+        else:
+            finish()
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        """判断异常是否值得重试（超时、连接错误、限流和服务端错误）"""
+        if isinstance(error, (TimeoutError, FutureTimeoutError, ConnectionError)):
+            return True
+        status_code = getattr(error, "status_code", None)
+        if status_code is not None:
+            return status_code in RETRYABLE_STATUS_CODES
+        name = type(error).__name__
+        return any(marker in name for marker in ("Timeout", "Connection", "RateLimit", "InternalServer"))
+
+    def _record_failure(self, breaker: CircuitBreaker, error: Exception):
+        """只有服务端问题（可重试的错误）计入熔断；请求错误和排队超时只结束试探"""
+        if self.is_retryable(error):
+            breaker.record_failure()
+        else:
+            breaker.release_probe()
+
+    def _backoff(self, attempt: int) -> float:
+        """全抖动指数退避"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _run_with_timeout(self, model: str, fn: Callable[[], T], timeout: float,
+                          timing: Dict[str, float]) -> T:
+        """在网关线程中执行调用；超时后槽位要等底层调用真正结束才释放"""
+        timing["queue"] += self._acquire(model, time.monotonic() + timeout)
+        try:
+            future = self._executor.submit(fn)
+        except Exception:
+            self._release(model)
+            raise
+        future.add_done_callback(lambda _: self._release(model))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"模型 {model} 调用超时（{timeout}秒）")
+
+    def _record(self, model: str, caller: str, kind: str, started_at: float, started: float,
+                timing: Dict[str, float], retries: int, outcome: str, usage: Optional[Dict[str, int]] = None,
+                image_count: int = 0, payload_bytes: int = 0, error: Optional[Exception] = None):
+        """写入一次调用记录"""
+        usage = usage or {}
+        self.recorder.record(
+            caller=caller,
+            model=model,
+            kind=kind,
+            started_at=started_at,
+            latency_ms=(time.monotonic() - started) * 1000,
+            queue_ms=timing["queue"] * 1000,
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+            image_count=image_count,
+            payload_bytes=payload_bytes,
+            retries=retries,
+            outcome=outcome,
+            error=str(error)[:500] if error is not None else None
+        )
+
+    def call(self, model: str, fn: Callable[[], T], caller: str = "unknown",
+             timeout: Optional[float] = None, kind: str = "chat",
+             image_count: int = 0, payload_bytes: int = 0) -> T:
+        """经网关执行一次模型调用
+
+        Args:
+            model: 模型名称（用于按模型限流和熔断）
+            fn: 实际发起调用的无参函数
+            caller: 调用方标识（用于指标统计）
+            timeout: 单次尝试超时秒数，默认 analysis_timeout
+            kind: 调用类型（chat / vision / embedding），用于调用记录
+            image_count: 请求中的图片数，用于调用记录
+            payload_bytes: 请求负载字节数，用于调用记录
+
+        Returns:
+            fn 的返回值
+        """
+        timeout = timeout or self.timeout
+        breaker = self.breaker(model)
+        started_at = time.time()
+        started = time.monotonic()
+        timing = {"queue": 0.0}
+        attempt = 0
+        while True:
+            try:
+                breaker.before_call()
+                result = self._run_with_timeout(model, fn, timeout, timing)
+            except CircuitOpenError as e:
+                self._record(model, caller, kind, started_at, started, timing, attempt, "rejected",
+                             image_count=image_count, payload_bytes=payload_bytes, error=e)
+                raise
+            except Exception as e:
+                self._record_failure(breaker, e)
+                if attempt < self.retry_attempts and self.is_retryable(e):
+                    attempt += 1
+                    metrics.inc("model_call_retries_total", model=model)
+                    time.sleep(self._backoff(attempt))
+                    continue
+                metrics.inc("model_calls_total", model=model, caller=caller, outcome="error")
+                metrics.observe("model_call_seconds", time.monotonic() - started, model=model)
+                self._record(model, caller, kind, started_at, started, timing, attempt, "error",
+                             image_count=image_count, payload_bytes=payload_bytes, error=e)
+                raise
+            breaker.record_success()
+            metrics.inc("model_calls_total", model=model, caller=caller, outcome="success")
+            metrics.observe("model_call_seconds", time.monotonic() - started, model=model)
+            self._record(model, caller, kind, started_at, started, timing, attempt, "success",
+                         usage=extract_token_usage(result), image_count=image_count, payload_bytes=payload_bytes)
+            return result
+
+    def stream(self, model: str, fn: Callable[[], Iterator[T]], caller: str = "unknown",
+               timeout: Optional[float] = None, kind: str = "chat",
+               image_count: int = 0, payload_bytes: int = 0) -> Iterator[T]:
+        """经网关执行流式调用
+
+        在收到第一个分块之前失败可以重试；开始输出后出错直接抛出，避免重复内容。
+        分块在网关线程中读取，单次尝试从获得槽位起超过 timeout 仍未读完即按超时失败处理。
+        槽位在流结束（或调用方关闭生成器）时释放。token用量取各分块用量之和。
+        """
+        timeout = timeout or self.timeout
+        breaker = self.breaker(model)
+        started_at = time.time()
+        started = time.monotonic()
+        timing = {"queue": 0.0}
+        usage = {"input_tokens": 0, "output_tokens": 0}
+        attempt = 0
+        while True:
+            try:
+                breaker.before_call()
+            except CircuitOpenError as e:
+                self._record(model, caller, kind, started_at, started, timing, attempt, "rejected",
+                             image_count=image_count, payload_bytes=payload_bytes, error=e)
+                raise
+            try:
+                timing["queue"] += self._acquire(model, time.monotonic() + timeout)
+            except ModelGatewayError as e:
+                breaker.release_probe()
+                metrics.inc("model_calls_total", model=model, caller=caller, outcome="error")
+                self._record(model, caller, kind, started_at, started, timing, attempt, "error",
+                             usage=usage, image_count=image_count, payload_bytes=payload_bytes, error=e)
+                raise
+            reader = _StreamReader(fn)
+            deadline = time.monotonic() + timeout
+            emitted = False
+            try:
+                while True:
+                    reader.pending = self._executor.submit(reader.read)
+                    try:
+                        chunk = reader.pending.result(timeout=max(0.0, deadline - time.monotonic()))
+                    except FutureTimeoutError:
+                        raise TimeoutError(f"模型 {model} 流式调用超时（{timeout}秒）")
+                    reader.pending = None
+                    if chunk is _STREAM_END:
+                        break
+                    emitted = True
+                    for key, value in extract_token_usage(chunk).items():
+                        usage[key] += value
+                    yield chunk
+            except Exception as e:
+                self._record_failure(breaker, e)
+                if not emitted and attempt < self.retry_attempts and self.is_retryable(e):
+                    attempt += 1
+                    metrics.inc("model_call_retries_total", model=model)
+                    self._release_stream(model, reader)
+                    time.sleep(self._backoff(attempt))
+                    continue
+                metrics.inc("model_calls_total", model=model, caller=caller, outcome="error")
+                self._release_stream(model, reader)
+                self._record(model, caller, kind, started_at, started, timing, attempt, "error",
+                             usage=usage, image_count=image_count, payload_bytes=payload_bytes, error=e)
+                raise
+            except GeneratorExit:
+                breaker.release_probe()
+                self._release_stream(model, reader)
+                self._record(model, caller, kind, started_at, started, timing, attempt, "cancelled",
+                             usage=usage, image_count=image_count, payload_bytes=payload_bytes)
+                raise
+            breaker.record_success()
+            metrics.inc("model_calls_total", model=model, caller=caller, outcome="success")
+            metrics.observe("model_call_seconds", time.monotonic() - started, model=model)
+            self._release_stream(model, reader)
+            self._record(model, caller, kind, started_at, started, timing, attempt, "success",
+                         usage=usage, image_count=image_count, payload_bytes=payload_bytes)
+            return
+
+    async def acall(self, model: str, fn: Callable[[], T], caller: str = "unknown",
+                    timeout: Optional[float] = None, **record_fields) -> T:
+        """异步调用方使用的入口，与同步调用共享并发槽位和熔断状态"""
+        return await asyncio.to_thread(self.call, model, fn, caller, timeout, **record_fields)
+
+    def status(self) -> Dict[str, Any]:
+        """网关当前状态（各模型熔断状态）"""
+        with self._lock:
+            models = list(self._breakers.keys())
+        return {
+            "max_concurrency": self.max_concurrency,
+            "per_model_concurrency": self.per_model_concurrency,
+            "breakers": {model: self.breaker(model).state for model in models}
+        }
+
+
+_gateway: Optional[ModelGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_model_gateway() -> ModelGateway:
+    """获取进程内共享的模型网关"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = ModelGateway()
+    return _gateway
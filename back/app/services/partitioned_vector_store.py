@@ -0,0 +1,245 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.config import settings
+from app.db.database import SessionLocal
+from app.models.vector_partition import VectorPartition
+from app.services.vector_backend import VectorBackend, group_by_where
+
+RESULT_FIELDS = ("ids", "documents", "metadatas", "embeddings")
+
+
+def partition_collection_name(base_collection: str, product_name: str) -> str:
+    """产品分区的物理集合名称（产品名可能含中文或特殊字符，用哈希保证是合法的集合名）"""
+    digest = hashlib.sha1(product_name.encode("utf-8")).hexdigest()[:12]
+    return f"{base_collection}_p{digest}"
+
+
+def list_partitions(base_collection: str) -> Dict[str, str]:
+    """逻辑集合已有的分区: 产品名称 -> 物理集合名称"""
+    db = SessionLocal()
+    try:
+        rows = db.query(VectorPartition.product_name, VectorPartition.collection_name).filter(
+            VectorPartition.base_collection == base_collection
+        ).order_by(VectorPartition.product_name).all()
+        return {product_name: collection_name for product_name, collection_name in rows}
+    except OperationalError:
+        # 表尚未创建（create_tables 之前）
+        return {}
+    finally:
+        db.close()
+
+
+def register_partition(base_collection: str, product_name: str) -> str:
+    """登记产品分区（已存在时直接返回），返回物理集合名称"""
+    collection_name = partition_collection_name(base_collection, product_name)
+    db = SessionLocal()
+    try:
+        exists = db.query(VectorPartition.id).filter(
+            VectorPartition.base_collection == base_collection,
+            VectorPartition.product_name == product_name
+        ).first()
+        if not exists:
+            db.add(VectorPartition(base_collection=base_collection, product_name=product_name,
+                                   collection_name=collection_name))
+            try:
+                db.commit()
+            except IntegrityError:
+                # 并发登记同一分区
+                db.rollback()
+        return collection_name
+    finally:
+        db.close()
+
+
+def remove_partitions(base_collection: str):
+    db = SessionLocal()
+    try:
+        db.query(VectorPartition).filter(VectorPartition.base_collection == base_collection).delete(
+            synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def where_products(where: Optional[Dict[str, Any]]) -> Optional[Set[str]]:
+    """where 子句限定的产品集合，未限定产品时返回None"""
+    if not where:
+        return None
+    products = None
+    for key, condition in where.items():
+        if key == "$and":
+            for clause in condition:
+                clause_products = where_products(clause)
+                if clause_products is not None:
+                    products = clause_products if products is None else products & clause_products
+        elif key == "product_name":
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            if "$eq" in condition:
+                clause_products = {condition["$eq"]}
+            elif "$in" in condition:
+                clause_products = set(condition["$in"])
+            else:
+                continue
+            products = clause_products if products is None else products & clause_products
+    return products
+
+
+class PartitionedVectorBackend(VectorBackend):
+    """按产品分区的向量存储
+
+    每个产品的文档存放在独立的物理集合中（映射记录在 vector_partitions 表）。
+    限定产品的查询只检索对应分区；未限定产品时并行检索所有分区，按距离合并取前k个。
+    启用分区前写入的文档仍留在与逻辑集合同名的旧集合中，读取和检索时一并包含，
+    直至用 migrate_vector_partitions.py 迁移完毕。
+    未配置 vector_partition_by_product 的进程由 ClientRegistry 定期检查 vector_partitions 表，
+    迁移开始后最多 PARTITION_CHECK_INTERVAL 秒改用分区存储；在此之前它们只能看到旧集合中尚未迁移的文档。
+    """
+
+    def __init__(self, base_collection: str, open_collection: Callable[[str], VectorBackend],
+                 embedding_function: Embeddings, search_workers: Optional[int] = None):
+        self.base_collection = base_collection
+        self.open_collection = open_collection
+        self.embedding_function = embedding_function
+        self.search_workers = max(1, search_workers or settings.vector_partition_search_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def legacy(self) -> VectorBackend:
+        """启用分区前的未分区集合"""
+        return self.open_collection(self.base_collection)
+
+    def partition(self, product_name: str) -> VectorBackend:
+        """产品对应的分区，不存在时登记并创建"""
+        return self.open_collection(register_partition(self.base_collection, product_name))
+
+    def _targets(self, where: Optional[Dict[str, Any]] = None) -> List[VectorBackend]:
+        """需要访问的集合：where 限定的产品分区，以及仍有数据的旧集合"""
+        products = where_products(where)
+        targets = [
+            self.open_collection(collection_name)
+            for product_name, collection_name in list_partitions(self.base_collection).items()
+            if products is None or product_name in products
+        ]
+        legacy = self.legacy
+        if legacy.count():
+            targets.append(legacy)
+        return targets
+
+    def _map(self, function: Callable[[VectorBackend], Any], targets: List[VectorBackend]) -> List[Any]:
+        """在各集合上并行执行"""
+        if len(targets) <= 1:
+            return [function(target) for target in targets]
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.search_workers,
+                                                        thread_name_prefix="vector-partition")
+        return list(self._executor.map(function, targets))
+
+    def add_texts(self, texts, metadatas=None, ids=None, embeddings=None):
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        if ids is None:
+            raise ValueError("分区存储写入时必须提供文档ID")
+        ids = list(ids)
+        # 所有分区的文档一次批量计算向量
+        if embeddings is None:
+            embeddings = self.embedding_function.embed_documents(texts)
+
+        groups: Dict[str, List[int]] = {}
+        for index, metadata in enumerate(metadatas):
+            groups.setdefault((metadata or {}).get("product_name") or "", []).append(index)
+        for product_name, indexes in groups.items():
+            self.partition(product_name).add_texts(
+                [texts[i] for i in indexes],
+                metadatas=[metadatas[i] for i in indexes],
+                ids=[ids[i] for i in indexes],
+                embeddings=[list(embeddings[i]) for i in indexes]
+            )
+
+        # 覆盖写入旧集合中的同ID文档时，去掉旧副本
+        legacy = self.legacy
+        if legacy.count():
+            legacy.delete(ids)
+        return ids
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        result: Dict[str, Any] = {field: [] for field in RESULT_FIELDS}
+        skip = offset or 0
+        remaining = limit
+        for target in self._targets(where):
+            if remaining is not None and remaining <= 0:
+                break
+            page = target.get(ids=ids, where=where, limit=remaining, offset=skip, include=include)
+            if page["ids"]:
+                skip = 0
+            elif skip:
+                # 本分区的匹配文档全部被offset跳过
+                skip = max(0, skip - len(target.get(ids=ids, where=where, include=[])["ids"]))
+            for field in RESULT_FIELDS:
+                if page.get(field) is not None:
+                    result[field].extend(list(page[field]))
+            if remaining is not None:
+                remaining -= len(page["ids"])
+
+        for field in ("documents", "metadatas", "embeddings"):
+            if field not in include:
+                result[field] = None
+        return result
+
+    def delete(self, ids):
+        if not ids:
+            return
+        ids = list(ids)
+        self._map(lambda target: target.delete(ids), self._targets())
+
+    def count(self):
+        return sum(target.count() for target in self._targets())
+
+    def search_by_vector(self, embedding, k=4, where=None) -> List[Tuple[Document, float]]:
+        partial = self._map(lambda target: target.search_by_vector(embedding, k=k, where=where),
+                            self._targets(where))
+        return self._merge(partial, k)
+
+    def search_by_vectors(self, embeddings, k=4, wheres=None):
+        results: List[List[Tuple[Document, float]]] = [[] for _ in embeddings]
+        for where, indexes in group_by_where(wheres, len(embeddings)):
+            vectors = [embeddings[index] for index in indexes]
+            partial = self._map(lambda target: target.search_by_vectors(vectors, k=k, wheres=[where] * len(vectors)),
+                                self._targets(where))
+            for position, index in enumerate(indexes):
+                results[index] = self._merge([hits[position] for hits in partial], k)
+        return results
+
+    @staticmethod
+    def _merge(partial: List[List[Tuple[Document, float]]], k: int) -> List[Tuple[Document, float]]:
+        """合并各集合的结果取前k个（迁移过程中同一文档可能短暂同时存在于旧集合和分区，按ID去重）"""
+        best: Dict[str, Tuple[Document, float]] = {}
+        for results in partial:
+            for doc, distance in results:
+                key = doc.id or str(id(doc))
+                if key not in best or distance < best[key][1]:
+                    best[key] = (doc, distance)
+        return sorted(best.values(), key=lambda item: item[1])[:k]
+
+    def close(self):
+        """停止并行检索的线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def delete_collection(self):
+        for target in self._targets():
+            target.delete_collection()
+        remove_partitions(self.base_collection)
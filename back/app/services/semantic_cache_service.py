@@ -0,0 +1,232 @@
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import func
+
+from app.config import settings
+from app.db.database import SessionLocal
+from app.models.semantic_cache_entry import SemanticCacheEntry
+from app.models.video_stage import VideoStage
+from app.utils.metrics import metrics
+from app.utils.text_similarity import embedding_to_bytes, stack_embeddings
+
+metrics.describe("semantic_cache_requests_total", "语义报告缓存的查询次数（按命中结果）")
+metrics.describe("semantic_cache_evictions_total", "语义报告缓存淘汰的条目数（按原因）")
+
+
+class _EntryMatrix:
+    """同一模型、同一产品过滤条件下全部缓存查询的归一化向量矩阵"""
+
+    def __init__(self, signature: Tuple[int, int], rows: List[Tuple[int, float, float, bytes]]):
+        self.signature = signature
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.created_at = np.array([row[1] for row in rows], dtype=np.float64)
+        self.thresholds = np.array([row[2] for row in rows], dtype=np.float64)
+        matrix = stack_embeddings([row[3] for row in rows]) if rows else np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = (matrix / norms).astype(np.float32)
+
+
+# 进程内共享的向量矩阵: (embedding_model, product_name) -> _EntryMatrix
+_matrices: Dict[Tuple[str, str], _EntryMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def _invalidate_matrices(product_name: Optional[str] = None):
+    """写入或删除条目后丢弃对应的矩阵，下次查询时重新加载"""
+    with _matrices_lock:
+        for key in list(_matrices.keys()):
+            if product_name is None or key[1] == product_name:
+                del _matrices[key]
+
+
+class SemanticReportCache:
+    """按查询语义相似度复用对比报告的缓存
+
+    查询向量与同一产品过滤条件、同一阈值下的已缓存查询做余弦相似度比较，
+    超过 semantic_cache_similarity 且报告引用的阶段仍全部存在时返回缓存报告。
+    每次读写使用独立的数据库会话，不影响调用方的事务。
+
+    已缓存查询的向量在进程内按 (模型, 产品) 保存为归一化矩阵，一次矩阵乘法完成打分；
+    本进程写入时直接失效，其他进程的写入通过条目数和最大ID的变化发现。
+    """
+
+    def __init__(self, embedding_model: str, similarity: Optional[float] = None,
+                 ttl: Optional[int] = None, max_size: Optional[int] = None):
+        self.embedding_model = embedding_model
+        self.similarity = similarity if similarity is not None else settings.semantic_cache_similarity
+        self.ttl = ttl if ttl is not None else settings.semantic_cache_ttl
+        self.max_size = max_size if max_size is not None else settings.semantic_cache_max_size
+
+    def lookup(self, query_vector: List[float], product_name: Optional[str],
+               similarity_threshold: float) -> Optional[Dict[str, Any]]:
+        """查找语义相近的已缓存报告
+
+        Returns:
+            命中时返回缓存的报告（附带 matched_query 和 query_similarity），否则返回None
+        """
+        now = time.time()
+        product_name = product_name or ""
+        db = SessionLocal()
+        try:
+            entries = self._entry_matrix(db, product_name)
+            if len(entries.ids):
+                query = np.asarray(query_vector, dtype=np.float32)
+                query_norm = float(np.linalg.norm(query)) or 1.0
+                scores = entries.matrix @ (query / query_norm)
+                valid = (entries.created_at >= now - self.ttl) & np.isclose(
+                    entries.thresholds, similarity_threshold, rtol=0.0, atol=1e-9
+                )
+                scores[~valid] = -np.inf
+                # 从最相似的候选开始，跳过引用了已删除阶段的报告
+                candidates = np.flatnonzero(scores >= self.similarity)
+                for index in candidates[np.argsort(-scores[candidates])]:
+                    entry = db.query(SemanticCacheEntry).filter(SemanticCacheEntry.id == int(entries.ids[index])).first()
+                    if entry is None:
+                        # 已被其他进程淘汰
+                        continue
+                    if not self._sources_valid(db, json.loads(entry.source_stage_ids)):
+                        db.delete(entry)
+                        db.commit()
+                        _invalidate_matrices(product_name)
+                        metrics.inc("semantic_cache_evictions_total", reason="stale")
+                        continue
+
+                    entry.last_accessed_at = now
+                    entry.hit_count += 1
+                    report = json.loads(entry.report)
+                    report.update({
+                        "matched_query": entry.query,
+                        "query_similarity": round(float(scores[index]), 4)
+                    })
+                    db.commit()
+                    metrics.inc("semantic_cache_requests_total", result="hit")
+                    return report
+
+            metrics.inc("semantic_cache_requests_total", result="miss")
+            return None
+        finally:
+            db.close()
+
+    def store(self, query: str, query_vector: List[float], product_name: Optional[str],
+              similarity_threshold: float, report: Dict[str, Any]):
+        """缓存报告，记录其引用的阶段ID"""
+        now = time.time()
+        stage_ids = sorted({
+            source["stage_id"] for source in report.get("sources", [])
+            if source.get("stage_id") is not None
+        })
+        db = SessionLocal()
+        try:
+            db.add(SemanticCacheEntry(
+                product_name=product_name or "",
+                similarity_threshold=similarity_threshold,
+                query=query,
+                embedding=embedding_to_bytes(query_vector),
+                embedding_model=self.embedding_model,
+                report=json.dumps(report, ensure_ascii=False, default=float),
+                source_stage_ids=json.dumps(stage_ids),
+                created_at=now,
+                last_accessed_at=now,
+                hit_count=0
+            ))
+            db.flush()
+            self._evict(db, now)
+            db.commit()
+        finally:
+            db.close()
+        _invalidate_matrices()
+
+    def clear(self, product_name: Optional[str] = None) -> int:
+        """清空缓存；指定产品时只清除该产品过滤条件下的条目"""
+        db = SessionLocal()
+        try:
+            query = db.query(SemanticCacheEntry)
+            if product_name is not None:
+                query = query.filter(SemanticCacheEntry.product_name == product_name)
+            deleted = query.delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        _invalidate_matrices(product_name)
+        return deleted
+
+    def _entry_matrix(self, db, product_name: str) -> _EntryMatrix:
+        """当前模型和产品的向量矩阵，条目数或最大ID变化（其他进程写入或淘汰）时重新加载"""
+        condition = (
+            SemanticCacheEntry.product_name == product_name,
+            SemanticCacheEntry.embedding_model == self.embedding_model
+        )
+        count, max_id = db.query(func.count(SemanticCacheEntry.id), func.max(SemanticCacheEntry.id)).filter(
+            *condition
+        ).one()
+        signature = (count, max_id or 0)
+        key = (self.embedding_model, product_name)
+        with _matrices_lock:
+            entries = _matrices.get(key)
+        if entries is not None and entries.signature == signature:
+            return entries
+
+        rows = db.query(
+            SemanticCacheEntry.id, SemanticCacheEntry.created_at,
+            SemanticCacheEntry.similarity_threshold, SemanticCacheEntry.embedding
+        ).filter(*condition).all()
+        entries = _EntryMatrix(signature, rows)
+        with _matrices_lock:
+            _matrices[key] = entries
+        return entries
+
+    @staticmethod
+    def _sources_valid(db, stage_ids: List[int]) -> bool:
+        """报告引用的阶段是否仍全部存在"""
+        if not stage_ids:
+            return True
+        existing = db.query(VideoStage.id).filter(VideoStage.id.in_(stage_ids)).count()
+        return existing == len(stage_ids)
+
+    def _evict(self, db, now: float):
+        """淘汰过期条目，并按最近访问时间淘汰超出容量的条目"""
+        expired = db.query(SemanticCacheEntry).filter(
+            SemanticCacheEntry.created_at < now - self.ttl
+        ).delete(synchronize_session=False)
+        if expired:
+            metrics.inc("semantic_cache_evictions_total", expired, reason="ttl")
+
+        overflow = db.query(SemanticCacheEntry).count() - self.max_size
+        if overflow > 0:
+            stale_ids = [
+                row[0] for row in db.query(SemanticCacheEntry.id).order_by(
+                    SemanticCacheEntry.last_accessed_at
+                ).limit(overflow).all()
+            ]
+            db.query(SemanticCacheEntry).filter(
+                SemanticCacheEntry.id.in_(stale_ids)
+            ).delete(synchronize_session=False)
+            metrics.inc("semantic_cache_evictions_total", len(stale_ids), reason="size")
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计：各产品的条目数和整体命中率"""
+        hits = metrics.get_counter("semantic_cache_requests_total", result="hit")
+        misses = metrics.get_counter("semantic_cache_requests_total", result="miss")
+        db = SessionLocal()
+        try:
+            by_product = dict(db.query(
+                SemanticCacheEntry.product_name, func.count(SemanticCacheEntry.id)
+            ).group_by(SemanticCacheEntry.product_name).all())
+        finally:
+            db.close()
+
+        total = hits + misses
+        return {
+            "size": sum(by_product.values()),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "similarity": self.similarity,
+            "entries_by_product": by_product,
+            "hits": int(hits),
+            "misses": int(misses),
+            "hit_rate": round(hits / total, 4) if total else 0.0
+        }
@@ -8,6 +8,8 @@ from lark_oapi.api.docx.v1 import *
 # 加载环境变量
 load_dotenv()
 
+from app.config import settings
+
 class SimpleFeishuService:
     """
     简化的飞书文档服务类，只提供基本的创建文档和添加内容功能
@@ -18,16 +20,23 @@ class SimpleFeishuService:
         # 从环境变量获取配置
         self.app_id = os.getenv('FEISHU_APP_ID')
         self.app_secret = os.getenv('FEISHU_APP_SECRET')
+        local_server = settings.local_model_server_url.rstrip('/')
+        if local_server:
+            # 本地替身服务器不校验应用凭证
+            self.app_id = self.app_id or 'cli_local'
+            self.app_secret = self.app_secret or 'local'
         
         if not self.app_id or not self.app_secret:
             raise ValueError("请在.env文件中配置FEISHU_APP_ID和FEISHU_APP_SECRET")
         
         # 创建client
-        self.client = lark.Client.builder() \
+        builder = lark.Client.builder() \
             .app_id(self.app_id) \
             .app_secret(self.app_secret) \
-            .log_level(lark.LogLevel.INFO) \
-            .build()
+            .log_level(lark.LogLevel.INFO)
+        if local_server:
+            builder = builder.domain(local_server)
+        self.client = builder.build()
     
     def get_access_token(self):
         """
@@ -1,13 +1,14 @@
 import os
-import base64
+import hashlib
 import cv2
 import json
+import math
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 from sqlalchemy.orm import Session
 from skimage.metrics import structural_similarity as ssim
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -16,66 +17,204 @@ load_dotenv()
 from app.models.video_file import VideoFile
 from app.models.video_frame import VideoFrame
 from app.models.video_stage import VideoStage
+from app.models.video_analysis_run import VideoAnalysisRun
 from app.services.video_service import VideoFileService, VideoStageService
 from app.services.video_rag_service import VideoRAGService
+from app.services.stage_embedding_service import StageEmbeddingService
+from app.services.cache_service import PersistentCache, make_cache_key, model_identity
+from app.services.model_gateway import get_model_gateway
+from app.services.client_registry import ClientRegistry, get_client_registry
+from app.config import settings
+from app.utils.image_payload import optimize_image_payload
 
 
 class SSIMVideoAnalysisService:
     """基于SSIM的视频分析服务"""
     
-    def __init__(self, db: Session):
+    # 阶段分析提示词模板版本，修改提示词时需同步递增以使旧的缓存结果失效
+    STAGE_PROMPT_VERSION = "stage-analysis-v1"
+    
+    ANALYSIS_MODES = ("single", "windowed")
+    
+    def __init__(self, db: Session, registry: Optional[ClientRegistry] = None):
         self.db = db
+        registry = registry or get_client_registry()
         self.video_file_service = VideoFileService(db)
         self.video_stage_service = VideoStageService(db)
-        self.rag_service = VideoRAGService(db)
+        self.rag_service = VideoRAGService(db, registry)
+        self.stage_embedding_service = StageEmbeddingService(db, registry)
         
-        # 初始化LangChain ChatOpenAI客户端
-        self.llm = ChatOpenAI(
-            model_name=os.getenv("ARK_MODEL", "doubao-1-5-vision-pro-250328"),
-            openai_api_key=os.getenv("ARK_API_KEY"),
-            openai_api_base=os.getenv("ARK_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3"),
-        )
+        # 共享的视觉模型客户端
+        self.llm = registry.vision_llm
+        self.gateway = get_model_gateway()
+        
+        # 视觉模型响应缓存
+        self.vision_cache = PersistentCache("vision_stage_analysis")
     
     def analyze_video_with_ssim(self, video_id: int, product_name: str, 
-                               frame_interval: int = 30, ssim_threshold: float = 0.75) -> Dict[str, Any]:
+                               frame_interval: int = 30, ssim_threshold: float = 0.75,
+                               force: bool = False, analysis_mode: str = "single") -> Dict[str, Any]:
         """使用SSIM分析视频并生成阶段信息
         
+        内容重复的上传共享首次上传文件的分析结果；参数完全相同的分析直接返回已有结果。
+        
         Args:
             video_id: 视频文件ID
             product_name: 产品名称（用于向量存储的metadata）
             frame_interval: 帧间隔（多少帧检测一次）
             ssim_threshold: SSIM阈值
+            force: 是否忽略已有结果强制重新分析
+            analysis_mode: single 一次性分析全部关键帧；windowed 按重叠窗口边解码边并发分析后合并
             
         Returns:
             分析结果字典
         """
+        result = None
+        for event in self._analysis_events(
+            video_id, product_name, frame_interval, ssim_threshold, force, analysis_mode, stream_llm=False
+        ):
+            if event["type"] == "result":
+                result = event["data"]
+        return result
+    
+    def analyze_video_with_ssim_stream(self, video_id: int, product_name: str,
+                                       frame_interval: int = 30, ssim_threshold: float = 0.75,
+                                       force: bool = False, analysis_mode: str = "single") -> Iterator[str]:
+        """流式分析视频，以SSE格式逐步返回分析进度
+        
+        事件类型依次为：start、progress（解码进度）、keyframe（每发现一个关键帧）、frames_saved、
+        stage_chunk（模型流式输出）或 window_result（窗口化模式每个窗口完成）、stages、stages_saved、
+        rag_stored、result；出错时返回 error。参数与 analyze_video_with_ssim 相同。
+        
+        Yields:
+            SSE格式的事件数据
+        """
+        try:
+            for event in self._analysis_events(
+                video_id, product_name, frame_interval, ssim_threshold, force, analysis_mode, stream_llm=True
+            ):
+                yield self._format_sse(event)
+        except Exception as e:
+            self.db.rollback()
+            yield self._format_sse({
+                "type": "error",
+                "error": str(e),
+                "message": f"分析过程中发生错误: {str(e)}"
+            })
+    
+    @staticmethod
+    def _format_sse(event: Dict[str, Any]) -> str:
+        return f"data: {json.dumps(event, ensure_ascii=False, default=float)}\n\n"
+    
+    def _analysis_events(self, video_id: int, product_name: str, frame_interval: int, ssim_threshold: float,
+                         force: bool, analysis_mode: str, stream_llm: bool) -> Iterator[Dict[str, Any]]:
+        """执行SSIM分析并逐步产出分析事件，最后一个事件为 result
+        
+        关键帧检测到即保存并产出；窗口化模式下每凑满一个窗口就提交并发分析，解码继续进行。
+        
+        Args:
+            stream_llm: 一次性分析时是否以流式调用视觉模型并产出输出分块
+        """
         # 获取视频文件
         video_file = self.video_file_service.get_video_file(video_id)
         if not video_file:
             raise ValueError(f"视频文件不存在: {video_id}")
         
+        source_id = video_file.analysis_source_id
+        
+        if analysis_mode not in self.ANALYSIS_MODES:
+            raise ValueError(f"不支持的分析模式: {analysis_mode}")
+        
+        if not force:
+            previous_run = self._find_previous_run(
+                source_id, product_name, frame_interval, ssim_threshold, analysis_mode
+            )
+            if previous_run:
+                result = json.loads(previous_run.result)
+                result.update({
+                    "video_id": video_id,
+                    "source_video_id": source_id,
+                    "reused_analysis": True
+                })
+                yield {"type": "result", "data": result}
+                return
+        
         if not os.path.exists(video_file.file_path):
             raise ValueError(f"视频文件路径不存在: {video_file.file_path}")
         
-        # 提取关键帧
-        keyframes_info = self._extract_ssim_keyframes(
-            video_file.file_path, frame_interval, ssim_threshold
-        )
+        yield {
+            "type": "start",
+            "video_id": video_id,
+            "source_video_id": source_id,
+            "analysis_mode": analysis_mode,
+            "frame_interval": frame_interval,
+            "ssim_threshold": ssim_threshold
+        }
         
-        # 保存关键帧到数据库和文件系统
-        saved_frames = self._save_keyframes_to_db(video_id, keyframes_info)
+        windowed = analysis_mode == "windowed"
+        window_size = max(2, settings.stage_window_size)
+        overlap = min(max(0, settings.stage_window_overlap), window_size - 1)
+        executor = ThreadPoolExecutor(max_workers=max(1, settings.stage_window_concurrency)) if windowed else None
+        window = []
+        futures = []
+        keyframes_info = []
+        saved_frames = []
         
-        # 使用AI分析关键帧生成阶段信息
-        stage_analysis = self._analyze_stages_with_ai(keyframes_info)
+        try:
+            for kind, payload in self._scan_ssim_frames(video_file.file_path, frame_interval, ssim_threshold):
+                if kind == "progress":
+                    yield {"type": "progress", **payload}
+                    continue
+                
+                # 关键帧检测到即保存，客户端可以立即展示
+                keyframes_info.append(payload)
+                saved_frame = self._save_keyframe(source_id, len(keyframes_info), payload)
+                saved_frames.append(saved_frame)
+                yield {"type": "keyframe", "index": len(keyframes_info), **saved_frame}
+                
+                if windowed:
+                    window.append(payload)
+                    if len(window) >= window_size:
+                        futures.append(executor.submit(self._analyze_stages_with_ai, list(window), True))
+                        window = window[len(window) - overlap:] if overlap else []
+            
+            self.db.commit()
+            yield {"type": "frames_saved", "total_keyframes": len(saved_frames)}
+            
+            if windowed:
+                # 剩余关键帧（不只是上一窗口的重叠部分）组成最后一个窗口
+                if len(window) > overlap or (window and not futures):
+                    futures.append(executor.submit(self._analyze_stages_with_ai, list(window), True))
+                for completed, future in enumerate(as_completed(futures), 1):
+                    yield {
+                        "type": "window_result",
+                        "completed": completed,
+                        "total_windows": len(futures),
+                        "stage_analysis": future.result()
+                    }
+                stage_analysis = self._merge_window_stages([future.result() for future in futures])
+            elif stream_llm:
+                stage_analysis = yield from self._stream_stages_with_ai(keyframes_info)
+            else:
+                stage_analysis = self._analyze_stages_with_ai(keyframes_info)
+        finally:
+            if executor:
+                # 客户端中途断开时不再等待未开始的窗口
+                executor.shutdown(wait=False, cancel_futures=True)
+        
+        yield {"type": "stages", "stage_analysis": stage_analysis}
         
         # 保存阶段信息到数据库
-        saved_stages = self._save_stages_to_db(video_id, stage_analysis)
+        saved_stages = self._save_stages_to_db(source_id, stage_analysis)
+        yield {"type": "stages_saved", "saved_stages": saved_stages}
         
         # 存储到向量数据库
-        rag_result = self.rag_service.store_video_analysis(video_id, product_name, stage_analysis)
+        rag_result = self.rag_service.store_video_analysis(source_id, product_name, stage_analysis)
+        yield {"type": "rag_stored", "rag_storage": rag_result}
         
-        return {
+        result = {
             "video_id": video_id,
+            "source_video_id": source_id,
             "product_name": product_name,
             "total_keyframes": len(saved_frames),
             "keyframes": saved_frames,
@@ -83,8 +222,48 @@ class SSIMVideoAnalysisService:
             "saved_stages": saved_stages,
             "rag_storage": rag_result,
             "ssim_threshold": ssim_threshold,
-            "frame_interval": frame_interval
+            "frame_interval": frame_interval,
+            "analysis_mode": analysis_mode
         }
+        
+        self._save_analysis_run(source_id, product_name, frame_interval, ssim_threshold, analysis_mode, result)
+        
+        result["reused_analysis"] = False
+        yield {"type": "result", "data": result}
+    
+    def _find_previous_run(self, video_id: int, product_name: str, frame_interval: int,
+                           ssim_threshold: float, analysis_mode: str = "single") -> Optional[VideoAnalysisRun]:
+        """查找参数完全相同的已有分析记录"""
+        runs = self.db.query(VideoAnalysisRun).filter(
+            VideoAnalysisRun.video_file_id == video_id,
+            VideoAnalysisRun.product_name == product_name,
+            VideoAnalysisRun.frame_interval == frame_interval
+        ).order_by(VideoAnalysisRun.id.desc()).all()
+        
+        for run in runs:
+            # 旧记录没有分析模式，均为一次性分析
+            run_mode = run.analysis_mode or "single"
+            if run_mode == analysis_mode and math.isclose(run.ssim_threshold, ssim_threshold, abs_tol=1e-9):
+                return run
+        return None
+    
+    def _save_analysis_run(self, video_id: int, product_name: str, frame_interval: int,
+                           ssim_threshold: float, analysis_mode: str, result: Dict[str, Any]):
+        """记录分析参数和结果，供重复分析请求复用"""
+        # 只有完整成功的分析才值得复用
+        if not result["rag_storage"].get("success"):
+            return
+        
+        db_run = VideoAnalysisRun(
+            video_file_id=video_id,
+            product_name=product_name,
+            frame_interval=frame_interval,
+            ssim_threshold=ssim_threshold,
+            analysis_mode=analysis_mode,
+            result=json.dumps(result, ensure_ascii=False, default=float)
+        )
+        self.db.add(db_run)
+        self.db.commit()
     
     def delete_video_analysis(self, video_id: int) -> Dict[str, Any]:
         """删除视频的分析结果
@@ -114,6 +293,10 @@ class SSIMVideoAnalysisService:
             VideoStage.video_file_id == video_id
         ).delete()
         
+        self.db.query(VideoAnalysisRun).filter(
+            VideoAnalysisRun.video_file_id == video_id
+        ).delete()
+        
         self.db.commit()
         
         # 从向量数据库中删除
@@ -127,9 +310,9 @@ class SSIMVideoAnalysisService:
             "message": f"成功删除视频 {video_id} 的分析结果"
         }
     
-    def _extract_ssim_keyframes(self, video_path: str, frame_interval: int, 
-                               ssim_threshold: float) -> List[Dict[str, Any]]:
-        """使用SSIM提取关键帧"""
+    def _scan_ssim_frames(self, video_path: str, frame_interval: int,
+                          ssim_threshold: float) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """按间隔解码视频，产出 ("keyframe", 关键帧) 和 ("progress", 解码进度)"""
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
             raise ValueError(f"无法打开视频文件: {video_path}")
@@ -139,20 +322,25 @@ class SSIMVideoAnalysisService:
             total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
             video_duration = total_frames / fps  # 视频总时长（秒）
             
-            keyframes_info = []
+            # 解码进度大约每2%报告一次
+            progress_step = max(frame_interval, total_frames // 50)
+            next_progress = progress_step
+            
             prev_frame = None
             last_keyframe_index = 0
+            has_keyframe = False
             
             # 读取第一帧作为参考
             cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
             ret, first_frame = cap.read()
             if ret:
-                keyframes_info.append({
+                yield "keyframe", {
                     "frame_number": 0,
                     "timestamp": 0.0,
                     "frame_data": first_frame,
                     "ssim_score": 1.0
-                })
+                }
+                has_keyframe = True
                 prev_frame = first_frame
                 last_keyframe_index = 0
             
@@ -168,17 +356,22 @@ class SSIMVideoAnalysisService:
                     # 如果相似度低于阈值，认为是关键帧
                     if similarity < ssim_threshold:
                         timestamp = i / fps
-                        keyframes_info.append({
+                        yield "keyframe", {
                             "frame_number": i,
                             "timestamp": timestamp,
                             "frame_data": current_frame,
                             "ssim_score": similarity
-                        })
+                        }
+                        has_keyframe = True
                         prev_frame = current_frame
                         last_keyframe_index = i
+                
+                if i >= next_progress:
+                    next_progress = i + progress_step
+                    yield "progress", self._progress_payload(i, total_frames)
             
             # 处理最后一个阶段：如果最后一个关键帧不是视频结尾，添加结束帧
-            if len(keyframes_info) > 0 and last_keyframe_index < total_frames - frame_interval:
+            if has_keyframe and last_keyframe_index < total_frames - frame_interval:
                 # 读取最后一帧
                 cap.set(cv2.CAP_PROP_POS_FRAMES, total_frames - 1)
                 ret, last_frame = cap.read()
@@ -187,19 +380,27 @@ class SSIMVideoAnalysisService:
                     last_similarity = self._calculate_ssim(prev_frame, last_frame)
                     
                     # 添加视频结束帧作为最后阶段的结束点
-                    keyframes_info.append({
+                    yield "keyframe", {
                         "frame_number": total_frames - 1,
                         "timestamp": video_duration,
                         "frame_data": last_frame,
                         "ssim_score": last_similarity,
                         "is_end_frame": True  # 标记为结束帧
-                    })
+                    }
             
-            return keyframes_info
+            yield "progress", self._progress_payload(total_frames, total_frames)
             
         finally:
             cap.release()
     
+    @staticmethod
+    def _progress_payload(processed_frames: int, total_frames: int) -> Dict[str, Any]:
+        return {
+            "processed_frames": processed_frames,
+            "total_frames": total_frames,
+            "progress": round(processed_frames / total_frames, 4) if total_frames else 1.0
+        }
+    
     def _calculate_ssim(self, frame1: np.ndarray, frame2: np.ndarray) -> float:
         """计算两帧之间的SSIM相似度"""
         # 转换为灰度图
@@ -214,73 +415,119 @@ class SSIMVideoAnalysisService:
         similarity = ssim(gray1, gray2)
         return similarity
     
-    def _encode_image_to_base64(self, image: np.ndarray) -> str:
-        """将图片转为Base64编码"""
-        _, buffer = cv2.imencode('.jpg', image)
-        return base64.b64encode(buffer).decode('utf-8')
-    
-    def _save_keyframes_to_db(self, video_id: int, keyframes_info: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """保存关键帧到数据库和文件系统"""
+    def _save_keyframe(self, video_id: int, index: int, keyframe: Dict[str, Any]) -> Dict[str, Any]:
+        """保存单个关键帧图片并写入数据库（不提交事务）"""
         # 创建输出目录
         output_dir = f"static/cut_files/video_{video_id}"
         os.makedirs(output_dir, exist_ok=True)
         
-        saved_frames = []
+        # 保存帧图片
+        frame_filename = f"keyframe_{index:02d}_time_{keyframe['timestamp']*1000:.0f}ms.jpg"
+        frame_path = os.path.join(output_dir, frame_filename)
         
-        for i, keyframe in enumerate(keyframes_info):
-            # 保存帧图片
-            frame_filename = f"keyframe_{i+1:02d}_time_{keyframe['timestamp']*1000:.0f}ms.jpg"
-            frame_path = os.path.join(output_dir, frame_filename)
-            
-            cv2.imwrite(frame_path, keyframe['frame_data'])
-            
-            # 保存到数据库
-            db_frame = VideoFrame(
-                video_file_id=video_id,
-                frame_number=keyframe['frame_number'],
-                timestamp=keyframe['timestamp'],
-                frame_path=frame_path,
-                width=keyframe['frame_data'].shape[1],
-                height=keyframe['frame_data'].shape[0]
-            )
-            
-            self.db.add(db_frame)
-            self.db.flush()  # 获取ID
-            
-            saved_frames.append({
-                "id": db_frame.id,
-                "frame_number": keyframe['frame_number'],
-                "timestamp": keyframe['timestamp'],
-                "frame_path": frame_path,
-                "ssim_score": keyframe['ssim_score']
-            })
+        cv2.imwrite(frame_path, keyframe['frame_data'])
         
-        self.db.commit()
-        return saved_frames
+        # 保存到数据库
+        db_frame = VideoFrame(
+            video_file_id=video_id,
+            frame_number=keyframe['frame_number'],
+            timestamp=keyframe['timestamp'],
+            frame_path=frame_path,
+            width=keyframe['frame_data'].shape[1],
+            height=keyframe['frame_data'].shape[0]
+        )
+        
+        self.db.add(db_frame)
+        self.db.flush()  # 获取ID
+        
+        return {
+            "id": db_frame.id,
+            "frame_number": keyframe['frame_number'],
+            "timestamp": keyframe['timestamp'],
+            "frame_path": frame_path,
+            "ssim_score": keyframe['ssim_score']
+        }
     
-    def _analyze_stages_with_ai(self, keyframes_info: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """使用AI分析关键帧生成阶段信息"""
+    def _analyze_stages_with_ai(self, keyframes_info: List[Dict[str, Any]],
+                                is_window: bool = False) -> Dict[str, Any]:
+        """使用AI分析关键帧生成阶段信息
+        
+        Args:
+            keyframes_info: 关键帧列表
+            is_window: 关键帧是否只是视频中的一个窗口片段（时间从首个关键帧开始）
+        """
         if not keyframes_info:
             return {"stages": [], "time": [], "description": []}
         
-        # 构建多图像输入的content
-        content = []
+        request = self._build_stage_request(keyframes_info, is_window)
         
-        # 添加所有帧图像
-        for i, keyframe in enumerate(keyframes_info):
-            frame_base64 = self._encode_image_to_base64(keyframe['frame_data'])
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{frame_base64}"
-                }
-            })
+        # 关键帧内容、提示词和模型都相同时直接复用之前的分析结果（命中时不压缩图片）
+        cached_analysis = self.vision_cache.get(request["cache_key"])
+        if cached_analysis is not None:
+            return cached_analysis
+        self._attach_stage_images(request, keyframes_info)
         
+        try:
+            response = self.gateway.call(
+                self.llm.model_name,
+                lambda: self.llm.invoke([request["message"]]),
+                caller="ssim_stage_analysis",
+                kind="vision",
+                image_count=request["image_count"],
+                payload_bytes=request["payload_bytes"]
+            )
+            return self._parse_stage_response(response.content, request)
+                
+        except Exception as e:
+            print(f"AI分析出错: {e}")
+            return self._fallback_stage_analysis(request, f"AI分析出错: {str(e)}")
+    
+    def _stream_stages_with_ai(self, keyframes_info: List[Dict[str, Any]]):
+        """流式调用视觉模型分析关键帧，逐块产出 stage_chunk 事件，返回解析后的阶段信息"""
+        if not keyframes_info:
+            return {"stages": [], "time": [], "description": []}
+        
+        request = self._build_stage_request(keyframes_info, False)
+        
+        cached_analysis = self.vision_cache.get(request["cache_key"])
+        if cached_analysis is not None:
+            yield {"type": "stage_cached"}
+            return cached_analysis
+        self._attach_stage_images(request, keyframes_info)
+        
+        chunks = []
+        try:
+            for chunk in self.gateway.stream(
+                self.llm.model_name,
+                lambda: self.llm.stream([request["message"]]),
+                caller="ssim_stage_analysis_stream",
+                kind="vision",
+                image_count=request["image_count"],
+                payload_bytes=request["payload_bytes"]
+            ):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield {"type": "stage_chunk", "content": chunk.content}
+        except Exception as e:
+            print(f"AI分析出错: {e}")
+            return self._fallback_stage_analysis(request, f"AI分析出错: {str(e)}")
+        
+        return self._parse_stage_response("".join(chunks), request)
+    
+    def _build_stage_request(self, keyframes_info: List[Dict[str, Any]], is_window: bool) -> Dict[str, Any]:
+        """构建阶段分析的提示词和缓存键
+        
+        缓存键由原始关键帧内容计算，图片压缩只在缓存未命中时由 _attach_stage_images 进行。
+        """
         # 添加文本提示
         frame_times_str = ', '.join([f'{kf["timestamp"]*1000:.0f}ms' for kf in keyframes_info])
         video_end_time = keyframes_info[-1]['timestamp'] * 1000  # 视频结束时间（毫秒）
+        segment_start_time = keyframes_info[0]['timestamp'] * 1000 if is_window else 0.0
         
-        prompt_text = f"""你是一个QA，你的任务是对给定视频的关键帧进行阶段分析。首先，请仔细阅读以下视频关键帧的时间点：
+        if is_window:
+            prompt_text = self._build_window_prompt(frame_times_str, segment_start_time, video_end_time)
+        else:
+            prompt_text = f"""你是一个QA，你的任务是对给定视频的关键帧进行阶段分析。首先，请仔细阅读以下视频关键帧的时间点：
 <frame_times>
 {frame_times_str}
 </frame_times>
@@ -313,53 +560,201 @@ class SSIMVideoAnalysisService:
   "description": ["阶段1描述", "阶段2描述", "阶段3描述"]
 }}"""
         
+        # 缓存键：原始关键帧内容、图片压缩参数、提示词版本和模型
+        frame_hashes = [self._frame_hash(keyframe['frame_data']) for keyframe in keyframes_info]
+        cache_key = make_cache_key(
+            model_identity(self.llm.model_name, self.llm.openai_api_base),
+            self.STAGE_PROMPT_VERSION,
+            frame_hashes,
+            [settings.vision_max_long_edge, settings.vision_payload_budget_bytes, settings.vision_image_format],
+            hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()
+        )
+        
+        return {
+            "prompt_text": prompt_text,
+            "cache_key": cache_key,
+            "segment_start_time": segment_start_time,
+            "video_end_time": video_end_time
+        }
+    
+    @staticmethod
+    def _frame_hash(frame) -> str:
+        """原始帧像素的哈希（包含尺寸，避免不同形状的相同字节冲突）"""
+        digest = hashlib.sha256(str(frame.shape).encode("ascii"))
+        digest.update(np.ascontiguousarray(frame).tobytes())
+        return digest.hexdigest()
+    
+    def _attach_stage_images(self, request: Dict[str, Any], keyframes_info: List[Dict[str, Any]]):
+        """压缩关键帧并构建多图像请求消息（缓存未命中时调用）"""
+        # 压缩关键帧以控制请求负载大小
+        images, payload_stats = optimize_image_payload(
+            [keyframe['frame_data'] for keyframe in keyframes_info],
+            max_long_edge=settings.vision_max_long_edge,
+            budget_bytes=settings.vision_payload_budget_bytes,
+            image_format=settings.vision_image_format
+        )
+        print(
+            f"视觉请求图片负载: {payload_stats['image_count']}张, "
+            f"{payload_stats['original_bytes'] / 1024:.0f}KB -> {payload_stats['optimized_bytes'] / 1024:.0f}KB "
+            f"({payload_stats['format']}, 质量{payload_stats['quality']}, 长边{payload_stats['long_edge']}px)"
+        )
+        
+        # 构建多图像输入的content：所有帧图像，再加文本提示
+        content = [
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{image['mime_type']};base64,{image['data']}"
+                }
+            }
+            for image in images
+        ]
         content.append({
             "type": "text",
-            "text": prompt_text
+            "text": request["prompt_text"]
         })
         
         # 使用LangChain的HumanMessage来处理多图像输入
-        message = HumanMessage(content=content)
-        
+        request["message"] = HumanMessage(content=content)
+        request["image_count"] = payload_stats["image_count"]
+        request["payload_bytes"] = payload_stats["optimized_bytes"]
+    
+    def _parse_stage_response(self, response_content: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """解析模型返回的阶段JSON，成功时写入缓存"""
+        # 尝试解析JSON响应
+        response_text = response_content.strip()
+        
+        # 如果响应包含代码块，提取JSON部分
+        if "```json" in response_text:
+            start = response_text.find("```json") + 7
+            end = response_text.find("```", start)
+            response_text = response_text[start:end].strip()
+        elif "```" in response_text:
+            start = response_text.find("```") + 3
+            end = response_text.find("```", start)
+            response_text = response_text[start:end].strip()
+        
+        # 解析JSON
         try:
-            response = self.llm.invoke([message])
-            
-            # 尝试解析JSON响应
-            response_text = response.content.strip()
-            
-            # 如果响应包含代码块，提取JSON部分
-            if "```json" in response_text:
-                start = response_text.find("```json") + 7
-                end = response_text.find("```", start)
-                response_text = response_text[start:end].strip()
-            elif "```" in response_text:
-                start = response_text.find("```") + 3
-                end = response_text.find("```", start)
-                response_text = response_text[start:end].strip()
+            stage_analysis = json.loads(response_text)
+            self.vision_cache.set(request["cache_key"], stage_analysis)
+            return stage_analysis
+        except json.JSONDecodeError:
+            # 如果JSON解析失败，返回默认结构
+            return self._fallback_stage_analysis(request, "AI分析失败，使用默认描述")
+    
+    @staticmethod
+    def _fallback_stage_analysis(request: Dict[str, Any], description: str) -> Dict[str, Any]:
+        """模型调用或解析失败时，用整个片段作为一个阶段"""
+        return {
+            "stage": ["视频分析"],
+            "time": [f"{request['segment_start_time']:.0f}~{request['video_end_time']:.0f}ms"],
+            "description": [description]
+        }
+    
+    def _build_window_prompt(self, frame_times_str: str, segment_start_time: float,
+                             segment_end_time: float) -> str:
+        """构建窗口片段的阶段分析提示词"""
+        return f"""你是一个QA，你的任务是对视频中一个片段的关键帧进行阶段分析。首先，请仔细阅读以下关键帧的时间点：
+<frame_times>
+{frame_times_str}
+</frame_times>
+
+片段时间范围: {segment_start_time:.0f}ms ~ {segment_end_time:.0f}ms（片段前后可能还有其他内容）
+
+接下来，请查看从该片段中提取的关键帧：
+<video_frames>
+上述提供的图像序列
+</video_frames>
+
+请参考以下示例格式来分析片段内的各个阶段：
+<example>
+片段共包括3个阶段
+1. 从{segment_start_time:.0f}ms~3000ms:登录完成
+2. 从3000ms~4000ms:打开一个会话(页面)
+3. 从4000ms~{segment_end_time:.0f}ms:页面内容完成加载
+</example>
+
+重要提示：
+1. 第一个阶段从片段开始时间({segment_start_time:.0f}ms)开始，最后一个阶段延续到片段结束时间({segment_end_time:.0f}ms)
+2. 每个阶段都应该有明确的开始和结束时间，时间使用视频中的绝对时间
+3. 阶段之间不应该有时间间隙
+
+最后，请严格按照以下JSON格式返回结果，不要添加任何其他文字：
+{{
+  "stage": ["阶段1", "阶段2", "阶段3"],
+  "time": ["{segment_start_time:.0f}ms~结束时间1", "开始时间2~结束时间2", "开始时间3~{segment_end_time:.0f}ms"],
+  "description": ["阶段1描述", "阶段2描述", "阶段3描述"]
+}}"""
+    
+    def _merge_window_stages(self, window_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """合并各窗口的阶段分析结果
+        
+        按开始时间排序后扫描：与前一阶段时间重叠且名称相同（或互相包含）的阶段合并为一个；
+        名称不同的重叠阶段从前一阶段结束处截断，被完全覆盖的则丢弃。
+        """
+        segments = []
+        for result in window_results:
+            for stage_name, time_range, description in zip(
+                result.get("stage", []), result.get("time", []), result.get("description", [])
+            ):
+                parsed = self._parse_time_range(time_range)
+                if parsed is None:
+                    continue
+                segments.append({
+                    "stage": stage_name,
+                    "start": parsed[0] * 1000,
+                    "end": parsed[1] * 1000,
+                    "description": description
+                })
+        
+        segments.sort(key=lambda item: (item["start"], item["end"]))
+        
+        merged = []
+        for segment in segments:
+            if not merged or segment["start"] >= merged[-1]["end"]:
+                merged.append(segment)
+                continue
             
-            # 解析JSON
-            try:
-                stage_analysis = json.loads(response_text)
-                return stage_analysis
-            except json.JSONDecodeError:
-                # 如果JSON解析失败，返回默认结构
-                return {
-                    "stage": ["视频分析"],
-                    "time": [f"0~{keyframes_info[-1]['timestamp']*1000:.0f}ms"],
-                    "description": ["AI分析失败，使用默认描述"]
-                }
-                
-        except Exception as e:
-            print(f"AI分析出错: {e}")
-            return {
-                "stage": ["视频分析"],
-                "time": [f"0~{keyframes_info[-1]['timestamp']*1000:.0f}ms"],
-                "description": [f"AI分析出错: {str(e)}"]
-            }
+            previous = merged[-1]
+            if self._is_same_stage(previous["stage"], segment["stage"]):
+                previous["end"] = max(previous["end"], segment["end"])
+                if len(segment["description"] or "") > len(previous["description"] or ""):
+                    previous["description"] = segment["description"]
+            elif segment["end"] > previous["end"]:
+                segment["start"] = previous["end"]
+                merged.append(segment)
+        
+        return {
+            "stage": [item["stage"] for item in merged],
+            "time": [f"{item['start']:.0f}ms~{item['end']:.0f}ms" for item in merged],
+            "description": [item["description"] for item in merged]
+        }
+    
+    @staticmethod
+    def _is_same_stage(name1: str, name2: str) -> bool:
+        """判断两个阶段名称是否描述同一阶段"""
+        normalized1 = "".join(ch for ch in str(name1) if ch.isalnum())
+        normalized2 = "".join(ch for ch in str(name2) if ch.isalnum())
+        if not normalized1 or not normalized2:
+            return False
+        return normalized1 in normalized2 or normalized2 in normalized1
+    
+    @staticmethod
+    def _parse_time_range(time_range: str) -> Optional[Tuple[float, float]]:
+        """解析 "开始ms~结束ms" 格式的时间范围，返回秒数，无法解析时返回None"""
+        try:
+            if "~" in time_range:
+                start_str, end_str = time_range.split("~")
+                return float(start_str.replace("ms", "")) / 1000, float(end_str.replace("ms", "")) / 1000
+            return 0.0, float(time_range.replace("ms", "")) / 1000
+        except (ValueError, AttributeError, TypeError):
+            return None
     
     def _save_stages_to_db(self, video_id: int, stage_analysis: Dict[str, Any]) -> List[Dict[str, Any]]:
         """保存阶段信息到数据库"""
         saved_stages = []
+        db_stages = []
         
         stages = stage_analysis.get("stage", [])
         times = stage_analysis.get("time", [])
@@ -377,18 +772,9 @@ class SSIMVideoAnalysisService:
                 cap.release()
         
         for i, (stage_name, time_range, description) in enumerate(zip(stages, times, descriptions)):
-            # 解析时间范围
-            try:
-                if "~" in time_range:
-                    start_str, end_str = time_range.split("~")
-                    start_time = float(start_str.replace("ms", "")) / 1000  # 转换为秒
-                    end_time = float(end_str.replace("ms", "")) / 1000
-                else:
-                    start_time = 0.0
-                    end_time = float(time_range.replace("ms", "")) / 1000
-            except:
-                start_time = 0.0
-                end_time = 1.0
+            # 解析时间范围（转换为秒）
+            parsed_range = self._parse_time_range(time_range)
+            start_time, end_time = parsed_range if parsed_range else (0.0, 1.0)
             
             # 特殊处理最后一个阶段：确保结束时间不会是0ms持续时间
             if i == len(stages) - 1 and video_duration is not None:
@@ -417,6 +803,7 @@ class SSIMVideoAnalysisService:
             
             self.db.add(db_stage)
             self.db.flush()
+            db_stages.append(db_stage)
             
             saved_stages.append({
                 "id": db_stage.id,
@@ -427,6 +814,12 @@ class SSIMVideoAnalysisService:
                 "description": description
             })
         
+        # 一次批量请求计算全部阶段向量，供阶段匹配快速打分；失败时在首次匹配时补算
+        try:
+            self.stage_embedding_service.embed_stages(db_stages)
+        except Exception as e:
+            print(f"阶段向量计算失败: {str(e)}")
+        
         self.db.commit()
         return saved_stages
     
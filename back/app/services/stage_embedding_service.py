@@ -0,0 +1,65 @@
+from typing import List, Optional
+from sqlalchemy.orm import Session
+
+from app.models.video_stage import VideoStage
+from app.services.client_registry import ClientRegistry, get_client_registry
+from app.utils.text_similarity import embedding_to_bytes
+
+
+class StageEmbeddingService:
+    """视频阶段文本向量服务
+
+    阶段向量在分析完成时批量计算并随 VideoStage 保存，供阶段匹配在进程内打分；
+    历史阶段或更换Embedding模型后的阶段在首次匹配时补算。
+    """
+
+    def __init__(self, db: Session, registry: Optional[ClientRegistry] = None):
+        self.db = db
+        self.embeddings = (registry or get_client_registry()).embeddings
+
+    @property
+    def model_name(self) -> str:
+        return self.embeddings.identity
+
+    @staticmethod
+    def stage_text(stage: VideoStage) -> str:
+        """用于计算向量的阶段文本"""
+        if stage.description:
+            return f"{stage.stage_name}: {stage.description}"
+        return stage.stage_name
+
+    def embed_stages(self, stages: List[VideoStage]) -> int:
+        """批量计算阶段向量并写入（不提交事务）
+
+        Returns:
+            计算的阶段数量
+        """
+        if not stages:
+            return 0
+        vectors = self.embeddings.embed_documents([self.stage_text(stage) for stage in stages])
+        for stage, vector in zip(stages, vectors):
+            stage.embedding = embedding_to_bytes(vector)
+            stage.embedding_model = self.model_name
+        return len(stages)
+
+    def ensure_embeddings(self, stages: List[VideoStage]) -> int:
+        """为缺少向量或向量模型已变更的阶段补算向量并提交"""
+        missing = [
+            stage for stage in stages
+            if stage.embedding is None or stage.embedding_model != self.model_name
+        ]
+        if not missing:
+            return 0
+        self.embed_stages(missing)
+        self.db.commit()
+        return len(missing)
+
+    def embed_query(self, text: str) -> List[float]:
+        """计算查询文本向量"""
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """一次请求计算多个查询文本的向量"""
+        if len(texts) == 1:
+            return [self.embed_query(texts[0])]
+        return self.embeddings.embed_documents(texts)
@@ -1,34 +1,43 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+from app.models.video_file import VideoFile
 from app.models.video_stage import VideoStage
-from app.services.video_service import VideoStageService
+from app.services.video_service import VideoStageService, VideoFileService
 from app.schemas.video_schemas import StageMatchingRequest, StageMatchingResponse, MatchedStage
+from app.services.model_gateway import get_model_gateway
+from app.services.client_registry import ClientRegistry, get_client_registry
+from app.services.stage_embedding_service import StageEmbeddingService
+from app.config import settings
+from app.utils.text_similarity import lexical_overlap, cosine_scores, stack_embeddings
 
 # 加载环境变量
 load_dotenv()
 
 class StageMatchingService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, registry: Optional[ClientRegistry] = None):
         self.db = db
         self.stage_service = VideoStageService(db)
+        self.video_file_service = VideoFileService(db)
         
-        # 初始化LangChain ChatOpenAI客户端
-        self.llm = ChatOpenAI(
-            model_name="doubao-seed-1-6-250615",
-            openai_api_key="6e0538ce-25b8-4f61-9342-505879befdda",
-            openai_api_base="https://ark.cn-beijing.volces.com/api/v3",
-        )
+        # 共享的LangChain ChatOpenAI客户端
+        registry = registry or get_client_registry()
+        self.llm = registry.text_llm
+        self.gateway = get_model_gateway()
+        self.stage_embedding_service = StageEmbeddingService(db, registry)
     
     def match_stages(self, request: StageMatchingRequest) -> StageMatchingResponse:
         """
-        使用LangChain和豆包AI进行阶段匹配分析
+        阶段匹配分析
+        
+        先用阶段向量的余弦相似度和关键词重合度在进程内打分，结果明确时直接返回；
+        最高分不足或前几名分数接近时，只把得分最高的候选阶段交给LLM判断。
         
         Args:
             request: 包含用户输入和视频ID的请求对象
@@ -37,8 +46,10 @@ class StageMatchingService:
             StageMatchingResponse: 匹配结果响应
         """
         try:
-            # 获取数据库中的阶段信息
-            db_stages = self.stage_service.get_video_stages(request.video_id)
+            # 获取数据库中的阶段信息（重复上传的视频使用源文件的阶段）
+            video_file = self.video_file_service.get_video_file(request.video_id)
+            source_id = video_file.analysis_source_id if video_file else request.video_id
+            db_stages = self.stage_service.get_video_stages(source_id)
             
             if not db_stages:
                 return StageMatchingResponse(
@@ -47,20 +58,40 @@ class StageMatchingService:
                     video_id=request.video_id,
                     matched_stages=[],
                     total_matches=0,
-                    analysis_summary="该视频暂无阶段信息，请先进行视频分析。"
+                    analysis_summary="该视频暂无阶段信息，请先进行视频分析。",
+                    match_method="none"
                 )
             
+            candidates = db_stages
+            if settings.stage_match_fast_path:
+                scored = self._score_stages(request.user_input, db_stages)
+                if scored is not None:
+                    if self._is_confident(scored):
+                        matched_stages = self._build_fast_matches(scored)
+                        top = scored[0]
+                        return StageMatchingResponse(
+                            success=True,
+                            user_input=request.user_input,
+                            video_id=request.video_id,
+                            matched_stages=matched_stages,
+                            total_matches=len(matched_stages),
+                            analysis_summary=f"最匹配的阶段为「{top['stage'].stage_name}」（综合分 {top['score']:.2f}）",
+                            match_method="embedding"
+                        )
+                    # 结果不明确：只把得分最高的候选交给LLM
+                    candidates = [item["stage"] for item in scored[:settings.stage_match_llm_candidates]]
+            
             # 构建阶段信息字符串
-            stages_info = self._format_stages_for_prompt(db_stages)
+            stages_info = self._format_stages_for_prompt(candidates)
             
             # 构建prompt
             prompt = self._create_matching_prompt(request.user_input, stages_info)
             
             # 调用LangChain进行分析
-            response = self.llm.invoke([prompt])
+            response = self._invoke_llm(prompt, "stage_matching")
             
             # 解析AI响应
-            analysis_result = self._parse_ai_response(response.content, db_stages)
+            analysis_result = self._parse_ai_response(response.content, candidates)
             
             return StageMatchingResponse(
                 success=True,
@@ -68,7 +99,8 @@ class StageMatchingService:
                 video_id=request.video_id,
                 matched_stages=analysis_result["matched_stages"],
                 total_matches=len(analysis_result["matched_stages"]),
-                analysis_summary=analysis_result["summary"]
+                analysis_summary=analysis_result["summary"],
+                match_method="llm"
             )
             
         except Exception as e:
@@ -78,9 +110,225 @@ class StageMatchingService:
                 video_id=request.video_id,
                 matched_stages=[],
                 total_matches=0,
-                analysis_summary=f"分析过程中发生错误: {str(e)}"
+                analysis_summary=f"分析过程中发生错误: {str(e)}",
+                match_method="none"
             )
     
+    def match_stages_batch(self, requests: List[StageMatchingRequest]) -> List[Dict[str, Any]]:
+        """
+        批量阶段匹配
+        
+        同一视频的请求共用一次阶段查询和一次向量计算，仍需LLM判断的查询合并为一个prompt；
+        不同视频的LLM调用并发执行，并发度由模型网关统一限制。
+        
+        Args:
+            requests: 阶段匹配请求列表
+            
+        Returns:
+            与请求顺序一致的匹配结果列表
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        groups: Dict[int, List[int]] = {}
+        for index, request in enumerate(requests):
+            groups.setdefault(request.video_id, []).append(index)
+        
+        videos = {
+            video.id: video
+            for video in self.db.query(VideoFile).filter(VideoFile.id.in_(list(groups))).all()
+        }
+        
+        # 数据库访问和向量打分在当前线程完成，线程池只负责LLM调用
+        llm_jobs = []
+        for video_id, indexes in groups.items():
+            video_file = videos.get(video_id)
+            if not video_file:
+                for index in indexes:
+                    results[index] = {
+                        "success": False,
+                        "user_input": requests[index].user_input,
+                        "video_id": video_id,
+                        "error": f"视频文件不存在: {video_id}"
+                    }
+                continue
+            
+            db_stages = self.stage_service.get_video_stages(video_file.analysis_source_id)
+            if not db_stages:
+                for index in indexes:
+                    results[index] = self._build_response(
+                        requests[index], [], "该视频暂无阶段信息，请先进行视频分析。", "none", success=False
+                    ).dict()
+                continue
+            
+            pending = indexes
+            candidates = db_stages
+            if settings.stage_match_fast_path:
+                query_vectors = self._embed_queries(db_stages, [requests[index].user_input for index in indexes])
+                if query_vectors is not None:
+                    pending = []
+                    candidate_ids = set()
+                    for index, query_vector in zip(indexes, query_vectors):
+                        scored = self._rank_stages(requests[index].user_input, query_vector, db_stages)
+                        if self._is_confident(scored):
+                            top = scored[0]
+                            results[index] = self._build_response(
+                                requests[index],
+                                self._build_fast_matches(scored),
+                                f"最匹配的阶段为「{top['stage'].stage_name}」（综合分 {top['score']:.2f}）",
+                                "embedding"
+                            ).dict()
+                        else:
+                            pending.append(index)
+                            candidate_ids.update(
+                                item["stage"].id for item in scored[:settings.stage_match_llm_candidates]
+                            )
+                    candidates = [stage for stage in db_stages if stage.id in candidate_ids]
+            
+            if pending:
+                stages_info = self._format_stages_for_prompt(candidates)
+                if len(pending) == 1:
+                    prompt = self._create_matching_prompt(requests[pending[0]].user_input, stages_info)
+                else:
+                    prompt = self._create_batch_matching_prompt(
+                        [requests[index].user_input for index in pending], stages_info
+                    )
+                llm_jobs.append((pending, candidates, prompt))
+        
+        if llm_jobs:
+            with ThreadPoolExecutor(max_workers=min(len(llm_jobs), settings.model_gateway_max_concurrency)) as executor:
+                futures = [
+                    executor.submit(self._invoke_llm, prompt, "stage_matching_batch")
+                    for _, _, prompt in llm_jobs
+                ]
+                responses = []
+                for future in futures:
+                    try:
+                        responses.append(future.result())
+                    except Exception as e:
+                        responses.append(e)
+            
+            for (pending, candidates, _), response in zip(llm_jobs, responses):
+                if isinstance(response, Exception):
+                    for index in pending:
+                        results[index] = self._build_response(
+                            requests[index], [], f"分析过程中发生错误: {str(response)}", "none", success=False
+                        ).dict()
+                    continue
+                
+                if len(pending) == 1:
+                    analysis_results = [self._parse_ai_response(response.content, candidates)]
+                else:
+                    analysis_results = self._parse_batch_ai_response(response.content, candidates, len(pending))
+                for index, analysis_result in zip(pending, analysis_results):
+                    results[index] = self._build_response(
+                        requests[index], analysis_result["matched_stages"], analysis_result["summary"], "llm"
+                    ).dict()
+        
+        return results
+    
+    def _invoke_llm(self, prompt: HumanMessage, caller: str):
+        """
+        经模型网关调用LLM
+        """
+        return self.gateway.call(
+            self.llm.model_name,
+            lambda: self.llm.invoke([prompt]),
+            caller=caller
+        )
+    
+    @staticmethod
+    def _build_response(request: StageMatchingRequest, matched_stages: List[MatchedStage], summary: str,
+                        match_method: str, success: bool = True) -> StageMatchingResponse:
+        """
+        构建阶段匹配响应
+        """
+        return StageMatchingResponse(
+            success=success,
+            user_input=request.user_input,
+            video_id=request.video_id,
+            matched_stages=matched_stages,
+            total_matches=len(matched_stages),
+            analysis_summary=summary,
+            match_method=match_method
+        )
+    
+    def _score_stages(self, user_input: str, stages: List[VideoStage]) -> Optional[List[Dict[str, Any]]]:
+        """
+        计算各阶段与用户输入的综合分，按分数从高到低排序；向量不可用时返回None
+        """
+        query_vectors = self._embed_queries(stages, [user_input])
+        if query_vectors is None:
+            return None
+        return self._rank_stages(user_input, query_vectors[0], stages)
+    
+    def _embed_queries(self, stages: List[VideoStage], queries: List[str]) -> Optional[List[List[float]]]:
+        """
+        确保阶段向量可用，并一次计算全部查询的向量；失败时返回None
+        """
+        try:
+            self.stage_embedding_service.ensure_embeddings(stages)
+            return self.stage_embedding_service.embed_queries(queries)
+        except Exception as e:
+            print(f"阶段向量匹配不可用，使用LLM匹配: {str(e)}")
+            self.db.rollback()
+            return None
+    
+    def _rank_stages(self, user_input: str, query_vector: List[float],
+                     stages: List[VideoStage]) -> List[Dict[str, Any]]:
+        """
+        按综合分从高到低排列阶段
+        """
+        semantic = cosine_scores(query_vector, stack_embeddings([stage.embedding for stage in stages]))
+        weight = settings.stage_match_semantic_weight
+        
+        scored = []
+        for stage, cosine in zip(stages, semantic):
+            # 命中阶段名称比只命中描述更可信，描述的重合度打八折
+            lexical = max(
+                lexical_overlap(user_input, stage.stage_name),
+                0.8 * lexical_overlap(user_input, stage.description or "")
+            )
+            cosine = max(0.0, float(cosine))
+            scored.append({
+                "stage": stage,
+                "score": weight * cosine + (1 - weight) * lexical,
+                "semantic": cosine,
+                "lexical": lexical
+            })
+        
+        scored.sort(key=lambda item: item["score"], reverse=True)
+        return scored
+    
+    def _is_confident(self, scored: List[Dict[str, Any]]) -> bool:
+        """
+        最高分足够高且与次高分拉开差距时，认为匹配结果明确
+        """
+        if not scored or scored[0]["score"] < settings.stage_match_confident_score:
+            return False
+        if len(scored) == 1:
+            return True
+        return scored[0]["score"] - scored[1]["score"] >= settings.stage_match_ambiguity_margin
+    
+    def _build_fast_matches(self, scored: List[Dict[str, Any]]) -> List[MatchedStage]:
+        """
+        将向量打分结果转换为匹配阶段列表
+        """
+        matched_stages = []
+        for item in scored:
+            if item["score"] < settings.stage_match_min_score:
+                break
+            stage = item["stage"]
+            matched_stages.append(MatchedStage(
+                stage_id=stage.id,
+                stage_name=stage.stage_name,
+                start_time=stage.start_time,
+                end_time=stage.end_time,
+                duration=stage.duration,
+                description=stage.description,
+                similarity_score=round(item["score"], 4),
+                match_reason=f"语义相似度 {item['semantic']:.2f}，关键词重合度 {item['lexical']:.2f}"
+            ))
+        return matched_stages
+    
     def _format_stages_for_prompt(self, stages: List[VideoStage]) -> str:
         """
         将数据库中的阶段信息格式化为prompt字符串
@@ -144,6 +392,53 @@ class StageMatchingService:
 5. 总结要简洁明了地说明匹配结果
 6. 返回结果中必须包含阶段的起始时间和结束时间
 
+请严格按照JSON格式返回，不要添加任何其他文字。
+"""
+        
+        return HumanMessage(content=prompt_text)
+    
+    def _create_batch_matching_prompt(self, user_inputs: List[str], stages_info: str) -> HumanMessage:
+        """
+        创建一次评估多个用户输入的阶段匹配prompt
+        """
+        queries_text = "\n".join(f'查询{i}: "{user_input}"' for i, user_input in enumerate(user_inputs, 1))
+        prompt_text = f"""
+你是一个专业的视频阶段分析专家。你的任务是针对下面的每一条用户输入，分别从给定的视频阶段信息中找到最匹配的阶段。
+
+用户输入列表:
+{queries_text}
+
+视频阶段信息:
+{stages_info}
+
+请分别分析每条用户输入与各个阶段的相似度，并按照以下JSON格式返回结果，results中每条查询对应一项：
+
+{{
+  "results": [
+    {{
+      "query_index": 查询序号(从1开始),
+      "matched_stages": [
+        {{
+          "stage_id": 阶段ID,
+          "start_time": 开始时间(秒),
+          "end_time": 结束时间(秒),
+          "similarity_score": 相似度分数(0-1之间的浮点数),
+          "match_reason": "匹配原因的详细说明"
+        }}
+      ],
+      "summary": "该查询的分析总结"
+    }}
+  ]
+}}
+
+分析要求:
+1. 相似度分数应该基于语义相似性、关键词匹配、时间范围等因素综合评估
+2. 只返回相似度分数大于0.3的阶段
+3. 按相似度分数从高到低排序
+4. 匹配原因要具体说明为什么这个阶段与用户输入相关
+5. 每条查询都必须在results中出现，即使没有匹配的阶段
+6. 返回结果中必须包含阶段的起始时间和结束时间
+
 请严格按照JSON格式返回，不要添加任何其他文字。
 """
         
@@ -157,31 +452,8 @@ class StageMatchingService:
             # 尝试解析JSON响应
             response_data = json.loads(ai_response)
             
-            matched_stages = []
-            stage_dict = {stage.id: stage for stage in db_stages}
-            
-            for match in response_data.get("matched_stages", []):
-                stage_id = match.get("stage_id")
-                if stage_id in stage_dict:
-                    stage = stage_dict[stage_id]
-                    # 使用AI返回的时间信息，如果没有则使用数据库中的时间
-                    ai_start_time = match.get("start_time", stage.start_time)
-                    ai_end_time = match.get("end_time", stage.end_time)
-                    
-                    matched_stage = MatchedStage(
-                        stage_id=stage.id,
-                        stage_name=stage.stage_name,
-                        start_time=ai_start_time,
-                        end_time=ai_end_time,
-                        duration=ai_end_time - ai_start_time,
-                        description=stage.description,
-                        similarity_score=match.get("similarity_score", 0.0),
-                        match_reason=match.get("match_reason", "")
-                    )
-                    matched_stages.append(matched_stage)
-            
             return {
-                "matched_stages": matched_stages,
+                "matched_stages": self._build_matched_stages(response_data.get("matched_stages", []), db_stages),
                 "summary": response_data.get("summary", "分析完成")
             }
             
@@ -195,4 +467,64 @@ class StageMatchingService:
             return {
                 "matched_stages": [],
                 "summary": f"响应处理错误: {str(e)}"
-            }
\ No newline at end of file
+            }
+    
+    def _parse_batch_ai_response(self, ai_response: str, db_stages: List[VideoStage],
+                                 query_count: int) -> List[Dict[str, Any]]:
+        """
+        解析多查询AI响应，按查询顺序返回匹配结果
+        """
+        try:
+            response_data = json.loads(ai_response)
+            by_index = {
+                item.get("query_index"): item
+                for item in response_data.get("results", [])
+                if isinstance(item, dict)
+            }
+            
+            results = []
+            for query_index in range(1, query_count + 1):
+                item = by_index.get(query_index)
+                if item is None:
+                    results.append({"matched_stages": [], "summary": "AI响应中缺少该查询的结果"})
+                    continue
+                results.append({
+                    "matched_stages": self._build_matched_stages(item.get("matched_stages", []), db_stages),
+                    "summary": item.get("summary", "分析完成")
+                })
+            return results
+            
+        except json.JSONDecodeError:
+            summary = f"AI响应解析失败，原始响应: {ai_response[:200]}..."
+        except Exception as e:
+            summary = f"响应处理错误: {str(e)}"
+        return [{"matched_stages": [], "summary": summary} for _ in range(query_count)]
+    
+    def _build_matched_stages(self, matches: List[Dict[str, Any]], db_stages: List[VideoStage]) -> List[MatchedStage]:
+        """
+        将AI返回的匹配项转换为匹配阶段列表，忽略不存在的阶段ID
+        """
+        matched_stages = []
+        stage_dict = {stage.id: stage for stage in db_stages}
+        
+        for match in matches:
+            stage_id = match.get("stage_id")
+            if stage_id in stage_dict:
+                stage = stage_dict[stage_id]
+                # 使用AI返回的时间信息，如果没有则使用数据库中的时间
+                ai_start_time = match.get("start_time", stage.start_time)
+                ai_end_time = match.get("end_time", stage.end_time)
+                
+                matched_stage = MatchedStage(
+                    stage_id=stage.id,
+                    stage_name=stage.stage_name,
+                    start_time=ai_start_time,
+                    end_time=ai_end_time,
+                    duration=ai_end_time - ai_start_time,
+                    description=stage.description,
+                    similarity_score=match.get("similarity_score", 0.0),
+                    match_reason=match.get("match_reason", "")
+                )
+                matched_stages.append(matched_stage)
+        
+        return matched_stages
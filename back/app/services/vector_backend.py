@@ -0,0 +1,192 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.config import settings
+
+
+def metadata_matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """判断单条元数据是否满足Chroma风格的where子句"""
+    for key, condition in (where or {}).items():
+        if key == "$and":
+            if not all(metadata_matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(metadata_matches(metadata, clause) for clause in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            value = metadata.get(key)
+            for operator, expected in condition.items():
+                if operator == "$eq":
+                    matched = value == expected
+                elif operator == "$ne":
+                    matched = value != expected
+                elif operator == "$in":
+                    matched = value in expected
+                elif operator == "$nin":
+                    matched = value not in expected
+                elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                    if not isinstance(value, (int, float)) or isinstance(value, bool):
+                        return False
+                    matched = {
+                        "$gt": value > expected,
+                        "$gte": value >= expected,
+                        "$lt": value < expected,
+                        "$lte": value <= expected
+                    }[operator]
+                else:
+                    raise ValueError(f"不支持的过滤操作: {operator}")
+                if not matched:
+                    return False
+    return True
+
+
+def group_by_where(wheres: Optional[List[Optional[Dict[str, Any]]]],
+                   count: int) -> List[Tuple[Optional[Dict[str, Any]], List[int]]]:
+    """把批量查询按相同的where子句分组，返回 [(where, 查询下标列表)]"""
+    groups: Dict[str, Tuple[Optional[Dict[str, Any]], List[int]]] = {}
+    for index, where in enumerate(wheres or [None] * count):
+        key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+        groups.setdefault(key, (where, []))[1].append(index)
+    return list(groups.values())
+
+
+class VectorBackend(ABC):
+    """向量存储后端接口
+
+    距离统一为平方L2距离（越小越相似），与Chroma默认的l2空间一致；
+    where 使用Chroma的元数据过滤语法（$eq/$ne/$in/$nin/$gt/$gte/$lt/$lte/$and/$or）。
+    """
+
+    embedding_function: Embeddings
+
+    @abstractmethod
+    def add_texts(self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None,
+                  ids: Optional[List[str]] = None,
+                  embeddings: Optional[List[List[float]]] = None) -> List[str]:
+        """写入文档（ID已存在时覆盖），未提供向量时批量计算"""
+
+    @abstractmethod
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Sequence[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        """按ID或元数据条件读取文档，返回 {"ids", "documents", "metadatas"}"""
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        """按ID删除文档"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """文档总数"""
+
+    @abstractmethod
+    def search_by_vector(self, embedding: List[float], k: int = 4,
+                         where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """按向量检索最相近的k个文档，返回 (文档, 平方L2距离)，按距离升序"""
+
+    def search_by_vectors(self, embeddings: List[List[float]], k: int = 4,
+                          wheres: Optional[List[Optional[Dict[str, Any]]]] = None) -> List[List[Tuple[Document, float]]]:
+        """批量按向量检索，wheres 与 embeddings 一一对应（省略时均不过滤），返回每个查询的结果"""
+        wheres = wheres or [None] * len(embeddings)
+        return [self.search_by_vector(embedding, k=k, where=where) for embedding, where in zip(embeddings, wheres)]
+
+    @abstractmethod
+    def delete_collection(self):
+        """删除整个集合"""
+
+    def search(self, query: str, k: int = 4,
+               where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """按查询文本检索"""
+        return self.search_by_vector(self.embedding_function.embed_query(query), k=k, where=where)
+
+
+class ChromaVectorBackend(VectorBackend):
+    """基于 langchain_chroma 的后端"""
+
+    def __init__(self, store: Chroma, embedding_function: Embeddings):
+        self.store = store
+        self.embedding_function = embedding_function
+
+    def add_texts(self, texts, metadatas=None, ids=None, embeddings=None):
+        if embeddings is None:
+            return self.store.add_texts(texts, metadatas=metadatas, ids=ids)
+        self.store._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=texts)
+        return ids
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        return self.store.get(ids=ids, where=where, limit=limit, offset=offset, include=list(include))
+
+    def delete(self, ids):
+        if ids:
+            self.store.delete(ids=ids)
+
+    def count(self):
+        return self.store._collection.count()
+
+    def search_by_vector(self, embedding, k=4, where=None):
+        return self.store.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=where)
+
+    def search(self, query, k=4, where=None):
+        return self.store.similarity_search_with_score(query, k=k, filter=where)
+
+    def search_by_vectors(self, embeddings, k=4, wheres=None):
+        # 相同过滤条件的查询合并为一次query调用
+        results: List[List[Tuple[Document, float]]] = [[] for _ in embeddings]
+        for where, indexes in group_by_where(wheres, len(embeddings)):
+            response = self.store._collection.query(
+                query_embeddings=[embeddings[index] for index in indexes],
+                n_results=k,
+                where=where,
+                include=["documents", "metadatas", "distances"]
+            )
+            for position, index in enumerate(indexes):
+                results[index] = [
+                    (Document(page_content=content or "", metadata=metadata or {}, id=doc_id), distance)
+                    for doc_id, content, metadata, distance in zip(
+                        response["ids"][position], response["documents"][position],
+                        response["metadatas"][position], response["distances"][position]
+                    )
+                ]
+        return results
+
+    def delete_collection(self):
+        self.store.delete_collection()
+
+
+def create_vector_backend(collection_name: str, embedding_function: Embeddings,
+                          backend: Optional[str] = None) -> VectorBackend:
+    """按配置创建向量存储后端
+
+    Args:
+        collection_name: 集合名称
+        embedding_function: 计算向量的Embedding客户端
+        backend: 后端类型（chroma / mmap），默认使用配置项 vector_backend
+    """
+    backend = backend or settings.vector_backend
+    if backend == "chroma":
+        store = Chroma(
+            collection_name=collection_name,
+            embedding_function=embedding_function,
+            persist_directory=os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_video_db"),
+        )
+        return ChromaVectorBackend(store, embedding_function)
+    if backend == "mmap":
+        from app.services.mmap_vector_index import MmapVectorBackend
+        return MmapVectorBackend(
+            os.path.join(settings.mmap_vector_directory, collection_name),
+            embedding_function,
+            dtype=settings.mmap_vector_dtype,
+            ivf_threshold=settings.mmap_ivf_threshold,
+            ivf_nprobe=settings.mmap_ivf_nprobe,
+            quantization=settings.mmap_quantization,
+            rerank_multiplier=settings.mmap_rerank_multiplier,
+            pq_subvectors=settings.mmap_pq_subvectors
+        )
+    raise ValueError(f"不支持的向量存储后端: {backend}")
@@ -3,12 +3,7 @@ import json
 import math
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
-from langchain_core.embeddings import Embeddings
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from volcenginesdkarkruntime import Ark
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -17,55 +12,52 @@ load_dotenv()
 from app.models.video_stage import VideoStage
 from app.models.video_file import VideoFile
 from app.services.video_service import VideoStageService, VideoFileService
+from app.services.model_gateway import get_model_gateway
+from app.services.client_registry import ClientRegistry, get_client_registry
+from app.services.cache_service import PersistentCache, make_cache_key, model_identity
+from app.services.corpus_version import get_corpus_version, bump_corpus_version
+from app.services.semantic_cache_service import SemanticReportCache
+from app.services.lexical_index import get_lexical_index, invalidate_lexical_index
+from app.config import settings
+from app.utils.text_similarity import normalize_query, lexical_overlap
 
-
-class ArkEmbeddings(Embeddings):
-    """Ark embedding model integration."""
-    
-    def __init__(self, model: str = "doubao-embedding-large-text-250515"):
-        self.client = Ark(api_key=os.getenv("ARK_API_KEY"))
-        self.model = model
-    
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Embed search docs."""
-        resp = self.client.embeddings.create(
-            model=self.model,
-            input=texts,
-            encoding_format="float",
-        )
-        return [embedding.embedding for embedding in resp.data]
-    
-    def embed_query(self, text: str) -> List[float]:
-        """Embed query text."""
-        resp = self.client.embeddings.create(
-            model=self.model,
-            input=[text],
-            encoding_format="float",
-        )
-        return resp.data[0].embedding
+# 按ID删除时每批的文档数
+DELETE_BATCH_SIZE = 1000
 
 
 class VideoRAGService:
     """视频分析RAG服务"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, registry: Optional[ClientRegistry] = None):
         self.db = db
         self.video_stage_service = VideoStageService(db)
         self.video_file_service = VideoFileService(db)
         
-        # 初始化embedding和向量存储
-        self.embeddings = ArkEmbeddings()
-        self.vector_store = Chroma(
-            collection_name=os.getenv("CHROMA_COLLECTION_NAME", "video_analysis_collection"),
-            embedding_function=self.embeddings,
-            persist_directory=os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_video_db"),
-        )
+        # embedding、向量存储和LLM均来自进程内共享的客户端注册表
+        registry = registry or get_client_registry()
+        self.embeddings = registry.embeddings
+        self.vector_store = registry.vector_store
+        self.collection_name = registry.collection_name
+        self.llm = registry.text_llm
+        self.gateway = get_model_gateway()
         
-        # 初始化LLM
-        self.llm = ChatOpenAI(
-            model_name=os.getenv("LLM_MODEL_NAME", "doubao-seed-1-6-250615"),
-            openai_api_key=os.getenv("ARK_API_KEY"),
-            openai_api_base=os.getenv("ARK_API_BASE", "https://ark.cn-beijing.volces.com/api/v3"),
+        # 对比报告缓存，键中包含语料版本，向量集合变更后旧报告自动失效
+        self.report_cache = PersistentCache("comparison_report")
+        # 语义缓存：措辞不同但含义相近的查询复用报告
+        self.semantic_cache = SemanticReportCache(self.embeddings.identity)
+    
+    def _report_cache_key(self, query: str, product_name: Optional[str], similarity_threshold: float) -> str:
+        """对比报告缓存键：规范化查询、产品过滤、相似度阈值、集合及其语料版本和模型
+
+        语料版本按物理集合计数，切换集合（重建索引）后新旧集合的版本号可能相同，因此键中同时包含集合名称。
+        """
+        return make_cache_key(
+            normalize_query(query),
+            product_name or "",
+            round(similarity_threshold, 4),
+            self.collection_name,
+            get_corpus_version(self.collection_name),
+            model_identity(self.llm.model_name, self.llm.openai_api_base)
         )
     
     def store_video_analysis(self, video_id: int, product_name: str, 
@@ -89,23 +81,18 @@ class VideoRAGService:
             # 获取数据库中的阶段信息
             db_stages = self.video_stage_service.get_video_stages(video_id)
             
-            documents = []
-            stored_count = 0
-            
             stages = stage_analysis.get("stage", [])
             times = stage_analysis.get("time", [])
             descriptions = stage_analysis.get("description", [])
             
+            doc_ids, texts, metadatas = [], [], []
             for i, (stage_name, time_range, description) in enumerate(zip(stages, times, descriptions)):
                 # 查找对应的数据库阶段记录
                 db_stage = None
                 if i < len(db_stages):
                     db_stage = db_stages[i]
                 
-                # 构建文档内容 - 仅保存描述内容用于后续分析
-                content = description
-                
-                # 构建metadata
+                # 构建metadata（Chroma不接受None值，缺失的字段不写入）
                 metadata = {
                     "video_id": video_id,
                     "stage_id": db_stage.id if db_stage else None,
@@ -117,33 +104,39 @@ class VideoRAGService:
                     "stage_index": i
                 }
                 
-                # 检查是否已存在相同的记录（避免重复存储）
-                doc_id = f"video_{video_id}_stage_{i}_{product_name}"
-                
-                # 检查向量数据库中是否已存在
-                existing_docs = self.vector_store.similarity_search(
-                    content, 
-                    k=1,
-                    filter={
-                        "$and": [
-                            {"video_id": {"$eq": video_id}},
-                            {"stage_index": {"$eq": i}},
-                            {"product_name": {"$eq": product_name}}
-                        ]
-                    }
+                # 文档ID由视频、阶段序号和产品确定，可直接用于判断是否已存储
+                doc_ids.append(self.stage_doc_id(video_id, i, product_name))
+                # 文档内容仅保存描述内容用于后续分析
+                texts.append(description)
+                metadatas.append({key: value for key, value in metadata.items() if value is not None})
+            stage_count = len(doc_ids)
+            
+            # 视频级摘要文档，用于两级检索时先选出候选视频
+            if stage_count:
+                doc_ids.append(self.summary_doc_id(video_id, product_name))
+                texts.append(self.build_video_summary(stages, descriptions))
+                metadatas.append({
+                    "video_id": video_id,
+                    "product_name": product_name,
+                    "analysis_type": "video_summary",
+                    "video_filename": video_file.filename,
+                    "stage_count": stage_count
+                })
+            
+            # 一次按ID查询已存在的文档，新阶段和摘要一次批量计算向量并写入
+            existing_ids = set(self.vector_store.get(ids=doc_ids, include=[])["ids"]) if doc_ids else set()
+            new_indexes = [i for i, doc_id in enumerate(doc_ids) if doc_id not in existing_ids]
+            if new_indexes:
+                self.vector_store.add_texts(
+                    texts=[texts[i] for i in new_indexes],
+                    metadatas=[metadatas[i] for i in new_indexes],
+                    ids=[doc_ids[i] for i in new_indexes]
                 )
-                
-                if not existing_docs:
-                    # 创建文档
-                    doc = Document(
-                        page_content=content,
-                        metadata=metadata
-                    )
-                    
-                    # 添加到向量数据库
-                    self.vector_store.add_documents([doc], ids=[doc_id])
-                    documents.append(doc)
-                    stored_count += 1
+            stored_count = len([i for i in new_indexes if i < stage_count])
+            
+            if new_indexes:
+                bump_corpus_version(self.collection_name)
+                invalidate_lexical_index(self.collection_name)
             
             return {
                 "success": True,
@@ -167,78 +160,327 @@ class VideoRAGService:
     
 
 
+    def _lookup_semantic_report(self, query: str, product_name: Optional[str],
+                                similarity_threshold: float):
+        """计算查询向量并查找语义相近的缓存报告
+        
+        Returns:
+            (查询向量, 缓存报告)；未启用语义缓存或向量计算失败时查询向量为None
+        """
+        if not settings.semantic_cache_enabled:
+            return None, None
+        try:
+            query_vector = self.embeddings.embed_query(query)
+        except Exception as e:
+            print(f"查询向量计算失败，跳过语义缓存: {str(e)}")
+            return None, None
+        return query_vector, self.semantic_cache.lookup(query_vector, product_name, similarity_threshold)
+    
     def query_similar_stages(self, query: str, product_name: Optional[str] = None, 
-                           k: int = 5, similarity_threshold: float = 0.7) -> Dict[str, Any]:
+                           k: int = 5, similarity_threshold: float = 0.7,
+                           query_embedding: Optional[List[float]] = None,
+                           video_ids: Optional[List[int]] = None) -> Dict[str, Any]:
         """查询相似的视频阶段分析
         
         相似度比较机制说明：
-        1. 只比较文档的page_content（即视频阶段的描述内容）
+        1. 向量检索只比较文档的page_content（即视频阶段的描述内容）
         2. 元数据（metadata）仅用于过滤，不参与相似度计算
         3. 使用高斯核函数将向量距离转换为[0,1]范围的相似度分数
         4. 相似度分数越接近1表示越相似，越接近0表示越不相似
+        5. 启用混合检索时，同时在阶段名称和描述上做BM25字符n-gram检索，两路结果按倒数排名融合；
+           词法命中的结果相似度取向量相似度与查询字符覆盖率中的较大值
+        6. 可信的词法结果足够多时只用词法结果，不计算查询向量
         
         Args:
             query: 查询文本
             product_name: 产品名称过滤（可选）
             k: 返回结果数量
             similarity_threshold: 相似度阈值，只返回相似度大于此值的结果
+            query_embedding: 已计算好的查询向量（可选，避免重复计算）
+            video_ids: 只在这些视频的阶段中检索（可选）
             
         Returns:
             查询结果
         """
         try:
             # 构建过滤条件
-            filter_conditions = [{"analysis_type": {"$eq": "video_stage_analysis"}}]
-            if product_name:
-                filter_conditions.append({"product_name": {"$eq": product_name}})
+            filter_dict = self.build_metadata_filter(
+                analysis_type="video_stage_analysis",
+                product_name=product_name or None
+            )
+            if video_ids is not None:
+                filter_dict = {"$and": [filter_dict, {"video_id": {"$in": list(video_ids)}}]}
+            
+            hybrid = settings.hybrid_search_enabled
+            candidate_k = k * settings.hybrid_candidate_multiplier if hybrid else k
+            
+            # 词法检索
+            lexical_hits = self._lexical_search(query, candidate_k, filter_dict) if hybrid else []
+            confident_hits = [
+                hit for hit in lexical_hits
+                if hit["lexical_overlap"] >= settings.hybrid_lexical_confident_overlap
+            ]
+            if query_embedding is None and confident_hits and \
+                    len(confident_hits) >= min(k, settings.hybrid_lexical_min_hits):
+                results = [
+                    self._stage_result(hit["content"], hit["metadata"], hit["lexical_overlap"], None, "lexical")
+                    for hit in confident_hits[:k]
+                    if hit["lexical_overlap"] >= similarity_threshold
+                ]
+                return self._similar_stages_response(query, similarity_threshold, results, "lexical")
+            
+            # 向量检索 - 只比较文档内容，元数据仅用于过滤
+            if query_embedding is not None:
+                similar_docs_with_scores = self.vector_store.search_by_vector(
+                    query_embedding,
+                    k=candidate_k,
+                    where=filter_dict
+                )
+            else:
+                similar_docs_with_scores = self.vector_store.search(
+                    query,
+                    k=candidate_k,
+                    where=filter_dict
+                )
+            
+            return self._fuse_results(query, k, similarity_threshold, similar_docs_with_scores, lexical_hits)
             
-            filter_dict = {"$and": filter_conditions} if len(filter_conditions) > 1 else filter_conditions[0]
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "message": f"查询失败: {str(e)}"
+            }
+    
+    def query_similar_stages_batch(self, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """批量查询相似的视频阶段
+        
+        全部查询文本一次计算向量，按过滤条件分组后在向量索引中一次批量检索，
+        每个查询的词法检索和结果融合与 query_similar_stages 传入查询向量时相同。
+        
+        Args:
+            queries: [{"query", "product_name", "k", "similarity_threshold"}]，后三项可省略
             
-            # 执行相似性搜索 - 只比较文档内容，元数据仅用于过滤
-            similar_docs_with_scores = self.vector_store.similarity_search_with_score(
-                query,
-                k=k,
-                filter=filter_dict
+        Returns:
+            {"success", "total_queries", "results": [与 query_similar_stages 相同格式的结果]}
+        """
+        try:
+            requests = [{
+                "query": item["query"],
+                "product_name": item.get("product_name") or None,
+                "k": item.get("k") or 5,
+                "similarity_threshold": item.get("similarity_threshold", 0.7)
+            } for item in queries]
+            if not requests:
+                return {"success": True, "total_queries": 0, "results": []}
+            
+            # 相同的查询文本只计算一次向量，全部文本合并为一次Embedding请求
+            texts = list(dict.fromkeys(request["query"] for request in requests))
+            vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+            
+            hybrid = settings.hybrid_search_enabled
+            multiplier = settings.hybrid_candidate_multiplier if hybrid else 1
+            filters = [
+                self.build_metadata_filter(analysis_type="video_stage_analysis", product_name=request["product_name"])
+                for request in requests
+            ]
+            vector_hits = self.vector_store.search_by_vectors(
+                [vectors[request["query"]] for request in requests],
+                k=max(request["k"] for request in requests) * multiplier,
+                wheres=filters
             )
             
             results = []
-            for doc, score in similar_docs_with_scores:
-                # 直接使用chroma原生分数，分数越小表示越相似
-                # 使用高斯核函数将距离转换为相似度分数，确保在[0,1]范围内
-                # 参数sigma控制衰减速率，可以根据实际距离分布调整
-                # 如果大多数距离在600-900范围，sigma=150.0是合适的
-                # 如果距离普遍较小，可以减小sigma值；如果距离普遍较大，可以增大sigma值
-                sigma = 600.0  # 根据实际距离分布调整此参数
-                similarity_score = float(format(math.exp(-(score**2) / (2 * sigma**2)), '.4f'))  # 保留4位小数
-                
-                # 只保留相似度大于阈值的结果
-                if similarity_score >= similarity_threshold:
-                    metadata = doc.metadata
-                    
-                    results.append({
-                        "video_id": metadata.get("video_id"),
-                        "stage_id": metadata.get("stage_id"),
-                        "stage_name": metadata.get("stage_name"),
-                        "time_range": metadata.get("time_range"),
-                        "product_name": metadata.get("product_name"),
-                        "video_filename": metadata.get("video_filename"),
-                        "content": doc.page_content,
-                        "stage_index": metadata.get("stage_index"),
-                        "similarity_score": similarity_score,
-                        "raw_distance": score
-                    })
-            
-            # 按相似度分数排序
-            results = sorted(results, key=lambda x: x["similarity_score"], reverse=True)
+            for request, where, hits in zip(requests, filters, vector_hits):
+                candidate_k = request["k"] * multiplier
+                lexical_hits = self._lexical_search(request["query"], candidate_k, where) if hybrid else []
+                results.append(self._fuse_results(
+                    request["query"], request["k"], request["similarity_threshold"], hits[:candidate_k], lexical_hits
+                ))
             
             return {
                 "success": True,
-                "query": query,
-                "similarity_threshold": similarity_threshold,
-                "total_results": len(results),
+                "total_queries": len(results),
                 "results": results
             }
             
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "message": f"批量查询失败: {str(e)}"
+            }
+    
+    def _fuse_results(self, query: str, k: int, similarity_threshold: float, vector_hits,
+                      lexical_hits: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """向量和词法两路结果按倒数排名融合，过滤阈值后取前k个"""
+        candidates: Dict[str, Dict[str, Any]] = {}
+        for rank, (doc, score) in enumerate(vector_hits, 1):
+            # 向量存储返回平方L2距离，分数越小表示越相似
+            # 使用高斯核函数将距离转换为相似度分数，确保在[0,1]范围内
+            # 参数sigma控制衰减速率，可以根据实际距离分布调整
+            # 如果大多数距离在600-900范围，sigma=150.0是合适的
+            # 如果距离普遍较小，可以减小sigma值；如果距离普遍较大，可以增大sigma值
+            sigma = 600.0  # 根据实际距离分布调整此参数
+            similarity_score = float(format(math.exp(-(score**2) / (2 * sigma**2)), '.4f'))  # 保留4位小数
+            
+            candidates[self._document_key(doc.id, doc.metadata)] = {
+                "content": doc.page_content,
+                "metadata": doc.metadata,
+                "similarity_score": similarity_score,
+                "raw_distance": score,
+                "source": "vector",
+                "rrf_score": 1.0 / (settings.hybrid_rrf_k + rank)
+            }
+        
+        for rank, hit in enumerate(lexical_hits, 1):
+            candidate = candidates.setdefault(self._document_key(hit["id"], hit["metadata"]), {
+                "content": hit["content"],
+                "metadata": hit["metadata"],
+                "similarity_score": 0.0,
+                "raw_distance": None,
+                "source": "lexical",
+                "rrf_score": 0.0
+            })
+            if candidate["source"] == "vector":
+                candidate["source"] = "hybrid"
+            candidate["similarity_score"] = max(candidate["similarity_score"], hit["lexical_overlap"])
+            candidate["rrf_score"] += 1.0 / (settings.hybrid_rrf_k + rank)
+        
+        # 只保留相似度大于阈值的结果，按融合分数排序（未启用混合检索时即向量相似度顺序）
+        ranked = sorted(
+            (candidate for candidate in candidates.values()
+             if candidate["similarity_score"] >= similarity_threshold),
+            key=lambda candidate: (candidate["rrf_score"], candidate["similarity_score"]),
+            reverse=True
+        )[:k]
+        results = [
+            self._stage_result(candidate["content"], candidate["metadata"], candidate["similarity_score"],
+                               candidate["raw_distance"], candidate["source"], candidate["rrf_score"])
+            for candidate in ranked
+        ]
+        
+        return self._similar_stages_response(query, similarity_threshold, results,
+                                             "hybrid" if lexical_hits else "vector")
+    
+    def _lexical_search(self, query: str, k: int, where: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """BM25词法检索，结果附带查询在阶段名称和描述中的字符覆盖率"""
+        index = get_lexical_index(self.collection_name, self.vector_store)
+        hits = []
+        for row, score in index.search(query, k, where):
+            hits.append({
+                "id": index.ids[row],
+                "content": index.documents[row],
+                "metadata": index.metadatas[row],
+                "bm25_score": score,
+                "lexical_overlap": round(lexical_overlap(query, index.texts[row]), 4)
+            })
+        return hits
+    
+    @staticmethod
+    def stage_doc_id(video_id: int, stage_index: int, product_name: str) -> str:
+        """阶段文档在向量集合中的ID"""
+        return f"video_{video_id}_stage_{stage_index}_{product_name}"
+    
+    @staticmethod
+    def summary_doc_id(video_id: int, product_name: str) -> str:
+        """视频摘要文档在向量集合中的ID"""
+        return f"video_{video_id}_summary_{product_name}"
+    
+    @staticmethod
+    def build_video_summary(stages: List[str], descriptions: List[str]) -> str:
+        """由各阶段名称和描述拼接视频摘要文本，超出长度时截断"""
+        summary = "\n".join(f"{stage}: {description}" for stage, description in zip(stages, descriptions))
+        return summary[:settings.video_summary_max_chars]
+    
+    @classmethod
+    def _document_key(cls, doc_id: Optional[str], metadata: Dict[str, Any]) -> str:
+        """融合两路结果时用的文档键，缺少ID时按存储时的ID规则构造"""
+        if doc_id:
+            return doc_id
+        return cls.stage_doc_id(metadata.get("video_id"), metadata.get("stage_index"), metadata.get("product_name"))
+    
+    @staticmethod
+    def _stage_result(content: str, metadata: Dict[str, Any], similarity_score: float,
+                      raw_distance: Optional[float], match_source: str,
+                      rrf_score: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            "video_id": metadata.get("video_id"),
+            "stage_id": metadata.get("stage_id"),
+            "stage_name": metadata.get("stage_name"),
+            "time_range": metadata.get("time_range"),
+            "product_name": metadata.get("product_name"),
+            "video_filename": metadata.get("video_filename"),
+            "content": content,
+            "stage_index": metadata.get("stage_index"),
+            "similarity_score": similarity_score,
+            "raw_distance": raw_distance,
+            "match_source": match_source,
+            "rrf_score": round(rrf_score, 6) if rrf_score is not None else None
+        }
+    
+    @staticmethod
+    def _similar_stages_response(query: str, similarity_threshold: float, results: List[Dict[str, Any]],
+                                 retrieval_mode: str) -> Dict[str, Any]:
+        return {
+            "success": True,
+            "query": query,
+            "similarity_threshold": similarity_threshold,
+            "retrieval_mode": retrieval_mode,
+            "total_results": len(results),
+            "results": results
+        }
+    
+    def query_report_stages(self, query: str, product_name: Optional[str] = None, k: int = 10,
+                            similarity_threshold: float = 0.7,
+                            query_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """对比报告使用的相似阶段（两级检索）
+        
+        1. 先在视频摘要向量中检索，按产品轮流选出候选视频，避免同一产品的相近阶段占满上下文
+        2. 只在候选视频的阶段中检索，每个视频最多保留 two_level_max_stages_per_video 个阶段
+        
+        未启用两级检索或还没有摘要文档（摘要上线前存储、尚未重建索引的数据）时退回单级检索。
+        """
+        if not settings.two_level_retrieval_enabled:
+            return self.query_similar_stages(query, product_name, k=k, similarity_threshold=similarity_threshold,
+                                             query_embedding=query_embedding)
+        try:
+            if query_embedding is None:
+                query_embedding = self.embeddings.embed_query(query)
+            
+            summary_hits = self.vector_store.search_by_vector(
+                query_embedding,
+                k=settings.two_level_summary_candidates,
+                where=self.build_metadata_filter(analysis_type="video_summary", product_name=product_name or None)
+            )
+            video_ids = self._spread_videos(summary_hits, settings.two_level_candidate_videos)
+            if not video_ids:
+                return self.query_similar_stages(query, product_name, k=k, similarity_threshold=similarity_threshold,
+                                                 query_embedding=query_embedding)
+            
+            per_video = max(1, settings.two_level_max_stages_per_video)
+            similar_results = self.query_similar_stages(
+                query, product_name, k=len(video_ids) * per_video * 2, similarity_threshold=similarity_threshold,
+                query_embedding=query_embedding, video_ids=video_ids
+            )
+            if not similar_results["success"]:
+                return similar_results
+            
+            stage_counts: Dict[Any, int] = {}
+            results = []
+            for result in similar_results["results"]:
+                if stage_counts.get(result["video_id"], 0) >= per_video:
+                    continue
+                stage_counts[result["video_id"]] = stage_counts.get(result["video_id"], 0) + 1
+                results.append(result)
+                if len(results) >= k:
+                    break
+            
+            response = self._similar_stages_response(query, similarity_threshold, results,
+                                                     f"two_level_{similar_results['retrieval_mode']}")
+            response["candidate_videos"] = video_ids
+            return response
+            
         except Exception as e:
             return {
                 "success": False,
@@ -246,7 +488,25 @@ class VideoRAGService:
                 "message": f"查询失败: {str(e)}"
             }
     
-
+    @staticmethod
+    def _spread_videos(summary_hits, limit: int) -> List[int]:
+        """从按距离排序的摘要结果中按产品轮流选出候选视频"""
+        by_product: Dict[str, List[int]] = {}
+        for doc, _ in summary_hits:
+            videos = by_product.setdefault(doc.metadata.get("product_name", ""), [])
+            if doc.metadata.get("video_id") not in videos:
+                videos.append(doc.metadata.get("video_id"))
+        
+        # 产品按各自最相近的视频排序，每轮从每个产品取一个视频
+        queues = list(by_product.values())
+        video_ids: List[int] = []
+        while len(video_ids) < limit and any(queues):
+            for videos in queues:
+                if videos and len(video_ids) < limit:
+                    video_id = videos.pop(0)
+                    if video_id not in video_ids:
+                        video_ids.append(video_id)
+        return video_ids
     
     def generate_comparison_report(self, query: str, product_name: Optional[str] = None, similarity_threshold: float = 0.7) -> Dict[str, Any]:
         """生成对比分析报告
@@ -260,8 +520,31 @@ class VideoRAGService:
             生成的报告
         """
         try:
+            cache_key = self._report_cache_key(query, product_name, similarity_threshold)
+            cached_report = self.report_cache.get(cache_key)
+            if cached_report is not None:
+                return {
+                    "success": True,
+                    "query": query,
+                    **cached_report,
+                    "cached": True,
+                    "cache_type": "exact"
+                }
+            
+            query_vector, semantic_report = self._lookup_semantic_report(query, product_name, similarity_threshold)
+            if semantic_report is not None:
+                return {
+                    "success": True,
+                    "query": query,
+                    **semantic_report,
+                    "cached": True,
+                    "cache_type": "semantic"
+                }
+            
             # 查询相似阶段，使用相似度阈值过滤
-            similar_results = self.query_similar_stages(query, product_name, k=10, similarity_threshold=similarity_threshold)
+            similar_results = self.query_report_stages(
+                query, product_name, k=10, similarity_threshold=similarity_threshold, query_embedding=query_vector
+            )
             
             if not similar_results["success"] or not similar_results["results"]:
                 return {
@@ -301,15 +584,27 @@ class VideoRAGService:
             
             # 生成报告
             messages = prompt.invoke({"query": query, "context": context})
-            response = self.llm.invoke(messages)
+            response = self.gateway.call(
+                self.llm.model_name,
+                lambda: self.llm.invoke(messages),
+                caller="comparison_report"
+            )
             
-            return {
-                "success": True,
-                "query": query,
+            report = {
                 "report": response.content,
                 "source_count": len(similar_results["results"]),
                 "sources": similar_results["results"]
             }
+            self.report_cache.set(cache_key, report)
+            if query_vector is not None:
+                self.semantic_cache.store(query, query_vector, product_name, similarity_threshold, report)
+            
+            return {
+                "success": True,
+                "query": query,
+                **report,
+                "cached": False
+            }
             
         except Exception as e:
             return {
@@ -330,8 +625,21 @@ class VideoRAGService:
             流式返回的报告内容
         """
         try:
+            cache_key = self._report_cache_key(query, product_name, similarity_threshold)
+            cached_report = self.report_cache.get(cache_key)
+            if cached_report is not None:
+                yield from self._replay_cached_report(query, cached_report, "exact")
+                return
+            
+            query_vector, semantic_report = self._lookup_semantic_report(query, product_name, similarity_threshold)
+            if semantic_report is not None:
+                yield from self._replay_cached_report(query, semantic_report, "semantic")
+                return
+            
             # 查询相似阶段，使用相似度阈值过滤
-            similar_results = self.query_similar_stages(query, product_name, k=10, similarity_threshold=similarity_threshold)
+            similar_results = self.query_report_stages(
+                query, product_name, k=10, similarity_threshold=similarity_threshold, query_embedding=query_vector
+            )
             
             if not similar_results["success"] or not similar_results["results"]:
                 yield f"data: {json.dumps({'error': '未找到相关的分析结果'}, ensure_ascii=False)}\n\n"
@@ -380,17 +688,34 @@ class VideoRAGService:
             messages = prompt.invoke({"query": query, "context": context})
             
             # 使用流式调用
-            for chunk in self.llm.stream(messages):
+            report_parts = []
+            for chunk in self.gateway.stream(
+                self.llm.model_name,
+                lambda: self.llm.stream(messages),
+                caller="comparison_report_stream"
+            ):
                 if chunk.content:
+                    report_parts.append(chunk.content)
                     chunk_data = {
                         "type": "content",
                         "content": chunk.content
                     }
                     yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
             
+            # 完整生成的报告才写入缓存
+            report = {
+                "report": "".join(report_parts),
+                "source_count": len(similar_results["results"]),
+                "sources": similar_results["results"]
+            }
+            self.report_cache.set(cache_key, report)
+            if query_vector is not None:
+                self.semantic_cache.store(query, query_vector, product_name, similarity_threshold, report)
+            
             # 发送完成信号
             complete_data = {
-                "type": "complete"
+                "type": "complete",
+                "cached": False
             }
             yield f"data: {json.dumps(complete_data, ensure_ascii=False)}\n\n"
             
@@ -402,6 +727,130 @@ class VideoRAGService:
             }
             yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
     
+    def _replay_cached_report(self, query: str, cached_report: Dict[str, Any], cache_type: str):
+        """以与实时生成相同的SSE事件序列回放缓存的报告"""
+        initial_data = {
+            "type": "init",
+            "query": query,
+            "source_count": cached_report["source_count"],
+            "sources": cached_report["sources"],
+            "cached": True,
+            "cache_type": cache_type
+        }
+        if "matched_query" in cached_report:
+            initial_data["matched_query"] = cached_report["matched_query"]
+        yield f"data: {json.dumps(initial_data, ensure_ascii=False)}\n\n"
+        
+        report = cached_report["report"]
+        chunk_size = max(1, settings.comparison_report_replay_chunk_size)
+        for start in range(0, len(report), chunk_size):
+            chunk_data = {
+                "type": "content",
+                "content": report[start:start + chunk_size]
+            }
+            yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
+        
+        complete_data = {
+            "type": "complete",
+            "cached": True
+        }
+        yield f"data: {json.dumps(complete_data, ensure_ascii=False)}\n\n"
+    
+    @staticmethod
+    def build_metadata_filter(**conditions) -> Optional[Dict[str, Any]]:
+        """由字段等值条件构建Chroma的where子句，值为None的条件忽略
+        
+        例: build_metadata_filter(video_id=1, product_name="抖音")
+        """
+        clauses = [{key: {"$eq": value}} for key, value in conditions.items() if value is not None]
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    
+    def count_documents(self, where: Optional[Dict[str, Any]] = None) -> int:
+        """按元数据条件统计文档数（不计算向量）"""
+        if where is None:
+            return self.vector_store.count()
+        return len(self.vector_store.get(where=where, include=[])["ids"])
+    
+    def list_documents(self, where: Optional[Dict[str, Any]] = None, limit: int = 100,
+                       offset: int = 0) -> Dict[str, Any]:
+        """按元数据条件分页列出文档（不计算向量）
+        
+        Returns:
+            {"total", "limit", "offset", "items": [{"id", "content", "metadata"}]}
+        """
+        result = self.vector_store.get(
+            where=where, limit=limit, offset=offset, include=["documents", "metadatas"]
+        )
+        items = [
+            {"id": doc_id, "content": content, "metadata": metadata}
+            for doc_id, content, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        ]
+        return {
+            "total": self.count_documents(where),
+            "limit": limit,
+            "offset": offset,
+            "items": items
+        }
+    
+    def delete_documents(self, where: Dict[str, Any]) -> int:
+        """按元数据条件删除全部匹配的文档，返回删除数量
+        
+        where 不能为空，清空整个集合请直接删除集合。
+        """
+        if not where:
+            raise ValueError("删除条件不能为空")
+        
+        doc_ids = self.vector_store.get(where=where, include=[])["ids"]
+        for start in range(0, len(doc_ids), DELETE_BATCH_SIZE):
+            self.vector_store.delete(ids=doc_ids[start:start + DELETE_BATCH_SIZE])
+        
+        if doc_ids:
+            bump_corpus_version(self.collection_name)
+            invalidate_lexical_index(self.collection_name, doc_ids)
+        return len(doc_ids)
+    
+    def reassign_video_documents(self, video_id: int, new_video_id: int,
+                                 video_filename: Optional[str] = None) -> int:
+        """把视频的全部向量文档改挂到另一个视频ID下，返回迁移的文档数
+        
+        源文件被删除、由重复上传的记录接替时调用。文档ID中包含视频ID，
+        因此沿用已存储的向量按新ID重新写入，再删除旧文档。
+        """
+        documents = self.vector_store.get(
+            where=self.build_metadata_filter(video_id=video_id),
+            include=["documents", "metadatas", "embeddings"]
+        )
+        if not documents["ids"]:
+            return 0
+        
+        new_ids, metadatas = [], []
+        for metadata in documents["metadatas"]:
+            metadata = dict(metadata or {}, video_id=new_video_id)
+            if video_filename:
+                metadata["video_filename"] = video_filename
+            if metadata.get("analysis_type") == "video_summary":
+                new_ids.append(self.summary_doc_id(new_video_id, metadata.get("product_name")))
+            else:
+                new_ids.append(self.stage_doc_id(new_video_id, metadata.get("stage_index"),
+                                                 metadata.get("product_name")))
+            metadatas.append(metadata)
+        
+        self.vector_store.add_texts(
+            documents["documents"],
+            metadatas=metadatas,
+            ids=new_ids,
+            embeddings=[list(vector) for vector in documents["embeddings"]]
+        )
+        stale_ids = [doc_id for doc_id in documents["ids"] if doc_id not in set(new_ids)]
+        for start in range(0, len(stale_ids), DELETE_BATCH_SIZE):
+            self.vector_store.delete(ids=stale_ids[start:start + DELETE_BATCH_SIZE])
+        
+        bump_corpus_version(self.collection_name)
+        invalidate_lexical_index(self.collection_name, stale_ids)
+        return len(new_ids)
+    
     def delete_video_analysis_from_vector_store(self, video_id: int, product_name: Optional[str] = None) -> Dict[str, Any]:
         """从向量数据库中删除视频分析数据
         
@@ -413,50 +862,8 @@ class VideoRAGService:
             删除结果
         """
         try:
-            # 构建过滤条件
-            filter_conditions = [{"video_id": {"$eq": video_id}}]
-            if product_name:
-                filter_conditions.append({"product_name": {"$eq": product_name}})
-            
-            filter_dict = {"$and": filter_conditions} if len(filter_conditions) > 1 else filter_conditions[0]
-            
-            # 查找要删除的文档
-            docs_to_delete = self.vector_store.similarity_search(
-                "阶段",  # 使用有效查询字符串，主要依靠filter
-                k=100,  # 获取足够多的结果
-                filter=filter_dict
-            )
-            
-            # 实际执行删除操作
-            deleted_count = 0
-            if docs_to_delete:
-                # 方法1：如果使用的是支持按ID删除的向量存储
-                try:
-                    # 构建要删除的文档ID列表
-                    doc_ids = []
-                    for i, doc in enumerate(docs_to_delete):
-                        # 根据存储时的ID格式构建ID
-                        stage_index = doc.metadata.get('stage_index', i)
-                        doc_id = f"video_{video_id}_stage_{stage_index}_{product_name or doc.metadata.get('product_name', '')}"
-                        doc_ids.append(doc_id)
-                    
-                    # 执行批量删除
-                    if hasattr(self.vector_store, 'delete'):
-                        self.vector_store.delete(ids=doc_ids)
-                        deleted_count = len(doc_ids)
-                    elif hasattr(self.vector_store, '_collection'):
-                        # 直接操作Chroma collection
-                        self.vector_store._collection.delete(ids=doc_ids)
-                        deleted_count = len(doc_ids)
-                    else:
-                        # 如果没有直接删除方法，记录警告
-                        print(f"警告：向量存储不支持直接删除，找到 {len(docs_to_delete)} 个匹配文档")
-                        deleted_count = len(docs_to_delete)  # 标记为已处理
-                        
-                except Exception as delete_error:
-                    print(f"删除操作失败: {delete_error}")
-                    # 方法2：重新创建不包含该视频数据的向量存储（备选方案）
-                    deleted_count = len(docs_to_delete)
+            where = self.build_metadata_filter(video_id=video_id, product_name=product_name)
+            deleted_count = self.delete_documents(where)
             
             return {
                 "success": True,
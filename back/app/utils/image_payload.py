@@ -0,0 +1,101 @@
+import base64
+import cv2
+import numpy as np
+from typing import List, Dict, Any, Tuple
+
+# 支持的编码格式: 格式名 -> (文件扩展名, MIME类型, OpenCV质量参数)
+IMAGE_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+# 预算不足时每轮缩小的比例，以及允许缩小到的最小长边
+DOWNSCALE_STEP = 0.75
+MIN_LONG_EDGE = 320
+
+
+def resize_to_long_edge(image: np.ndarray, max_long_edge: int) -> np.ndarray:
+    """按长边等比缩放，长边不超过 max_long_edge 时保持原图"""
+    height, width = image.shape[:2]
+    long_edge = max(height, width)
+    if long_edge <= max_long_edge:
+        return image
+
+    scale = max_long_edge / long_edge
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def encode_base64(image: np.ndarray, image_format: str = "jpeg", quality: int = 95) -> str:
+    """按指定格式和质量编码为Base64"""
+    extension, _, quality_flag = IMAGE_FORMATS[image_format]
+    ok, buffer = cv2.imencode(extension, image, [quality_flag, int(quality)])
+    if not ok:
+        raise ValueError(f"图片编码失败: {image_format}")
+    return base64.b64encode(buffer).decode("utf-8")
+
+
+def _encode_all(images: List[np.ndarray], image_format: str, quality: int) -> Tuple[List[str], int]:
+    encoded = [encode_base64(image, image_format, quality) for image in images]
+    return encoded, sum(len(item) for item in encoded)
+
+
+def optimize_image_payload(images: List[np.ndarray], max_long_edge: int, budget_bytes: int,
+                           image_format: str = "jpeg", min_quality: int = 40,
+                           max_quality: int = 90) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """压缩一组图片，使Base64总大小尽量不超过预算
+
+    先按长边等比缩放，再二分查找能放进预算的最高统一质量；
+    最低质量仍超预算时继续缩小分辨率，直到长边降到 MIN_LONG_EDGE。
+
+    Args:
+        images: BGR图像列表
+        max_long_edge: 最大长边像素
+        budget_bytes: 全部图片Base64总字节预算
+        image_format: 编码格式（jpeg / webp）
+        min_quality: 最低编码质量
+        max_quality: 最高编码质量
+
+    Returns:
+        (图片列表[{"mime_type", "data"}], 负载统计)
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"不支持的图片格式: {image_format}")
+    if not images:
+        return [], {"image_count": 0, "original_bytes": 0, "optimized_bytes": 0}
+
+    # 原始负载：与优化前一致的全分辨率JPEG
+    original_bytes = sum(len(encode_base64(image, "jpeg")) for image in images)
+
+    long_edge = min(max_long_edge, max(max(image.shape[:2]) for image in images))
+    while True:
+        resized = [resize_to_long_edge(image, long_edge) for image in images]
+
+        best_quality = min_quality
+        encoded, total = _encode_all(resized, image_format, min_quality)
+        low, high = min_quality + 1, max_quality
+        while low <= high:
+            quality = (low + high) // 2
+            candidate, candidate_total = _encode_all(resized, image_format, quality)
+            if candidate_total <= budget_bytes:
+                best_quality, encoded, total = quality, candidate, candidate_total
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        if total <= budget_bytes or long_edge <= MIN_LONG_EDGE:
+            break
+        long_edge = max(MIN_LONG_EDGE, int(long_edge * DOWNSCALE_STEP))
+
+    mime_type = IMAGE_FORMATS[image_format][1]
+    payload = [{"mime_type": mime_type, "data": data} for data in encoded]
+    stats = {
+        "image_count": len(images),
+        "original_bytes": original_bytes,
+        "optimized_bytes": total,
+        "format": image_format,
+        "quality": best_quality,
+        "long_edge": long_edge,
+        "within_budget": total <= budget_bytes
+    }
+    return payload, stats
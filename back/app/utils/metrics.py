@@ -0,0 +1,75 @@
+"""进程内指标注册表，以Prometheus文本格式导出"""
+
+import threading
+from typing import Dict, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """线程安全的计数器和汇总指标注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._summaries: Dict[str, Dict[LabelKey, Tuple[int, float]]] = {}
+        self._descriptions: Dict[str, str] = {}
+
+    @staticmethod
+    def _label_key(labels: Dict[str, str]) -> LabelKey:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def describe(self, name: str, description: str):
+        """登记指标说明"""
+        self._descriptions[name] = description
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """计数器累加"""
+        key = self._label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """记录一次观测值（导出为 _count 和 _sum）"""
+        key = self._label_key(labels)
+        with self._lock:
+            series = self._summaries.setdefault(name, {})
+            count, total = series.get(key, (0, 0.0))
+            series[key] = (count + 1, total + value)
+
+    def get_counter(self, name: str, **labels) -> float:
+        """读取计数器当前值"""
+        with self._lock:
+            return self._counters.get(name, {}).get(self._label_key(labels), 0.0)
+
+    @staticmethod
+    def _format_labels(key: LabelKey) -> str:
+        if not key:
+            return ""
+        parts = [f'{name}="{value}"' for name, value in key]
+        return "{" + ",".join(parts) + "}"
+
+    def render_prometheus(self) -> str:
+        """导出为Prometheus文本格式"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._descriptions:
+                    lines.append(f"# HELP {name} {self._descriptions[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{self._format_labels(key)} {value}")
+            for name, series in sorted(self._summaries.items()):
+                if name in self._descriptions:
+                    lines.append(f"# HELP {name} {self._descriptions[name]}")
+                lines.append(f"# TYPE {name} summary")
+                for key, (count, total) in series.items():
+                    labels = self._format_labels(key)
+                    lines.append(f"{name}_count{labels} {count}")
+                    lines.append(f"{name}_sum{labels} {total}")
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表
+metrics = MetricsRegistry()
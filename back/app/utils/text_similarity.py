@@ -0,0 +1,68 @@
+import re
+import unicodedata
+import numpy as np
+from typing import List, Sequence, Set
+
+# 去除空白和标点，只保留文字和数字参与字符n-gram匹配
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """小写化并去除空白和标点"""
+    return _NON_WORD.sub("", (text or "").lower())
+
+
+def normalize_query(text: str) -> str:
+    """规范化查询文本用于缓存键：统一全半角和大小写，合并空白"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return " ".join(text.split())
+
+
+def char_ngrams(text: str, n: int = 2) -> Set[str]:
+    """字符n-gram集合；文本短于n时返回整个文本"""
+    text = normalize_text(text)
+    if not text:
+        return set()
+    if len(text) < n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def lexical_overlap(query: str, text: str, n: int = 2) -> float:
+    """查询在文本中的字符n-gram覆盖率（0~1）
+
+    查询整体出现在文本中时直接记为1，适合“登录”这类短查询。
+    """
+    normalized_query = normalize_text(query)
+    if not normalized_query:
+        return 0.0
+    if normalized_query in normalize_text(text):
+        return 1.0
+    query_grams = char_ngrams(normalized_query, n)
+    if not query_grams:
+        return 0.0
+    return len(query_grams & char_ngrams(text, n)) / len(query_grams)
+
+
+def embedding_to_bytes(vector: Sequence[float]) -> bytes:
+    """向量序列化为float32字节串"""
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def embedding_from_bytes(data: bytes) -> np.ndarray:
+    """从float32字节串还原向量"""
+    return np.frombuffer(data, dtype=np.float32)
+
+
+def cosine_scores(query: Sequence[float], matrix: np.ndarray) -> np.ndarray:
+    """查询向量与矩阵每一行的余弦相似度"""
+    query = np.asarray(query, dtype=np.float32)
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = 1.0
+    return matrix @ query / norms
+
+
+def stack_embeddings(blobs: List[bytes]) -> np.ndarray:
+    """将多个序列化向量堆叠为矩阵"""
+    return np.vstack([embedding_from_bytes(blob) for blob in blobs])
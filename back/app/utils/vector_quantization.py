@@ -0,0 +1,168 @@
+"""向量量化：int8标量量化和乘积量化（PQ），用于第一轮近似检索"""
+
+from typing import Dict, Optional
+import numpy as np
+
+# k-means训练的迭代次数和每个子空间的聚类数上限
+KMEANS_ITERATIONS = 12
+PQ_CENTROIDS = 256
+# 计算近似距离时每批的行数，避免一次性把全部编码展开为浮点数
+DISTANCE_CHUNK_ROWS = 8192
+
+
+def _kmeans(data: np.ndarray, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """简单的k-means，返回聚类中心"""
+    centroids = data[rng.choice(len(data), size=clusters, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = nearest(data, centroids)
+        for cluster in range(clusters):
+            members = data[labels == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+    return centroids
+
+
+def nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """每行最近的聚类中心下标"""
+    distances = (
+        np.einsum("ij,ij->i", data, data)[:, None]
+        - 2 * data @ centroids.T
+        + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+    )
+    return distances.argmin(axis=1)
+
+
+class Int8Quantizer:
+    """按行对称的int8标量量化：x ≈ scale * code，code ∈ [-127, 127]
+
+    距离近似为 |x|^2 - 2·scale·(code·q) + |q|^2，其中 |x|^2 使用精确值。
+    """
+
+    name = "int8"
+    min_train_size = 0
+
+    def __init__(self):
+        self.codes = np.zeros((0, 0), dtype=np.int8)
+        self.scales = np.zeros(0, dtype=np.float32)
+
+    @property
+    def trained(self) -> bool:
+        return True
+
+    def train(self, sample: np.ndarray):
+        pass
+
+    def encode(self, block: np.ndarray):
+        """追加编码一批向量"""
+        scales = np.abs(block).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(block / scales[:, None]), -127, 127).astype(np.int8)
+        self.codes = codes if not len(self.codes) else np.concatenate([self.codes, codes])
+        self.scales = np.concatenate([self.scales, scales.astype(np.float32)])
+
+    def approximate_distances(self, query: np.ndarray, rows: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        dots = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), DISTANCE_CHUNK_ROWS):
+            chunk = rows[start:start + DISTANCE_CHUNK_ROWS]
+            dots[start:start + len(chunk)] = self.codes[chunk].astype(np.float32) @ query
+        return norms[rows] - 2 * dots * self.scales[rows] + float(query @ query)
+
+    def take(self, rows: np.ndarray):
+        """只保留指定的行（压缩后调用）"""
+        self.codes = self.codes[rows]
+        self.scales = self.scales[rows]
+
+    def __len__(self):
+        return len(self.scales)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codes": self.codes, "scales": self.scales}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        self.codes = state["codes"]
+        self.scales = state["scales"]
+
+
+class ProductQuantizer:
+    """乘积量化：向量切分为若干子向量，每个子空间用256个中心编码为1字节
+
+    检索时对查询预先计算每个子空间到各中心的距离表（ADC），近似距离为查表求和。
+    """
+
+    name = "pq"
+    min_train_size = PQ_CENTROIDS
+
+    def __init__(self, subvectors: int = 64, seed: int = 0):
+        self.requested_subvectors = subvectors
+        self.seed = seed
+        self.codebooks: Optional[np.ndarray] = None  # (子空间数, 中心数, 子向量维度)
+        self.codes = np.zeros((0, 0), dtype=np.uint8)
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def train(self, sample: np.ndarray):
+        """在样本上训练各子空间的中心；维度不能整除时减少子空间数"""
+        dim = sample.shape[1]
+        subvectors = max(1, min(self.requested_subvectors, dim))
+        while dim % subvectors:
+            subvectors -= 1
+        sub_dim = dim // subvectors
+        centroids = min(PQ_CENTROIDS, len(sample))
+
+        rng = np.random.default_rng(self.seed)
+        self.codebooks = np.stack([
+            _kmeans(np.ascontiguousarray(sample[:, j * sub_dim:(j + 1) * sub_dim]), centroids, rng)
+            for j in range(subvectors)
+        ]).astype(np.float32)
+        self.codes = np.zeros((0, subvectors), dtype=np.uint8)
+
+    def encode(self, block: np.ndarray):
+        subvectors, _, sub_dim = self.codebooks.shape
+        codes = np.empty((len(block), subvectors), dtype=np.uint8)
+        for j in range(subvectors):
+            codes[:, j] = nearest(np.ascontiguousarray(block[:, j * sub_dim:(j + 1) * sub_dim]), self.codebooks[j])
+        self.codes = codes if not len(self.codes) else np.concatenate([self.codes, codes])
+
+    def approximate_distances(self, query: np.ndarray, rows: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        subvectors, _, sub_dim = self.codebooks.shape
+        table = ((self.codebooks - query.reshape(subvectors, 1, sub_dim)) ** 2).sum(axis=2)
+        distances = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), DISTANCE_CHUNK_ROWS):
+            chunk = rows[start:start + DISTANCE_CHUNK_ROWS]
+            distances[start:start + len(chunk)] = table[np.arange(subvectors), self.codes[chunk]].sum(axis=1)
+        return distances
+
+    def take(self, rows: np.ndarray):
+        self.codes = self.codes[rows]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        codebook_bytes = self.codebooks.nbytes if self.codebooks is not None else 0
+        return self.codes.nbytes + codebook_bytes
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codes": self.codes, "codebooks": self.codebooks}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        self.codes = state["codes"]
+        self.codebooks = state["codebooks"]
+
+
+def create_quantizer(name: str, pq_subvectors: int = 64):
+    """按名称创建量化器，none 返回None"""
+    if not name or name == "none":
+        return None
+    if name == "int8":
+        return Int8Quantizer()
+    if name == "pq":
+        return ProductQuantizer(pq_subvectors)
+    raise ValueError(f"不支持的量化方式: {name}")
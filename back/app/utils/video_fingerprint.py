@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+from typing import Tuple
+
+# 每个视频采样的帧数，指纹为对应数量的64位感知哈希
+FINGERPRINT_SAMPLES = 16
+HASH_BITS = 64
+
+
+def perceptual_hash(frame: np.ndarray) -> int:
+    """计算单帧的64位感知哈希（DCT pHash）"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:8, :8].flatten()
+
+    # 排除直流分量后取中位数，避免整体亮度影响
+    median = np.median(low_freq[1:])
+    bits = low_freq > median
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def compute_video_fingerprint(video_path: str, samples: int = FINGERPRINT_SAMPLES) -> Tuple[np.ndarray, float]:
+    """按视频时长均匀采样帧，生成感知哈希序列
+
+    Args:
+        video_path: 视频文件路径
+        samples: 采样帧数
+
+    Returns:
+        (uint64哈希序列, 视频时长秒数)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"无法打开视频文件: {video_path}")
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0 or fps <= 0:
+            raise ValueError(f"无法读取视频帧信息: {video_path}")
+
+        hashes = []
+        last_hash = 0
+        for i in range(samples):
+            frame_index = min(total_frames - 1, int((i + 0.5) * total_frames / samples))
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            ret, frame = cap.read()
+            # 读取失败时沿用上一帧的哈希，保持序列长度一致
+            if ret:
+                last_hash = perceptual_hash(frame)
+            hashes.append(last_hash)
+
+        return np.array(hashes, dtype=np.uint64), total_frames / fps
+    finally:
+        cap.release()
+
+
+def signature_to_bytes(signature: np.ndarray) -> bytes:
+    """将哈希序列序列化为字节（小端序）"""
+    return signature.astype("<u8").tobytes()
+
+
+def signature_from_bytes(data: bytes) -> np.ndarray:
+    """从字节反序列化哈希序列"""
+    return np.frombuffer(data, dtype="<u8").astype(np.uint64)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    """按元素统计uint64中置位的比特数"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.int64)
+    as_bytes = values.view(np.uint8).reshape(values.shape + (8,))
+    return np.unpackbits(as_bytes, axis=-1).sum(axis=-1).astype(np.int64)
+
+
+def sequence_distances(query: np.ndarray, candidates: np.ndarray, max_shift: int = 1) -> np.ndarray:
+    """计算查询指纹与候选指纹矩阵之间的归一化汉明距离
+
+    允许前后错位 max_shift 个采样点，以容忍录屏起止时间的轻微差异，取各错位下的最小距离。
+
+    Args:
+        query: 形状为 (samples,) 的查询指纹
+        candidates: 形状为 (n, samples) 的候选指纹矩阵
+        max_shift: 最大错位采样点数
+
+    Returns:
+        形状为 (n,) 的距离数组，取值范围 [0, 1]
+    """
+    if candidates.size == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    samples = query.shape[0]
+    best = np.full(candidates.shape[0], np.inf)
+    for shift in range(-max_shift, max_shift + 1):
+        if abs(shift) >= samples:
+            continue
+        q = query[max(0, shift):samples + min(0, shift)]
+        c = candidates[:, max(0, -shift):samples - max(0, shift)]
+        distances = _popcount(np.bitwise_xor(c, q)).mean(axis=1) / HASH_BITS
+        best = np.minimum(best, distances)
+    return best
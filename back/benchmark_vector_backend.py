@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+向量存储后端基准测试：比较 Chroma 与内存映射索引的写入耗时、检索延迟、召回率和内存占用
+
+召回率以精确检索结果为基准；量化后端（mmap-int8 / mmap-pq）同时报告量化编码占用的内存，
+与未量化时常驻的全精度向量大小对比。
+
+使用合成的聚类向量，不调用Embedding接口。每个后端在独立子进程中运行，内存增量互不影响。
+
+使用方法:
+python benchmark_vector_backend.py --count 20000 --dim 2048 --queries 200
+python benchmark_vector_backend.py --backends mmap mmap-ivf --count 100000
+python benchmark_vector_backend.py --backends mmap mmap-int8 mmap-pq --k 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 后端名称 -> (后端类型, MmapVectorBackend参数)
+BACKENDS = {
+    "chroma": ("chroma", {}),
+    "mmap": ("mmap", {"dtype": "float32"}),
+    "mmap-f16": ("mmap", {"dtype": "float16"}),
+    "mmap-ivf": ("mmap", {"dtype": "float32", "ivf_threshold": 1, "ivf_nprobe": 8}),
+    "mmap-int8": ("mmap", {"dtype": "float32", "quantization": "int8", "rerank_multiplier": 4}),
+    "mmap-pq": ("mmap", {"dtype": "float32", "quantization": "pq", "rerank_multiplier": 10}),
+}
+PRODUCTS = ["抖音", "飞书", "今日头条", "西瓜视频"]
+
+
+def rss_bytes() -> int:
+    """当前进程常驻内存（Linux读取/proc，其他平台退回峰值常驻内存）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def make_dataset(count: int, dim: int, queries: int, seed: int = 0):
+    """围绕若干中心生成的聚类向量，以及从数据附近采样的查询"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, count // 500), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=count)
+    data = centers[labels] + 0.3 * rng.normal(size=(count, dim)).astype(np.float32)
+    query_rows = rng.integers(0, count, size=queries)
+    query_vectors = data[query_rows] + 0.1 * rng.normal(size=(queries, dim)).astype(np.float32)
+    return data, query_vectors
+
+
+def exact_top_k(data: np.ndarray, mask: np.ndarray, query: np.ndarray, k: int) -> set:
+    rows = np.flatnonzero(mask)
+    distances = ((data[rows] - query) ** 2).sum(axis=1)
+    return set(rows[np.argsort(distances)[:k]].tolist())
+
+
+def percentile_ms(values, q) -> float:
+    return round(float(np.percentile(values, q)) * 1000, 3)
+
+
+def run_backend(name: str, args) -> dict:
+    """在当前进程中测试单个后端"""
+    from app.services.vector_backend import ChromaVectorBackend
+    from app.services.mmap_vector_index import MmapVectorBackend
+
+    data, queries = make_dataset(args.count, args.dim, args.queries, args.seed)
+    products = np.array([PRODUCTS[i % len(PRODUCTS)] for i in range(args.count)])
+    ids = [f"doc_{i}" for i in range(args.count)]
+    metadatas = [{"product_name": str(products[i]), "stage_index": i % 10} for i in range(args.count)]
+    texts = [f"阶段描述 {i}" for i in range(args.count)]
+
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    kind, options = BACKENDS[name]
+    baseline = rss_bytes()
+    if kind == "chroma":
+        from langchain_chroma import Chroma
+        backend = ChromaVectorBackend(Chroma(collection_name="bench", persist_directory=workdir), None)
+    else:
+        backend = MmapVectorBackend(workdir, None, **options)
+
+    started = time.perf_counter()
+    for start in range(0, args.count, args.batch_size):
+        end = start + args.batch_size
+        backend.add_texts(texts[start:end], metadatas[start:end], ids[start:end],
+                          embeddings=data[start:end].tolist())
+    insert_seconds = time.perf_counter() - started
+
+    results = {}
+    for label, where in (("no_filter", None), ("product_filter", {"product_name": {"$eq": PRODUCTS[0]}})):
+        mask = np.ones(args.count, dtype=bool) if where is None else products == PRODUCTS[0]
+        backend.search_by_vector(queries[0].tolist(), k=args.k, where=where)  # 预热（IVF训练等）
+        latencies, recalls = [], []
+        for query in queries:
+            started = time.perf_counter()
+            found = backend.search_by_vector(query.tolist(), k=args.k, where=where)
+            latencies.append(time.perf_counter() - started)
+            found_rows = {int(doc.id.split("_")[1]) for doc, _ in found}
+            recalls.append(len(found_rows & exact_top_k(data, mask, query, args.k)) / args.k)
+        results[label] = {
+            "p50_ms": percentile_ms(latencies, 50),
+            "p95_ms": percentile_ms(latencies, 95),
+            f"recall@{args.k}": round(float(np.mean(recalls)), 4)
+        }
+
+    report = {
+        "backend": name,
+        "count": args.count,
+        "dim": args.dim,
+        "insert_seconds": round(insert_seconds, 3),
+        "rss_delta_mb": round((rss_bytes() - baseline) / 1024 / 1024, 1),
+        "disk_mb": round(directory_size(workdir) / 1024 / 1024, 1),
+        "search": results
+    }
+    if kind == "mmap":
+        usage = backend.memory_usage()
+        report["index_memory_mb"] = {key: round(value / 1024 / 1024, 2) for key, value in usage.items()}
+        # 检索时需常驻内存的部分：量化时为量化编码（原始向量只读取重排的候选），否则为全部向量
+        resident = usage["quantized_bytes"] if usage["quantized_bytes"] else usage["vector_bytes"]
+        report["search_memory_mb"] = round((resident + usage["norm_bytes"] + usage["ivf_bytes"]) / 1024 / 1024, 2)
+    return report
+
+
+def print_table(reports, k: int):
+    print(f"\n{'后端':<10} {'写入(s)':>8} {'RSS增量(MB)':>12} {'磁盘(MB)':>9} {'检索内存(MB)':>12} "
+          f"{'p50(ms)':>8} {'p95(ms)':>8} {'召回@' + str(k):>8} {'过滤p50':>8} {'过滤召回':>8}")
+    for report in reports:
+        plain, filtered = report["search"]["no_filter"], report["search"]["product_filter"]
+        print(f"{report['backend']:<10} {report['insert_seconds']:>8} {report['rss_delta_mb']:>12} "
+              f"{report['disk_mb']:>9} {report.get('search_memory_mb', '-'):>12} "
+              f"{plain['p50_ms']:>8} {plain['p95_ms']:>8} "
+              f"{plain[f'recall@{k}']:>8} {filtered['p50_ms']:>8} {filtered[f'recall@{k}']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量存储后端基准测试")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--count", type=int, default=20000, help="向量数")
+    parser.add_argument("--dim", type=int, default=2048, help="向量维度")
+    parser.add_argument("--queries", type=int, default=200, help="查询次数")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批写入的向量数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--single", help=argparse.SUPPRESS)  # 子进程内运行单个后端
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_backend(args.single, args), ensure_ascii=False))
+        return
+
+    reports = []
+    for name in args.backends:
+        print(f"测试 {name} ...")
+        command = [sys.executable, os.path.abspath(__file__), "--single", name,
+                   "--count", str(args.count), "--dim", str(args.dim), "--queries", str(args.queries),
+                   "--k", str(args.k), "--batch-size", str(args.batch_size), "--seed", str(args.seed)]
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            print(f"❌ {name} 测试失败:\n{output.stderr[-2000:]}")
+            continue
+        reports.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print_table(reports, args.k)
+    print("\n详细结果:")
+    print(json.dumps(reports, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
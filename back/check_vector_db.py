@@ -13,7 +13,7 @@ from app.services.video_rag_service import VideoRAGService
 from app.db.database import get_db
 import json
 
-def check_vector_database():
+def check_vector_database(video_id=None, page_size=100):
     """检查向量数据库中的数据"""
     print("=== 向量数据库数据检查工具 ===")
     
@@ -25,21 +25,22 @@ def check_vector_database():
         rag_service = VideoRAGService(db)
         print("✓ RAG服务初始化成功")
         
-        # 获取所有数据（使用有效查询字符串）
+        # 按元数据分页列出全部数据（不计算向量）
         print("\n1. 检查所有存储的数据...")
         try:
-            # 使用一个通用查询词而不是空字符串
-            all_docs = rag_service.vector_store.similarity_search(
-                "阶段",  # 使用通用查询词
-                k=100  # 获取更多结果
-            )
-            
-            if all_docs:
-                print(f"✓ 找到 {len(all_docs)} 条记录")
-                for i, doc in enumerate(all_docs):
-                    print(f"\n记录 {i+1}:")
-                    print(f"  内容: {doc.page_content[:100]}...")
-                    print(f"  元数据: {json.dumps(doc.metadata, ensure_ascii=False, indent=2)}")
+            total = rag_service.count_documents()
+            if total:
+                print(f"✓ 找到 {total} 条记录")
+                offset = 0
+                while offset < total:
+                    page = rag_service.list_documents(limit=page_size, offset=offset)
+                    if not page["items"]:
+                        break
+                    for i, item in enumerate(page["items"], offset + 1):
+                        print(f"\n记录 {i} ({item['id']}):")
+                        print(f"  内容: {(item['content'] or '')[:100]}...")
+                        print(f"  元数据: {json.dumps(item['metadata'], ensure_ascii=False, indent=2)}")
+                    offset += len(page["items"])
             else:
                 print("❌ 向量数据库中没有找到任何数据")
         except Exception as e:
@@ -48,25 +49,22 @@ def check_vector_database():
         # 飞书相关测试已删除
         
         # 检查特定视频ID的数据
-        print("\n3. 检查视频ID=2的数据...")
-        try:
-            # 使用有效查询字符串和filter
-            video2_docs = rag_service.vector_store.similarity_search(
-                "视频阶段",  # 使用有效查询字符串
-                k=50,
-                filter={"video_id": {"$eq": 2}}
-            )
-            
-            if video2_docs:
-                print(f"✓ 视频ID=2 找到 {len(video2_docs)} 条记录")
-                for i, doc in enumerate(video2_docs):
-                    print(f"\n视频2记录 {i+1}:")
-                    print(f"  内容: {doc.page_content}")
-                    print(f"  元数据: {json.dumps(doc.metadata, ensure_ascii=False, indent=2)}")
-            else:
-                print("❌ 视频ID=2 没有找到数据")
-        except Exception as e:
-            print(f"❌ 查询视频ID=2数据失败: {str(e)}")
+        if video_id is not None:
+            print(f"\n3. 检查视频ID={video_id}的数据...")
+            try:
+                where = rag_service.build_metadata_filter(video_id=video_id)
+                video_docs = rag_service.list_documents(where=where, limit=page_size)
+                
+                if video_docs["total"]:
+                    print(f"✓ 视频ID={video_id} 找到 {video_docs['total']} 条记录")
+                    for i, item in enumerate(video_docs["items"]):
+                        print(f"\n视频{video_id}记录 {i+1}:")
+                        print(f"  内容: {item['content']}")
+                        print(f"  元数据: {json.dumps(item['metadata'], ensure_ascii=False, indent=2)}")
+                else:
+                    print(f"❌ 视频ID={video_id} 没有找到数据")
+            except Exception as e:
+                print(f"❌ 查询视频ID={video_id}数据失败: {str(e)}")
         
         # 测试不同的查询方式
         print("\n4. 测试语义查询...")
@@ -130,10 +128,12 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description="向量数据库检查工具")
     parser.add_argument("--clear", action="store_true", help="清空向量数据库")
+    parser.add_argument("--video-id", type=int, help="额外检查指定视频的数据")
+    parser.add_argument("--page-size", type=int, default=100, help="分页列出时每页的记录数")
     
     args = parser.parse_args()
     
     if args.clear:
         clear_vector_database()
     else:
-        check_vector_database()
\ No newline at end of file
+        check_vector_database(args.video_id, args.page_size)
\ No newline at end of file
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+本地模型替身服务器（离线压测和基准测试用）
+
+提供与 Ark OpenAI 兼容协议一致的对话（含流式）和 Embedding 接口，以及飞书文档接口的最小实现。
+对话返回可被分析流程正常解析的确定性结果，Embedding 为基于字符 n-gram 哈希的确定性向量。
+
+模式:
+- synthetic: 全部响应在本地合成（默认）
+- record:    转发到真实服务并把响应记录到文件，同时返回真实响应
+- replay:    按请求内容回放记录的响应，未记录的请求退回本地合成
+
+使用方法:
+python local_model_server.py --port 8100 --latency-ms 800 --chunk-delay-ms 30
+然后在 .env 中设置 LOCAL_MODEL_SERVER_URL=http://127.0.0.1:8100，所有模型和飞书客户端都会改用该服务器
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_UPSTREAM = "https://ark.cn-beijing.volces.com/api/v3"
+
+# 合成阶段名称（按关键帧顺序循环使用）
+STAGE_NAMES = ["应用启动", "登录", "首页加载", "打开会话", "页面内容加载", "操作完成"]
+
+
+class ServerConfig:
+    """替身服务器运行参数"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.mode = args.mode
+        self.latency_ms = args.latency_ms
+        self.jitter_ms = args.jitter_ms
+        self.per_image_ms = args.per_image_ms
+        self.chunk_delay_ms = args.chunk_delay_ms
+        self.chunk_chars = max(1, args.chunk_chars)
+        self.embedding_dim = args.embedding_dim
+        self.record_file = args.record_file
+        self.upstream = args.upstream.rstrip("/")
+        self.api_key = os.getenv("ARK_API_KEY", "")
+
+
+class RecordStore:
+    """记录/回放文件（JSON Lines，每行一个请求键和响应）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._responses: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        self._responses[item["key"]] = item["response"]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._responses.get(key)
+
+    def put(self, key: str, endpoint: str, response: Dict[str, Any]):
+        with self._lock:
+            self._responses[key] = response
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "endpoint": endpoint, "response": response}, ensure_ascii=False) + "\n")
+
+    def __len__(self):
+        return len(self._responses)
+
+
+def request_key(endpoint: str, body: Dict[str, Any]) -> str:
+    """请求内容的稳定键（忽略是否流式等不影响结果的字段）"""
+    relevant = {k: v for k, v in body.items() if k not in ("stream", "stream_options", "n")}
+    payload = json.dumps([endpoint, relevant], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数（中文约每1.5个字符一个token）"""
+    return max(1, int(len(text) / 1.5))
+
+
+def message_text_and_images(messages: List[Dict[str, Any]]):
+    """提取消息中的全部文本和图片数"""
+    texts = []
+    images = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    texts.append(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    images += 1
+    return "\n".join(texts), images
+
+
+def hash_embedding(text: str, dim: int) -> List[float]:
+    """确定性向量：字符1~2-gram哈希到各维度并带符号累加，再归一化
+
+    相同文本得到相同向量，字面相近的文本向量也相近。
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    normalized = "".join(text.lower().split())
+    grams = list(normalized) + [normalized[i:i + 2] for i in range(len(normalized) - 1)]
+    for gram in grams or [""]:
+        digest = hashlib.md5(gram.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector.tolist()
+
+
+def synthesize_stage_analysis(text: str) -> str:
+    """根据提示词中的关键帧时间合成阶段分析JSON，每个关键帧开始一个阶段"""
+    frame_block = re.search(r"<frame_times>(.*?)</frame_times>", text, re.S)
+    times = [float(value) for value in re.findall(r"(\d+(?:\.\d+)?)ms", frame_block.group(1))] if frame_block else []
+
+    window = re.search(r"片段时间范围: (\d+)ms ~ (\d+)ms", text)
+    total = re.search(r"视频总时长: (\d+)ms", text)
+    if window:
+        start, end = float(window.group(1)), float(window.group(2))
+    else:
+        start, end = 0.0, float(total.group(1)) if total else (times[-1] if times else 1000.0)
+
+    boundaries = sorted({t for t in times if start <= t < end} | {start})
+    stages, time_ranges, descriptions = [], [], []
+    for i, boundary in enumerate(boundaries):
+        stage_end = boundaries[i + 1] if i + 1 < len(boundaries) else end
+        name = STAGE_NAMES[(int(boundary) // 1000 + i) % len(STAGE_NAMES)]
+        stages.append(name)
+        time_ranges.append(f"{boundary:.0f}ms~{stage_end:.0f}ms")
+        descriptions.append(f"{name}阶段，画面在{boundary:.0f}ms发生变化")
+    return json.dumps({"stage": stages, "time": time_ranges, "description": descriptions}, ensure_ascii=False)
+
+
+def _stage_candidates(text: str) -> List[Dict[str, Any]]:
+    candidates = []
+    for block in re.finditer(r"- ID: (\d+)\n- 名称: (.*)\n- 开始时间: ([\d.]+)秒\n- 结束时间: ([\d.]+)秒", text):
+        candidates.append({
+            "stage_id": int(block.group(1)),
+            "name": block.group(2),
+            "start_time": float(block.group(3)),
+            "end_time": float(block.group(4))
+        })
+    return candidates
+
+
+def _best_match(query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if not candidates:
+        return []
+    scored = sorted(
+        candidates,
+        key=lambda item: (len(set(query) & set(item["name"])), -item["stage_id"]),
+        reverse=True
+    )
+    best = scored[0]
+    overlap = len(set(query) & set(best["name"]))
+    return [{
+        "stage_id": best["stage_id"],
+        "start_time": best["start_time"],
+        "end_time": best["end_time"],
+        "similarity_score": round(min(0.95, 0.5 + 0.1 * overlap), 2),
+        "match_reason": f"阶段名称「{best['name']}」与输入有{overlap}个相同字符"
+    }]
+
+
+def synthesize_stage_matching(text: str) -> str:
+    """根据提示词中的阶段列表合成阶段匹配JSON（支持单查询和多查询）"""
+    candidates = _stage_candidates(text)
+    queries = re.findall(r'查询(\d+): "(.*)"', text)
+    if queries:
+        return json.dumps({
+            "results": [
+                {"query_index": int(index), "matched_stages": _best_match(query, candidates), "summary": "本地合成结果"}
+                for index, query in queries
+            ]
+        }, ensure_ascii=False)
+
+    user_input = re.search(r'用户输入: "(.*)"', text)
+    return json.dumps({
+        "matched_stages": _best_match(user_input.group(1) if user_input else "", candidates),
+        "summary": "本地合成结果"
+    }, ensure_ascii=False)
+
+
+def synthesize_report(text: str) -> str:
+    """合成对比报告文本，长度由请求内容决定"""
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    sections = ["相似场景总结", "不同产品/视频的表现对比", "时间效率分析", "关键发现和建议"]
+    lines = []
+    for i, section in enumerate(sections, 1):
+        lines.append(f"## {i}. {section}")
+        for _ in range(rng.randint(2, 4)):
+            lines.append(f"- 本地合成内容 {rng.randint(100, 999)}：各阶段耗时差异约 {rng.randint(5, 40)}%。")
+    return "\n".join(lines)
+
+
+def synthesize_chat(messages: List[Dict[str, Any]]) -> str:
+    text, _ = message_text_and_images(messages)
+    if "<frame_times>" in text:
+        return synthesize_stage_analysis(text)
+    if "matched_stages" in text:
+        return synthesize_stage_matching(text)
+    return synthesize_report(text)
+
+
+def chat_completion(model: str, content: str, prompt_tokens: int) -> Dict[str, Any]:
+    completion_tokens = estimate_tokens(content)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+def create_app(config: ServerConfig) -> FastAPI:
+    app = FastAPI(title="本地模型替身服务器")
+    records = RecordStore(config.record_file) if config.mode in ("record", "replay") else None
+    stats = {"chat": 0, "embeddings": 0, "replay_hits": 0, "replay_misses": 0, "feishu": 0}
+    documents: Dict[str, List[Dict[str, Any]]] = {}
+
+    async def simulate_latency(images: int = 0):
+        delay = config.latency_ms + config.per_image_ms * images
+        if config.jitter_ms:
+            delay += random.uniform(0, config.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    async def forward(endpoint: str, body: Dict[str, Any], authorization: Optional[str]) -> Dict[str, Any]:
+        """记录模式：以非流式请求转发到真实服务"""
+        headers = {"Authorization": authorization or f"Bearer {config.api_key}"}
+        upstream_body = {k: v for k, v in body.items() if k not in ("stream", "stream_options")}
+        async with httpx.AsyncClient(timeout=600) as client:
+            response = await client.post(f"{config.upstream}/{endpoint}", json=upstream_body, headers=headers)
+            response.raise_for_status()
+            return response.json()
+
+    async def resolve(endpoint: str, body: Dict[str, Any], request: Request, synthesize) -> Dict[str, Any]:
+        key = request_key(endpoint, body)
+        if config.mode == "record":
+            response = await forward(endpoint, body, request.headers.get("authorization"))
+            records.put(key, endpoint, response)
+            return response
+        if config.mode == "replay":
+            response = records.get(key)
+            if response is not None:
+                stats["replay_hits"] += 1
+                return response
+            stats["replay_misses"] += 1
+        return synthesize()
+
+    def stream_completion(completion: Dict[str, Any], include_usage: bool):
+        async def generate():
+            content = completion["choices"][0]["message"]["content"] or ""
+            base = {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"]
+            }
+            first = {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+            yield f"data: {json.dumps(first, ensure_ascii=False)}\n\n"
+            for start in range(0, len(content), config.chunk_chars):
+                if config.chunk_delay_ms:
+                    await asyncio.sleep(config.chunk_delay_ms / 1000)
+                chunk = {**base, "choices": [{
+                    "index": 0,
+                    "delta": {"content": content[start:start + config.chunk_chars]},
+                    "finish_reason": None
+                }]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            last = {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(last, ensure_ascii=False)}\n\n"
+            if include_usage:
+                usage = {**base, "choices": [], "usage": completion.get("usage")}
+                yield f"data: {json.dumps(usage, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    @app.post("/api/v3/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["chat"] += 1
+        messages = body.get("messages", [])
+        text, images = message_text_and_images(messages)
+        await simulate_latency(images)
+
+        prompt_tokens = estimate_tokens(text) + images * 1000
+        completion = await resolve(
+            "chat/completions", body, request,
+            lambda: chat_completion(body.get("model", "local"), synthesize_chat(messages), prompt_tokens)
+        )
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return stream_completion(completion, include_usage)
+        return JSONResponse(completion)
+
+    @app.post("/api/v3/embeddings")
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        stats["embeddings"] += 1
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        await simulate_latency()
+
+        def synthesize():
+            tokens = sum(estimate_tokens(text) for text in inputs)
+            return {
+                "object": "list",
+                "model": body.get("model", "local"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": hash_embedding(text, config.embedding_dim)}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            }
+
+        return JSONResponse(await resolve("embeddings", body, request, synthesize))
+
+    # 飞书开放平台接口的最小实现（SimpleFeishuService 使用的部分）
+    @app.post("/open-apis/auth/v3/tenant_access_token/internal")
+    async def feishu_tenant_token():
+        stats["feishu"] += 1
+        return {"code": 0, "msg": "ok", "tenant_access_token": "t-local-token", "expire": 7200}
+
+    @app.post("/open-apis/docx/v1/documents")
+    async def feishu_create_document(request: Request):
+        stats["feishu"] += 1
+        body = await request.json()
+        document_id = uuid.uuid4().hex[:27]
+        documents[document_id] = []
+        return {"code": 0, "msg": "success", "data": {"document": {
+            "document_id": document_id, "revision_id": 1, "title": body.get("title", "")
+        }}}
+
+    @app.get("/open-apis/docx/v1/documents/{document_id}/blocks")
+    async def feishu_list_blocks(document_id: str):
+        stats["feishu"] += 1
+        items = [{"block_id": document_id, "block_type": 1, "children": [], "parent_id": ""}]
+        items.extend(documents.get(document_id, []))
+        return {"code": 0, "msg": "success", "data": {"items": items, "has_more": False}}
+
+    @app.post("/open-apis/docx/v1/documents/{document_id}/blocks/{block_id}/children")
+    async def feishu_create_children(document_id: str, block_id: str, request: Request):
+        stats["feishu"] += 1
+        body = await request.json()
+        children = []
+        for child in body.get("children", []):
+            child = {**child, "block_id": uuid.uuid4().hex[:27], "parent_id": block_id}
+            children.append(child)
+        documents.setdefault(document_id, []).extend(children)
+        return {"code": 0, "msg": "success", "data": {
+            "children": children, "document_revision_id": len(documents[document_id]) + 1
+        }}
+
+    @app.get("/health")
+    async def health():
+        return {
+            "status": "healthy",
+            "mode": config.mode,
+            "recorded_responses": len(records) if records is not None else 0,
+            "requests": stats
+        }
+
+    return app
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="本地模型替身服务器（OpenAI兼容对话/Embedding + 飞书文档接口）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default="synthetic")
+    parser.add_argument("--latency-ms", type=float, default=0, help="每个请求首字节前的固定延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="在固定延迟上叠加的随机延迟上限")
+    parser.add_argument("--per-image-ms", type=float, default=0, help="视觉请求每张图片额外增加的延迟")
+    parser.add_argument("--chunk-delay-ms", type=float, default=20, help="流式响应每个分块之间的延迟")
+    parser.add_argument("--chunk-chars", type=int, default=8, help="流式响应每个分块的字符数")
+    parser.add_argument("--embedding-dim", type=int, default=2048, help="合成向量的维度（与 doubao-embedding-large 一致）")
+    parser.add_argument("--record-file", default="local_model_records.jsonl", help="记录/回放文件")
+    parser.add_argument("--upstream", default=DEFAULT_UPSTREAM, help="记录模式转发的真实服务地址")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(f"本地模型替身服务器: http://{args.host}:{args.port} （模式: {args.mode}）")
+    print(f"在 .env 中设置 LOCAL_MODEL_SERVER_URL=http://{args.host}:{args.port} 以切换所有客户端")
+    uvicorn.run(create_app(ServerConfig(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.api import api_router
 from app.db.database import create_tables
+from app.services.client_registry import get_client_registry, close_client_registry
+from app.services.model_call_recorder import get_model_call_recorder
 import uvicorn
 
 
@@ -13,8 +15,16 @@ async def lifespan(app: FastAPI):
     # 启动时执行
     create_tables()
     print("数据库表创建完成")
+    try:
+        get_client_registry().warm_up()
+        print("模型客户端和向量存储初始化完成")
+    except Exception as e:
+        # 初始化失败时保留懒加载，首次使用时再创建
+        print(f"模型客户端预热失败: {str(e)}")
     yield
     # 关闭时执行
+    get_model_call_recorder().stop()
+    close_client_registry()
     print("应用关闭")
 
 
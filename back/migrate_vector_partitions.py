@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+把未分区的向量集合迁移为按产品分区
+
+逐批读取旧集合中的文档（连同已计算的向量，不重新调用Embedding接口），按 product_name
+写入各产品的分区集合后再从旧集合删除。迁移过程中检索同时覆盖旧集合和分区，服务可以不停机；
+中断后重新运行即可从剩余的文档继续。
+
+运行中的服务进程定期检查分区记录，迁移开始后最多 PARTITION_CHECK_INTERVAL 秒（默认10秒）
+自动改用分区存储（检索和写入），无需重启；在此之前它们只能看到旧集合中尚未迁移的文档。
+使用 mmap 后端时索引文件只应由一个进程写入，请先停止服务再迁移。
+
+使用方法:
+python migrate_vector_partitions.py
+python migrate_vector_partitions.py --batch-size 1000
+python migrate_vector_partitions.py --collection video_analysis
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.db.database import create_tables
+from app.services.client_registry import PARTITION_CHECK_INTERVAL, get_client_registry, close_client_registry
+from app.services.corpus_version import bump_corpus_version
+
+
+def migrate(args):
+    create_tables()
+    registry = get_client_registry()
+    collection = args.collection or registry.collection_name
+    store = registry.get_partitioned_vector_store(collection)
+    legacy = store.legacy
+
+    total = legacy.count()
+    print(f"迁移集合 {collection}: 旧集合中有 {total} 个文档")
+    if not total:
+        print("无需迁移")
+        close_client_registry()
+        return
+
+    started, moved = time.time(), 0
+    try:
+        while True:
+            # 写入分区时会删除旧集合中的同ID文档，因此每次都从头读取
+            page = legacy.get(limit=args.batch_size, offset=0,
+                              include=["documents", "metadatas", "embeddings"])
+            if not page["ids"]:
+                break
+            store.add_texts(page["documents"], metadatas=page["metadatas"], ids=page["ids"],
+                            embeddings=page["embeddings"])
+
+            moved += len(page["ids"])
+            elapsed = max(time.time() - started, 1e-6)
+            print(f"  已迁移 {moved}/{total}，{moved / elapsed:.1f} 文档/秒")
+
+        bump_corpus_version(collection)
+        partitions = store.get(include=[])
+        print(f"✓ 迁移完成: {moved} 个文档，分区内共 {len(partitions['ids'])} 个文档")
+        print(f"运行中的服务会在 {PARTITION_CHECK_INTERVAL:.0f} 秒内自动改用分区存储，无需重启")
+    finally:
+        close_client_registry()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把未分区的向量集合迁移为按产品分区")
+    parser.add_argument("--collection", help="逻辑集合名称（默认为当前使用的集合）")
+    parser.add_argument("--batch-size", type=int, default=500, help="每批迁移的文档数")
+    migrate(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+从数据库重建向量集合
+
+按视频分批读取 video_stages 表中的阶段（产品名称取自该视频的分析记录 video_analysis_runs），
+通过共享的模型网关并发计算向量，写入一个新集合；全部写完后把配置的集合名称原子地切换到新集合。
+每批写入后记录检查点，中断后使用 --resume 从上次完成的视频继续。
+
+使用方法:
+python reindex_vector_store.py
+python reindex_vector_store.py --batch-size 64 --concurrency 4
+python reindex_vector_store.py --resume
+python reindex_vector_store.py --no-switch --target video_analysis_v2
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.db.database import SessionLocal, create_tables
+from app.models import VideoFile, VideoStage, VideoAnalysisRun
+from app.services.client_registry import get_client_registry, close_client_registry
+from app.services.collection_alias import switch_collection
+from app.services.corpus_version import bump_corpus_version
+from app.services.video_rag_service import VideoRAGService
+
+DEFAULT_CHECKPOINT = "reindex_checkpoint.json"
+
+
+def load_checkpoint(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def video_documents(db, video: VideoFile):
+    """一个视频的全部阶段文档和视频摘要文档，每个分析过该视频的产品各一份（与 store_video_analysis 的ID和元数据一致）"""
+    products = [
+        row[0] for row in db.query(VideoAnalysisRun.product_name).filter(
+            VideoAnalysisRun.video_file_id == video.id
+        ).distinct().all()
+    ]
+    stages = db.query(VideoStage).filter(VideoStage.video_file_id == video.id).order_by(VideoStage.id).all()
+
+    documents = []
+    for product_name in products:
+        described = [stage for stage in stages if stage.description]
+        for index, stage in enumerate(stages):
+            if not stage.description:
+                continue
+            documents.append({
+                "id": VideoRAGService.stage_doc_id(video.id, index, product_name),
+                "text": stage.description,
+                "metadata": {
+                    "video_id": video.id,
+                    "stage_id": stage.id,
+                    "stage_name": stage.stage_name,
+                    "time_range": f"{stage.start_time * 1000:.0f}ms~{stage.end_time * 1000:.0f}ms",
+                    "product_name": product_name,
+                    "analysis_type": "video_stage_analysis",
+                    "video_filename": video.filename,
+                    "stage_index": index
+                }
+            })
+        if described:
+            documents.append({
+                "id": VideoRAGService.summary_doc_id(video.id, product_name),
+                "text": VideoRAGService.build_video_summary(
+                    [stage.stage_name for stage in described], [stage.description for stage in described]
+                ),
+                "metadata": {
+                    "video_id": video.id,
+                    "product_name": product_name,
+                    "analysis_type": "video_summary",
+                    "video_filename": video.filename,
+                    "stage_count": len(described)
+                }
+            })
+    return documents
+
+
+def write_window(store, embeddings, executor, documents, batch_size: int) -> int:
+    """把一组文档分批并发计算向量后写入集合"""
+    batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+    vectors = executor.map(lambda batch: embeddings.embed_documents([doc["text"] for doc in batch]), batches)
+    for batch, batch_vectors in zip(batches, vectors):
+        store.add_texts(
+            [doc["text"] for doc in batch],
+            metadatas=[doc["metadata"] for doc in batch],
+            ids=[doc["id"] for doc in batch],
+            embeddings=batch_vectors
+        )
+    return len(documents)
+
+
+def reindex(args):
+    create_tables()
+    registry = get_client_registry()
+    alias = registry.collection_alias
+
+    checkpoint = load_checkpoint(args.checkpoint) if args.resume else None
+    if checkpoint:
+        if checkpoint["alias"] != alias:
+            raise SystemExit(f"检查点属于集合 {checkpoint['alias']}，当前配置为 {alias}")
+        print(f"从检查点继续: 目标集合 {checkpoint['target']}，已完成到视频ID {checkpoint['last_video_id']}")
+    else:
+        if args.resume:
+            print("没有找到检查点，开始新的重建")
+        checkpoint = {
+            "alias": alias,
+            "target": args.target or f"{alias}_{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            "embedding_model": registry.embeddings.model,
+            "last_video_id": 0,
+            "videos_done": 0,
+            "documents_written": 0,
+            "started_at": time.time()
+        }
+        save_checkpoint(args.checkpoint, checkpoint)
+
+    target = checkpoint["target"]
+    store = registry.get_vector_store(target)
+    embeddings = registry.embeddings
+    print(f"重建集合: {alias} -> {target}（模型 {checkpoint['embedding_model']}）")
+
+    db = SessionLocal()
+    executor = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="reindex")
+    try:
+        total_videos = db.query(VideoFile).count()
+        pending_ids = [
+            row[0] for row in db.query(VideoFile.id).filter(
+                VideoFile.id > checkpoint["last_video_id"]
+            ).order_by(VideoFile.id).all()
+        ]
+
+        window_size = args.batch_size * args.concurrency
+        window, window_videos = [], 0
+        session_started, session_documents = time.time(), 0
+
+        def flush(last_video_id: int):
+            nonlocal window, window_videos, session_documents
+            written = write_window(store, embeddings, executor, window, args.batch_size)
+            checkpoint["last_video_id"] = last_video_id
+            checkpoint["videos_done"] += window_videos
+            checkpoint["documents_written"] += written
+            save_checkpoint(args.checkpoint, checkpoint)
+
+            session_documents += written
+            elapsed = max(time.time() - session_started, 1e-6)
+            print(f"  视频 {checkpoint['videos_done']}/{total_videos}，"
+                  f"文档 {checkpoint['documents_written']}，"
+                  f"{session_documents / elapsed:.1f} 文档/秒")
+            window, window_videos = [], 0
+            # 只保留当前窗口的对象，避免长时间运行时会话缓存不断增长
+            db.expunge_all()
+
+        for video_id in pending_ids:
+            video = db.query(VideoFile).filter(VideoFile.id == video_id).first()
+            window.extend(video_documents(db, video))
+            window_videos += 1
+            if len(window) >= window_size:
+                flush(video_id)
+        if window_videos:
+            flush(pending_ids[-1])
+
+        bump_corpus_version(target)
+        elapsed = time.time() - checkpoint["started_at"]
+        print(f"✓ 写入完成: {checkpoint['documents_written']} 个文档，"
+              f"新集合共 {store.count()} 个文档，总耗时 {elapsed:.1f} 秒")
+
+        if args.no_switch:
+            print(f"未切换集合，可稍后重新运行 --resume 或手动切换到 {target}")
+        else:
+            previous = switch_collection(alias, target)
+            print(f"✓ 已切换: {alias} -> {target}（原集合 {previous} 保留，确认无误后可删除）")
+        os.remove(args.checkpoint)
+    finally:
+        executor.shutdown(wait=True)
+        db.close()
+        close_client_registry()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从数据库重建向量集合")
+    parser.add_argument("--batch-size", type=int, default=64, help="每次Embedding请求的文档数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的Embedding请求数")
+    parser.add_argument("--target", help="新集合名称（默认为 <集合名>_<时间戳>）")
+    parser.add_argument("--resume", action="store_true", help="从检查点继续上次中断的重建")
+    parser.add_argument("--no-switch", action="store_true", help="只写入新集合，不切换")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="检查点文件")
+    reindex(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
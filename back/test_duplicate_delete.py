@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试删除重复上传的视频记录
+
+重复上传的记录与源记录共用同一个物理文件，删除重复记录后源文件必须仍然存在；
+删除源记录时文件和分析结果移交给重复记录，文件同样保留。
+使用临时目录和临时数据库，不影响本地数据。
+"""
+
+import asyncio
+import io
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import UploadFile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.datastructures import Headers
+
+from app.db.database import Base
+from app.services.file_service import FileService
+
+
+def _upload(service: FileService, content: bytes, filename: str):
+    upload = UploadFile(file=io.BytesIO(content), filename=filename,
+                        headers=Headers({"content-type": "video/mp4"}))
+    return asyncio.run(service.upload_video_file(upload))
+
+
+def _session(workdir: str):
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'test.db')}",
+                           connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def test_delete_duplicate_keeps_source_file():
+    """删除重复记录不删除源记录的文件"""
+    print("=== 测试删除重复上传记录 ===")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        db = _session(workdir)
+        try:
+            service = FileService(db)
+            content = os.urandom(4096)
+            source = _upload(service, content, "source.mp4")
+            duplicate = _upload(service, content, "duplicate.mp4")
+            assert duplicate.source_file_id == source.id
+            assert duplicate.file_path == source.file_path
+            print("✓ 第二次上传被识别为重复记录")
+
+            assert service.delete_video_file(duplicate.id)
+            assert os.path.exists(source.file_path), "删除重复记录后源文件被删除"
+            print("✓ 删除重复记录后源文件仍然存在")
+
+            duplicate = _upload(service, content, "duplicate.mp4")
+            assert service.delete_video_file(source.id)
+            db.refresh(duplicate)
+            assert duplicate.source_file_id is None
+            assert os.path.exists(duplicate.file_path), "删除源记录后接替记录的文件被删除"
+            print("✓ 删除源记录后文件移交给重复记录")
+
+            assert service.delete_video_file(duplicate.id)
+            assert not os.path.exists(duplicate.file_path)
+            print("✓ 删除最后一个引用后文件被删除")
+        finally:
+            db.close()
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    test_delete_duplicate_keeps_source_file()